@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+=====================================
+Benchmark automatic TTreeCache sizing
+=====================================
+
+This example compares the number of read calls and bytes read when a few
+branches of a tree with many branches are read through a TreeChain with the
+default fixed TTreeCache size and with ``cache_size='auto'`` where the cache
+is sized from the compressed size of a cluster of the branches read and the
+branches learned in the first file are added to the cache of the following
+files before their first entry.
+"""
+print(__doc__)
+import time
+from rootpy.tree import Tree, TreeChain
+from rootpy.io import root_open
+
+num_files = 4
+num_branches = 100
+num_entries = 50000
+names = ['x{0:d}'.format(i) for i in range(num_branches)]
+read = names[:5]
+
+filenames = []
+for i in range(num_files):
+    filename = "test{0:d}.root".format(i)
+    with root_open(filename, "recreate"):
+        tree = Tree("test")
+        tree.create_branches(dict((name, 'F') for name in names))
+        for j in range(num_entries):
+            for name in names:
+                setattr(tree, name, j)
+            tree.fill()
+        tree.write()
+    filenames.append(filename)
+
+
+def loop(cache_size):
+    chain = TreeChain("test", filenames,
+                      cache=True, cache_size=cache_size,
+                      read_branches_on_demand=True, learn_branches=10)
+    start = time.time()
+    total = 0.
+    for event in chain:
+        for name in read:
+            total += getattr(event, name)
+    elapsed = time.time() - start
+    metrics = chain.metrics.total
+    print("{0:>10}: {1:d} read calls, {2:d} bytes, {3:.2f} s".format(
+        str(cache_size), metrics['read_calls'], metrics['bytes_read'],
+        elapsed))
+
+
+loop(30000000)
+loop('auto')
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+==================================
+Benchmark fast access to branches
+==================================
+
+This example compares the cost of accessing the branches of a tree with many
+branches through the TreeBuffer and through the accessor class generated for
+the schema of the TreeBuffer when ``fast_access`` is enabled.
+"""
+print(__doc__)
+import time
+from rootpy.tree import Tree
+from rootpy.io import root_open
+
+num_branches = 50
+num_entries = 10000
+names = ['x{0:d}'.format(i) for i in range(num_branches)]
+
+f = root_open("test.root", "recreate")
+tree = Tree("test")
+tree.create_branches(dict((name, 'F') for name in names))
+for i in range(num_entries):
+    for name in names:
+        setattr(tree, name, i)
+    tree.fill()
+tree.write()
+
+
+def loop(tree):
+    start = time.time()
+    total = 0.
+    for event in tree:
+        for name in names:
+            total += getattr(event, name)
+    return time.time() - start
+
+
+def loop_read(tree):
+    # the time spent reading the entries only
+    start = time.time()
+    for event in tree:
+        pass
+    return time.time() - start
+
+
+tree.create_buffer(fast_access=False)
+read_time = loop_read(tree)
+buffer_time = loop(tree) - read_time
+tree.create_buffer(fast_access=True)
+accessor_time = loop(tree) - read_time
+
+accesses = float(num_branches * num_entries)
+print("TreeBuffer: {0:.3f} us per attribute".format(
+    1e6 * buffer_time / accesses))
+print("accessor:   {0:.3f} us per attribute".format(
+    1e6 * accessor_time / accesses))
+
+f.close()
@@ -18,7 +18,11 @@ if TABLES_NEW_API:
 else:
     tables_open = tables.openFile
 
-from root_numpy import tree2array, RootNumpyUnconvertibleWarning
+from .tree.reader import tree2array, UnconvertibleWarning
+try:
+    from root_numpy import RootNumpyUnconvertibleWarning
+except ImportError:
+    RootNumpyUnconvertibleWarning = UnconvertibleWarning
 from numpy.lib import recfunctions
 
 from .io import root_open, TemporaryFile
@@ -81,7 +85,8 @@ def tree2hdf5(tree, hfile, group=None,
         is converted.
 
     kwargs : dict, optional
-        Additional keyword arguments for the tree2array function.
+        Additional keyword arguments for
+        ``rootpy.tree.reader.tree2array``.
 
     """
     show_progress = show_progress and check_tty(sys.stdout)
@@ -143,6 +148,9 @@ def tree2hdf5(tree, hfile, group=None,
         while start < total_entries or start == 0:
             if start > 0:
                 with warnings.catch_warnings():
+                    warnings.simplefilter(
+                        "ignore",
+                        UnconvertibleWarning)
                     warnings.simplefilter(
                         "ignore",
                         RootNumpyUnconvertibleWarning)
@@ -164,7 +172,7 @@ def tree2hdf5(tree, hfile, group=None,
                     **kwargs)
                 array = _drop_object_col(array)
                 if pbar is not None:
-                    # start after any output from root_numpy
+                    # start after any output from the conversion
                     pbar.start()
                 if TABLES_NEW_API:
                     table = hfile.create_table(
@@ -229,7 +237,8 @@ def root2hdf5(rfile, hfile, rpath='',
         skip such trees.
 
     kwargs : dict, optional
-        Additional keyword arguments for the tree2array function.
+        Additional keyword arguments for
+        ``rootpy.tree.reader.tree2array``.
 
     """
     own_rootfile = False
@@ -21,7 +21,7 @@ from .treetypes import (
 from .tree import Tree, Ntuple
 from .treebuffer import TreeBuffer
 from .treemodel import TreeModel
-from .chain import TreeChain, TreeQueue
+from .chain import TreeChain, TreeQueue, enable_background_io
 from .cut import Cut
 from .categories import Categories
 
@@ -44,6 +44,7 @@ __all__ = [
     'TreeModel',
     'TreeChain',
     'TreeQueue',
+    'enable_background_io',
     'Cut',
     'Categories',
 ]
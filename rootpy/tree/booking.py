@@ -0,0 +1,268 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements the booking of many histograms that are all filled in
+a single pass over a tree (see ``rootpy.tree.Tree.draw_many``) instead of one
+pass per ``Draw``. The expressions, selections and weights use the same
+syntax as ``Draw`` and ``rootpy.tree.Cut`` and are evaluated on batches of
+NumPy columns (see ``rootpy.tree.expression``).
+"""
+from __future__ import absolute_import
+
+import re
+
+import numpy as np
+
+from ..extern.six import string_types
+from ..plotting import Hist, Hist2D, Hist3D
+from .cut import Cut
+from .expression import compile
+
+__all__ = [
+    'HistogramBooking',
+]
+
+# split on ':' but not on '::' as in TMath::Abs
+_DIMENSIONS = re.compile(r'(?<!:):(?!:)')
+
+_HIST_CLASSES = {
+    1: Hist,
+    2: Hist2D,
+    3: Hist3D,
+}
+
+
+def _flatten(values, size):
+    """
+    Return a one-dimensional array of the values of an expression and the
+    index of the entry of each value
+    """
+    values = np.asarray(values)
+    if values.ndim == 0:
+        return np.repeat(values, size), np.arange(size)
+    if values.dtype == object:
+        lengths = np.array([len(row) for row in values], dtype=np.intp)
+        flat = (np.concatenate([np.asarray(row, dtype=np.float64)
+                                for row in values])
+                if len(values) else np.empty(0))
+        return flat, np.repeat(np.arange(size), lengths)
+    if values.ndim > 1:
+        width = int(np.prod(values.shape[1:]))
+        return (values.reshape(-1),
+                np.repeat(np.arange(size), width))
+    return values, np.arange(size)
+
+
+class _Booking(object):
+
+    def __init__(self, expression, selection, weight, hist):
+        self.expression = expression
+        # the axes are given in the order of the histogram axes as in
+        # rootpy.tree.Tree.Draw
+        self.axes = [compile(axis) for axis in
+                     _DIMENSIONS.split(expression)]
+        self.selection = Cut(selection)
+        self.selection_expr = compile(str(self.selection))
+        self.weight = weight
+        self.weight_expr = compile(weight) if weight else None
+        self.hist = hist
+        # include the underflow and overflow bins
+        self.edges = [
+            np.concatenate([[-np.inf], list(hist._edges(axis)), [np.inf]])
+            for axis in range(len(self.axes))]
+        shape = tuple(len(edges) - 1 for edges in self.edges)
+        self.sumw = np.zeros(shape)
+        self.sumw2 = np.zeros(shape)
+        self.entries = 0
+
+    @property
+    def branches(self):
+        branches = set(self.selection_expr.branches)
+        for axis in self.axes:
+            branches.update(axis.branches)
+        if self.weight_expr is not None:
+            branches.update(self.weight_expr.branches)
+        return branches
+
+    def fill(self, batch, tree_weight=1.):
+        size = batch.size
+        # as in TTree::Draw the selection is also a weight
+        selection = np.asarray(self.selection_expr(batch))
+        weights = np.full(size, tree_weight, dtype=np.float64)
+        if self.weight_expr is not None:
+            weights = weights * np.asarray(
+                self.weight_expr(batch), dtype=np.float64)
+        if weights.ndim > 1:
+            raise ValueError("the weight must have one value per entry")
+        values = []
+        entry = None
+        for axis in self.axes:
+            axis_values, axis_entry = _flatten(axis(batch), size)
+            if entry is not None and not np.array_equal(entry, axis_entry):
+                raise ValueError(
+                    "inconsistent number of values in "
+                    "`{0}`".format(self.expression))
+            entry = axis_entry
+            values.append(axis_values.astype(np.float64))
+        weights = weights[entry]
+        if selection.dtype == object or selection.ndim > 1:
+            selection, selection_entry = _flatten(selection, size)
+            if not np.array_equal(selection_entry, entry):
+                # an entry passes if any instance of the selection passes
+                selection = self.selection_expr.mask(batch)[entry]
+        else:
+            selection = selection[entry]
+        # the selection of each instance of an array applies to the same
+        # instance of the values
+        selection = selection.astype(np.float64)
+        selection[np.isnan(selection)] = 0
+        weights = weights * selection
+        keep = weights != 0
+        for axis_values in values:
+            keep &= ~np.isnan(axis_values)
+        values = [axis_values[keep] for axis_values in values]
+        weights = weights[keep]
+        if len(weights) == 0:
+            return
+        sumw, _ = np.histogramdd(
+            np.column_stack(values), bins=self.edges, weights=weights)
+        sumw2, _ = np.histogramdd(
+            np.column_stack(values), bins=self.edges, weights=weights ** 2)
+        self.sumw += sumw
+        self.sumw2 += sumw2
+        self.entries += len(weights)
+
+    def finalize(self):
+        hist = self.hist
+        if not hist.GetSumw2N():
+            hist.Sumw2()
+        entries = hist.GetEntries() + self.entries
+        for index in np.ndindex(*self.sumw.shape):
+            sumw = self.sumw[index]
+            sumw2 = self.sumw2[index]
+            if sumw == 0 and sumw2 == 0:
+                continue
+            bin = hist.GetBin(*index)
+            hist.SetBinContent(bin, hist.GetBinContent(bin) + sumw)
+            hist.SetBinError(
+                bin, np.sqrt(hist.GetBinError(bin) ** 2 + sumw2))
+        # recompute the statistics from the bin contents
+        hist.ResetStats()
+        hist.SetEntries(entries)
+        self.sumw[...] = 0
+        self.sumw2[...] = 0
+        self.entries = 0
+        return hist
+
+
+class HistogramBooking(object):
+    """
+    A set of histograms that are filled together in a single pass over the
+    entries of a tree. Each histogram is booked with an expression as in
+    ``Tree.Draw`` (i.e. 'y:x' for a 2D histogram), a selection and weight.
+
+    .. sourcecode:: python
+
+        >>> booking = HistogramBooking()
+        >>> hpt = booking.book('jet_pt', 'njets>1', binning=(50, 0, 500))
+        >>> h2d = booking.book('jet_eta:jet_phi',
+        ...                    binning=(10, -3, 3, 10, -3, 3))
+        >>> tree.draw_many(booking)
+    """
+    def __init__(self):
+        self.bookings = []
+
+    @classmethod
+    def from_requests(cls, requests):
+        """
+        Create a booking from a list of dicts of the arguments of ``book``
+        or tuples of (expression, selection, weight, binning)
+        """
+        booking = cls()
+        for request in requests:
+            if isinstance(request, dict):
+                booking.book(**request)
+            else:
+                booking.book(*request)
+        return booking
+
+    def book(self, expression, selection=None, weight=None,
+             binning=None, hist=None, name=None):
+        """
+        Book a histogram and return it. The histogram is filled by
+        ``Tree.draw_many``.
+
+        Parameters
+        ----------
+        expression : str
+            The expression with one to three dimensions separated by ':'
+
+        selection : str or rootpy.tree.Cut, optional (default=None)
+            The selection. As in ``Tree.Draw`` the value of the selection is
+            also used as a weight.
+
+        weight : str, optional (default=None)
+            An additional weight expression
+
+        binning : tuple, optional (default=None)
+            The arguments used to create the Hist, Hist2D or Hist3D (i.e.
+            ``(nbins, low, high)`` in one dimension)
+
+        hist : Hist, Hist2D or Hist3D, optional (default=None)
+            Fill this existing histogram instead of creating one
+
+        name : str, optional (default=None)
+            The name of the created histogram
+        """
+        dimension = len(_DIMENSIONS.split(expression))
+        if dimension > 3:
+            raise ValueError(
+                "expression `{0}` has more than three dimensions".format(
+                    expression))
+        if hist is None:
+            if binning is None:
+                raise ValueError("either binning or hist must be specified")
+            kwargs = {}
+            if name is not None:
+                kwargs['name'] = name
+            hist = _HIST_CLASSES[dimension](*binning, **kwargs)
+            hist.SetDirectory(0)
+        elif hist.GetDimension() != dimension:
+            raise ValueError(
+                "expression `{0}` does not match the dimension of "
+                "the histogram".format(expression))
+        if isinstance(weight, string_types) and not weight.strip():
+            weight = None
+        self.bookings.append(_Booking(expression, selection, weight, hist))
+        return hist
+
+    @property
+    def hists(self):
+        """
+        The list of booked histograms in the order they were booked
+        """
+        return [booking.hist for booking in self.bookings]
+
+    @property
+    def branches(self):
+        """
+        The sorted list of branches required by all histograms
+        """
+        branches = set()
+        for booking in self.bookings:
+            branches.update(booking.branches)
+        return sorted(branches)
+
+    def fill(self, batch, weight=1.):
+        """
+        Fill all histograms with a batch of entries where ``weight`` is the
+        weight of the tree
+        """
+        for booking in self.bookings:
+            booking.fill(batch, weight)
+
+    def finalize(self):
+        """
+        Add the accumulated contents to the histograms and return them
+        """
+        return [booking.finalize() for booking in self.bookings]
@@ -0,0 +1,191 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements filling many entries of a tree from NumPy arrays in
+one call (see ``rootpy.tree.Tree.extend``). The values of each entry are
+copied into the TreeBuffer and the tree is filled by a compiled loop so no
+Python code runs per entry.
+"""
+from __future__ import absolute_import
+
+import ctypes
+from array import array
+
+import numpy as np
+
+from .. import compiled as C
+from .treetypes import Scalar, Array, BaseChar
+
+__all__ = [
+    'extend',
+]
+
+C.register_code("""
+#include <cstring>
+#include <TTree.h>
+
+Long64_t rootpy_tree_extend(TTree* tree, Long64_t entries, int ncolumns,
+                            long* sources, long* destinations,
+                            long* sizes, long* offsets)
+{
+    // Copy the values of each entry from the source arrays into the branch
+    // addresses and fill the tree. Variable-length columns have an array
+    // of entries + 1 offsets into the flat source array.
+    Long64_t nbytes = 0;
+    for (Long64_t i = 0; i < entries; ++i) {
+        for (int j = 0; j < ncolumns; ++j) {
+            const char* source = reinterpret_cast<const char*>(sources[j]);
+            char* destination = reinterpret_cast<char*>(destinations[j]);
+            if (offsets[j]) {
+                const Long64_t* offset =
+                    reinterpret_cast<const Long64_t*>(offsets[j]);
+                std::memcpy(destination, source + offset[i] * sizes[j],
+                            (offset[i + 1] - offset[i]) * sizes[j]);
+            } else {
+                std::memcpy(destination, source + i * sizes[j], sizes[j]);
+            }
+        }
+        int n = tree->Fill();
+        if (n < 0) {
+            return -1;
+        }
+        nbytes += n;
+    }
+    return nbytes;
+}
+""", ["rootpy_tree_extend"])
+
+
+def _address(variable):
+    # variables in a TreeRecord point into the record
+    variable = getattr(variable, 'buffer', variable)
+    return ctypes.addressof(ctypes.c_char.from_buffer(variable))
+
+
+def _dtype(variable):
+    if isinstance(variable, BaseChar):
+        return np.dtype(np.uint8)
+    return np.dtype(variable.typecode)
+
+
+def _offsets(name, column):
+    """
+    Return the offsets and flat values of a variable-length column given as
+    a pair of (offsets, values) or an object array of arrays
+    """
+    if isinstance(column, tuple):
+        offsets, values = column
+        offsets = np.asarray(offsets, dtype=np.int64)
+        values = np.asarray(values)
+        if (offsets.ndim != 1 or len(offsets) == 0 or offsets[0] != 0 or
+                offsets[-1] != len(values) or np.any(np.diff(offsets) < 0)):
+            raise ValueError(
+                "invalid offsets for branch `{0}`".format(name))
+        return offsets, values
+    column = np.asarray(column)
+    if column.dtype != object:
+        raise TypeError(
+            "variable-length branch `{0}` requires a pair of "
+            "(offsets, values) or an object array of arrays".format(name))
+    lengths = np.array([len(row) for row in column], dtype=np.int64)
+    offsets = np.zeros(len(column) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if len(column):
+        values = np.concatenate([np.asarray(row) for row in column])
+    else:
+        values = np.empty(0)
+    return offsets, values
+
+
+def extend(tree, arrays):
+    """
+    Fill the entries in ``arrays`` (a dict mapping branch names to arrays of
+    equal length) into ``tree`` and return the number of entries filled.
+    See ``rootpy.tree.Tree.extend``.
+    """
+    treebuffer = tree._buffer
+    arrays = dict(arrays)
+    # keep references to the converted arrays until the tree is filled
+    columns = []
+    sources = array('l')
+    destinations = array('l')
+    sizes = array('l')
+    offsets = array('l')
+    entries = None
+    counters = {}
+    for name, column in arrays.items():
+        if name not in treebuffer:
+            raise KeyError("branch `{0}` is not in the buffer".format(name))
+        variable = treebuffer[name]
+        if not isinstance(variable, (Scalar, Array)):
+            raise TypeError(
+                "only branches of basic types and arrays of basic types "
+                "can be extended, not `{0}`".format(name))
+        dtype = _dtype(variable)
+        length_name = getattr(variable, 'length_name', None)
+        if isinstance(variable, Array) and length_name:
+            offset, values = _offsets(name, column)
+            nentries = len(offset) - 1
+            lengths = np.diff(offset)
+            if len(lengths) and lengths.max() > len(variable):
+                raise ValueError(
+                    "entries of branch `{0}` are longer than its maximum "
+                    "length of {1:d}".format(name, len(variable)))
+            if length_name in counters:
+                if not np.array_equal(counters[length_name], lengths):
+                    raise ValueError(
+                        "inconsistent lengths for the branches using "
+                        "`{0}`".format(length_name))
+            counters[length_name] = lengths
+            values = np.ascontiguousarray(values, dtype=dtype)
+            offset = np.ascontiguousarray(offset)
+            columns.extend([values, offset])
+            offsets.append(offset.ctypes.data)
+            size = dtype.itemsize
+        else:
+            values = np.ascontiguousarray(column, dtype=dtype)
+            nentries = len(values)
+            if isinstance(variable, Array):
+                width = len(variable)
+                valid = (values.ndim > 1 and
+                         int(np.prod(values.shape[1:])) == width)
+            else:
+                width = 1
+                valid = values.ndim == 1
+            if not valid:
+                raise ValueError(
+                    "array of shape {0} does not match branch `{1}`".format(
+                        values.shape, name))
+            columns.append(values)
+            offsets.append(0)
+            size = dtype.itemsize * width
+        if entries is None:
+            entries = nentries
+        elif nentries != entries:
+            raise ValueError(
+                "arrays must have the same number of entries")
+        sources.append(values.ctypes.data)
+        destinations.append(_address(variable))
+        sizes.append(size)
+    # fill the counters of variable-length arrays
+    for length_name, lengths in counters.items():
+        if length_name in arrays:
+            if not np.array_equal(arrays[length_name], lengths):
+                raise ValueError(
+                    "branch `{0}` does not match the lengths of the "
+                    "variable-length arrays".format(length_name))
+            continue
+        variable = treebuffer[length_name]
+        values = np.ascontiguousarray(lengths, dtype=_dtype(variable))
+        columns.append(values)
+        sources.append(values.ctypes.data)
+        destinations.append(_address(variable))
+        sizes.append(values.dtype.itemsize)
+        offsets.append(0)
+    if not entries:
+        return 0
+    nbytes = C.rootpy_tree_extend(
+        tree, entries, len(sources), sources, destinations, sizes, offsets)
+    if nbytes < 0:
+        raise IOError("unable to fill the tree")
+    return entries
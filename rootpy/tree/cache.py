@@ -0,0 +1,204 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements persistent caches of information derived from trees
+that is expensive to compute, such as the entries passing a selection. The
+cached information is stored in the rootpy user-data area and is keyed by the
+identity of the file containing the tree (path, UUID, size and modification
+time) so that it is invalidated when the file changes.
+"""
+from __future__ import absolute_import
+
+import os
+import hashlib
+
+import ROOT
+
+from . import log; log = log[__name__]
+from .. import userdata
+from ..io import root_open, DoesNotExist
+from ..utils.path import mkdir_p
+from ..extern.shortuuid import uuid
+from ..context import thread_specific_tmprootdir
+from .cut import Cut
+
+__all__ = [
+    'tree_fingerprint',
+    'SelectionCache',
+]
+
+CACHE_ROOT = os.path.join(userdata.DATA_ROOT, 'trees')
+
+
+def tree_fingerprint(tree):
+    """
+    Return a tuple identifying a tree and the current version of the file
+    containing it or None if the tree is not stored in a file
+    """
+    directory = tree.GetDirectory()
+    if not directory:
+        return None
+    rfile = directory.GetFile()
+    if not rfile:
+        return None
+    filename = rfile.GetName()
+    fingerprint = [
+        filename,
+        rfile.GetUUID().AsString(),
+        directory.GetPath().split(':', 1)[-1],
+        tree.GetName(),
+    ]
+    if os.path.exists(filename):
+        stat = os.stat(filename)
+        fingerprint[0] = os.path.abspath(filename)
+        fingerprint += [stat.st_size, int(stat.st_mtime)]
+    return tuple(fingerprint)
+
+
+def cache_key(tree, *args):
+    """
+    Return a hash of the tree fingerprint and any additional arguments or
+    None if the tree is not stored in a file
+    """
+    fingerprint = tree_fingerprint(tree)
+    if fingerprint is None:
+        return None
+    return hashlib.sha1(
+        repr(fingerprint + args).encode('utf-8')).hexdigest()
+
+
+def _aliases(tree):
+    """
+    Return the sorted (name, definition) pairs of the aliases of a tree
+    """
+    aliases = tree.GetListOfAliases()
+    if not aliases:
+        return ()
+    return tuple(sorted((alias.GetName(), alias.GetTitle())
+                        for alias in aliases))
+
+
+class SelectionCache(object):
+    """
+    A persistent cache of the entries of trees passing selections. The
+    entries passing a selection are evaluated once and stored as a TEntryList
+    in the cache directory. Subsequent selections with the same (normalized)
+    cut on the same unchanged file only read the passing entries.
+
+    Parameters
+    ----------
+    path : str, optional (default=None)
+        The cache directory. By default the cache is placed in the rootpy
+        user-data area.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(CACHE_ROOT, 'selections')
+        mkdir_p(path)
+        self.path = path
+        self._memory = {}
+
+    def key(self, tree, selection):
+        """
+        Return the cache key for a selection on a tree or None if the tree
+        cannot be cached. The aliases of the tree are part of the key since
+        they change the meaning of the selection.
+        """
+        return cache_key(tree, str(Cut(selection)), _aliases(tree))
+
+    def entry_list(self, tree, selection, ranges=None):
+        """
+        Return a memory-resident TEntryList of the entries of ``tree``
+        passing ``selection``. The entry list is read from the cache if
+        available, otherwise it is evaluated and stored in the cache. See
+        ``evaluate_entry_list`` for ``ranges``.
+        """
+        key = self.key(tree, selection)
+        if key is None:
+            return evaluate_entry_list(tree, selection, ranges)
+        if key in self._memory:
+            return self._memory[key]
+        filename = os.path.join(self.path, key + '.root')
+        elist = None
+        if os.path.exists(filename):
+            try:
+                with root_open(filename) as cache_file:
+                    elist = cache_file.Get('entries')
+                    elist.SetDirectory(0)
+            except (IOError, DoesNotExist) as e:
+                log.warning(
+                    "ignoring unreadable selection cache {0}: {1}".format(
+                        filename, e))
+                elist = None
+            else:
+                log.debug("read cached selection {0}".format(filename))
+        if elist is None:
+            elist = evaluate_entry_list(tree, selection, ranges)
+            # write to a temporary file first so that concurrent readers
+            # never see an incomplete cache file
+            tmpname = '{0}.{1}.tmp'.format(filename, uuid())
+            with root_open(tmpname, 'recreate') as cache_file:
+                cache_file.cd()
+                elist.Write('entries')
+            os.rename(tmpname, filename)
+            log.info(
+                "cached {0:d} entries passing `{1}` in {2}".format(
+                    elist.GetN(), Cut(selection), filename))
+        self._memory[key] = elist
+        return elist
+
+    def clear(self):
+        """
+        Remove all cached selections
+        """
+        self._memory = {}
+        for name in os.listdir(self.path):
+            if name.endswith('.root'):
+                os.remove(os.path.join(self.path, name))
+
+
+def evaluate_entry_list(tree, selection, ranges=None):
+    """
+    Return a memory-resident TEntryList of the entries of ``tree`` passing
+    ``selection``. All entries are evaluated regardless of any entry list
+    applied to the tree. If a list of (start, stop) ``ranges`` is given
+    (i.e. the clusters that may pass according to a zone map) only the
+    entries in these ranges are evaluated and all other entries are known
+    to fail.
+    """
+    name = 'rootpy_entries_{0}'.format(uuid())
+    old_elist = ROOT.TTree.GetEntryList(tree)
+    if old_elist:
+        ROOT.TTree.SetEntryList(tree, None)
+    try:
+        with thread_specific_tmprootdir() as directory:
+            if ranges is None:
+                ROOT.TTree.Draw(tree, '>>{0}'.format(name),
+                                str(Cut(selection)), 'entrylist goff')
+                elist = directory.Get(name)
+            else:
+                elist = ROOT.TEntryList(name, str(Cut(selection)), tree)
+                for start, stop in ranges:
+                    part = '{0}_{1:d}'.format(name, start)
+                    ROOT.TTree.Draw(tree, '>>{0}'.format(part),
+                                    str(Cut(selection)), 'entrylist goff',
+                                    stop - start, start)
+                    elist.Add(directory.Get(part))
+            elist.SetDirectory(0)
+    finally:
+        if old_elist:
+            ROOT.TTree.SetEntryList(tree, old_elist)
+    return elist
+
+
+def intersect_entry_lists(elist, other):
+    """
+    Return a new TEntryList of the entries in both entry lists
+    """
+    # A & B = A - (A - B)
+    rest = ROOT.TEntryList(elist)
+    rest.Subtract(other)
+    both = ROOT.TEntryList(elist)
+    both.Subtract(rest)
+    both.SetDirectory(0)
+    return both
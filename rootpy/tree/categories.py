@@ -8,6 +8,7 @@ from .cut import Cut
 
 __all__ = [
     'Categories',
+    'CompiledCategories',
 ]
 
 
@@ -279,3 +280,120 @@ class Categories(object):
         """
         for category in self.walk():
             yield category
+
+    def compile(self):
+        """
+        Return a ``CompiledCategories`` that assigns the index of the leaf
+        category (in the order of ``walk``) to each entry of a batch of
+        columns in a single pass
+        """
+        return CompiledCategories(self)
+
+    def _categorize(self, values, entries, result, index):
+        """
+        Assign category indices starting at ``index`` to the ``entries``
+        reaching this node and return the next free index
+        """
+        if self.feature < 0:
+            raise ValueError(
+                "categories with leaf nodes cannot be compiled")
+        variable = values[self.variables[self.feature][0]][entries]
+        data = float(self.data)
+        for forbid, child, passing in (
+                (self.forbidleft, self.leftchild, variable <= data),
+                (self.forbidright, self.rightchild, variable > data)):
+            if forbid:
+                continue
+            if child is not None:
+                index = child._categorize(
+                    values, entries[passing], result, index)
+            else:
+                result[entries[passing]] = index
+                index += 1
+        return index
+
+
+class CompiledCategories(object):
+    """
+    A vectorized categorization of the entries of batches of columns (see
+    ``rootpy.tree.Tree.iter_batches``). Calling it with a batch returns an
+    array of the index of the category of each entry where the categories
+    are ordered as in ``Categories.walk`` and ``cuts`` holds the
+    corresponding selections. Entries that are not in any category (i.e.
+    in a forbidden region) have the index -1.
+
+    .. sourcecode:: python
+
+        >>> categories = Categories.from_string('{a|1,2,3}x{b|4,5,6}')
+        >>> compiled = categories.compile()
+        >>> counts, yields = compiled.yields(
+        ...     tree.iter_batches(compiled.branches + ['weight']),
+        ...     weight='weight')
+    """
+    def __init__(self, categories):
+        from .expression import compile
+        self.categories = categories
+        self.cuts = list(categories.walk())
+        self._expressions = dict(
+            (variable, compile(variable))
+            for variable, _ in categories.variables)
+        branches = set()
+        for expression in self._expressions.values():
+            branches.update(expression.branches)
+        self.branches = sorted(branches)
+
+    def __len__(self):
+        return len(self.cuts)
+
+    def __call__(self, columns):
+        import numpy as np
+        values = {}
+        for variable, expression in self._expressions.items():
+            value = np.asarray(expression(columns))
+            if value.dtype == object or value.ndim != 1:
+                raise ValueError(
+                    "the category variable `{0}` does not have one value "
+                    "per entry".format(variable))
+            values[variable] = value.astype(np.float64)
+        size = len(next(iter(values.values())))
+        result = np.empty(size, dtype=np.int64)
+        result.fill(-1)
+        self.categories._categorize(
+            values, np.arange(size), result, 0)
+        return result
+
+    def counts(self, columns, weights=None):
+        """
+        Return the number of entries in each category and the sums of their
+        weights (equal to the counts if ``weights`` is None)
+        """
+        import numpy as np
+        index = self(columns)
+        inside = index >= 0
+        counts = np.bincount(index[inside], minlength=len(self))
+        if weights is None:
+            return counts, counts.astype(np.float64)
+        weights = np.broadcast_to(
+            np.asarray(weights, dtype=np.float64), index.shape)
+        yields = np.bincount(
+            index[inside], weights=weights[inside], minlength=len(self))
+        return counts, yields
+
+    def yields(self, batches, weight=None):
+        """
+        Return the total number of entries in each category and the sums of
+        their weights over an iterable of batches. ``weight`` is the name of
+        a column or an expression.
+        """
+        import numpy as np
+        from .expression import compile
+        if weight is not None:
+            weight = compile(weight)
+        total_counts = np.zeros(len(self), dtype=np.int64)
+        total_yields = np.zeros(len(self), dtype=np.float64)
+        for batch in batches:
+            weights = weight(batch) if weight is not None else None
+            counts, yields = self.counts(batch, weights)
+            total_counts += counts
+            total_yields += yields
+        return total_counts, total_yields
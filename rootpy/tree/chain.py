@@ -2,44 +2,156 @@
 # distributed under the terms of the GNU General Public License
 from __future__ import absolute_import
 
+import sys
 import multiprocessing
+import threading
 import time
+from collections import deque
+
+import ROOT
 
 from .. import log; log = log[__name__]
 from ..io import root_open, DoesNotExist
 from ..utils.extras import humanize_bytes
 from ..context import preserve_current_directory
 from ..extern.six import string_types
-from .filtering import EventFilterList
+from .cache import SelectionCache
+from .cut import Cut
+from .filtering import FilterList, EventFilterList
+from .metrics import ChainMetrics
+from ..plotting.base import Plottable
+from .parallel import (
+    merge, tree_sum, map_files, map_ranges, draw_files, cluster_ranges)
 
 __all__ = [
     'TreeChain',
     'TreeQueue',
+    'enable_background_io',
 ]
 
 
+_BACKGROUND_IO = False
+
+
+def enable_background_io():
+    """
+    Allow ROOT I/O to be performed in background threads. This enables the
+    thread safety of ROOT for the whole process and releases the GIL while
+    ROOT opens files and reads entries, so it must be called explicitly
+    before creating a ``TreeChain`` with ``prefetch``.
+    """
+    global _BACKGROUND_IO
+    if _BACKGROUND_IO:
+        return
+    try:
+        enable_thread_safety = ROOT.ROOT.EnableThreadSafety
+    except AttributeError:  # ROOT 5
+        raise RuntimeError(
+            "background I/O requires a ROOT version with thread safety")
+    enable_thread_safety()
+    # release the GIL while ROOT opens files and reads entries so the main
+    # thread can continue while a file is opened in the background
+    for method in (ROOT.TFile.Open, ROOT.TTree.GetEntry):
+        try:
+            method._threaded = True
+        except AttributeError:
+            pass
+        try:
+            method.__release_gil__ = True
+        except AttributeError:
+            pass
+    _BACKGROUND_IO = True
+
+
+class _ChainFile(object):
+    """
+    A file of a chain that is opened either immediately or in a background
+    thread. Only the file is opened and the tree retrieved in the thread.
+    The branches and the TTreeCache of the tree are configured by the chain
+    on the main thread once it becomes the current tree. The cache is not
+    warmed up in the thread since the branches to cache depend on the state
+    of the chain (i.e. the learned branches) that is updated on the main
+    thread while the file is opened.
+    """
+    def __init__(self, filename, name, background=False):
+        self.filename = filename
+        self.name = name
+        self.file = None
+        self.tree = None
+        self.open_time = 0.
+        self.wait_time = 0.
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._open)
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._open()
+
+    def _open(self):
+        t0 = time.time()
+        try:
+            with preserve_current_directory():
+                self.file = root_open(self.filename)
+            self.tree = self.file.Get(self.name)
+        except (IOError, DoesNotExist):
+            pass
+        self.open_time = time.time() - t0
+
+    def wait(self):
+        """
+        Wait until the file is opened and return the time spent waiting
+        """
+        if self._thread is None:
+            return 0.
+        t0 = time.time()
+        self._thread.join()
+        self._thread = None
+        self.wait_time = time.time() - t0
+        return self.wait_time
+
+    def close(self):
+        self.wait()
+        if self.file is not None:
+            self.file.Close()
+            self.file = None
+
+
 class BaseTreeChain(object):
 
+    # the maximum number of files opened ahead of the current file or None
+    _max_prefetch = None
+
     def __init__(self, name,
                  treebuffer=None,
                  branches=None,
                  ignore_branches=None,
                  events=-1,
                  onfilechange=None,
+                 onmetrics=None,
+                 perf_stats=False,
                  read_branches_on_demand=False,
+                 fast_access=False,
+                 learn_branches=0,
+                 learned_branches=None,
                  cache=False,
-                 # 30 MB cache by default
+                 # 30 MB cache by default or 'auto'
                  cache_size=30000000,
                  learn_entries=10,
                  always_read=None,
                  ignore_unsupported=False,
-                 filters=None):
+                 filters=None,
+                 prefetch=0,
+                 selection=None,
+                 selection_cache=None,
+                 zonemaps=False):
         self._name = name
         self._buffer = treebuffer
         self._branches = branches
         self._ignore_branches = ignore_branches
         self._tree = None
         self._file = None
+        self._always_read = []
         self._events = events
         self._total_events = 0
         self._ignore_unsupported = ignore_unsupported
@@ -51,12 +163,60 @@ class BaseTreeChain(object):
         if onfilechange is None:
             onfilechange = []
         self._filechange_hooks = onfilechange
+        self.metrics = ChainMetrics(callback=onmetrics, perf_stats=perf_stats)
 
         self._read_branches_on_demand = read_branches_on_demand
+        self._fast_access = fast_access
+        self._learn_branches = learn_branches
+        self._learned_branches = learned_branches
+        self._accessed_branches = set()
         self._use_cache = cache
         self._cache_size = cache_size
         self._learn_entries = learn_entries
 
+        self._selection = selection
+        if selection_cache is True:
+            selection_cache = SelectionCache()
+        self._selection_cache = selection_cache
+        self._zonemaps = zonemaps
+
+        if self._max_prefetch is not None and prefetch > self._max_prefetch:
+            log.warning(
+                "{0} only prefetches {1:d} file(s)".format(
+                    self.__class__.__name__, self._max_prefetch))
+            prefetch = self._max_prefetch
+        self._prefetch = prefetch
+        self._prefetched = deque()
+        self._prefetch_exhausted = False
+        self._prefetch_open_time = 0.
+        self._prefetch_wait_time = 0.
+        if prefetch > 0 and not _BACKGROUND_IO:
+            log.warning(
+                "prefetch requires enable_background_io() to be called "
+                "first; files will be opened in the foreground")
+            self._prefetch = 0
+
+        # the options needed to reconstruct this chain in worker processes
+        self._options = dict(
+            branches=branches,
+            ignore_branches=ignore_branches,
+            onfilechange=onfilechange,
+            onmetrics=onmetrics,
+            perf_stats=perf_stats,
+            read_branches_on_demand=read_branches_on_demand,
+            fast_access=fast_access,
+            learn_branches=learn_branches,
+            learned_branches=learned_branches,
+            cache=cache,
+            cache_size=cache_size,
+            learn_entries=learn_entries,
+            always_read=always_read,
+            ignore_unsupported=ignore_unsupported,
+            prefetch=self._prefetch,
+            selection=selection,
+            selection_cache=selection_cache,
+            zonemaps=zonemaps)
+
         self.weight = 1.
         self.userdata = {}
 
@@ -94,14 +254,77 @@ class BaseTreeChain(object):
     def always_read(self, branches):
         self._always_read = branches
         self._tree.always_read(branches)
+        if self._use_cache:
+            for branch in branches:
+                if self._tree.GetBranch(branch):
+                    self._tree.AddBranchToCache(branch, True)
 
     def reset(self):
         if self._tree is not None:
+            if self._file is not None:
+                self.metrics.finish_file(self._file, self._tree)
             self._tree = None
         if self._file is not None:
             self._file.Close()
             self._file = None
 
+    @property
+    def prefetch_stats(self):
+        """
+        A dict of the total time spent opening files in the background
+        (``open``), the time spent waiting for the next file to be opened
+        (``waited``) and the time spent opening files that overlapped with
+        processing the current file (``overlapped``)
+        """
+        return {
+            'open': self._prefetch_open_time,
+            'waited': self._prefetch_wait_time,
+            'overlapped': max(
+                0., self._prefetch_open_time - self._prefetch_wait_time),
+        }
+
+    def _clear_prefetched(self):
+        while self._prefetched:
+            self._prefetched.popleft().close()
+        self._prefetch_exhausted = False
+
+    def _open_next(self, background):
+        filename = self._next_file()
+        if filename is None:
+            return None
+        return _ChainFile(filename, self._name, background=background)
+
+    def _cache_branches(self):
+        """
+        The branches known to be read (always read or learned in previous
+        files) that are added to the TTreeCache of each file before the
+        first entry so the learning phase of the cache is skipped
+        """
+        branches = set(self._always_read)
+        branches.update(self._accessed_branches)
+        if self._learned_branches:
+            branches.update(self._learned_branches)
+        return sorted(branches) or None
+
+    def _next_chain_file(self):
+        if self._prefetch < 1:
+            return self._open_next(background=False)
+        # keep ``prefetch`` files opening in the background while the
+        # current file is processed
+        while (not self._prefetch_exhausted and
+               len(self._prefetched) <= self._prefetch):
+            chain_file = self._open_next(background=True)
+            if chain_file is None:
+                self._prefetch_exhausted = True
+                break
+            self._prefetched.append(chain_file)
+        if not self._prefetched:
+            return None
+        chain_file = self._prefetched.popleft()
+        self._prefetch_wait_time += chain_file.wait()
+        self._prefetch_open_time += chain_file.open_time
+        return chain_file
+
     def Draw(self, *args, **kwargs):
         """
         Loop over subfiles, draw each, and sum the output into a single
@@ -110,6 +333,7 @@ class BaseTreeChain(object):
         self.reset()
         output = None
         while self._rollover():
+            self._select_entries()
             if output is None:
                 # Make our own copy of the drawn histogram
                 output = self._tree.Draw(*args, **kwargs)
@@ -126,6 +350,67 @@ class BaseTreeChain(object):
     def draw(self, *args, **kwargs):
         return self.Draw(*args, **kwargs)
 
+    def draw_many(self, booking, batch_size=100000):
+        """
+        Fill many histograms in a single pass over all trees (see
+        ``rootpy.tree.Tree.draw_many``)
+        """
+        from .booking import HistogramBooking
+        if not isinstance(booking, HistogramBooking):
+            booking = HistogramBooking.from_requests(booking)
+        self.reset()
+        while self._rollover():
+            for batch in self._tree.iter_batches(
+                    booking.branches or None, batch_size=batch_size,
+                    selection=self._selection):
+                booking.fill(batch, self._tree.GetWeight())
+        return booking.finalize()
+
+    def describe(self, expressions, cut=None, weight=None, **kwargs):
+        """
+        Compute summary statistics of expressions over all trees and merge
+        them (see ``rootpy.tree.Tree.describe``)
+        """
+        self.reset()
+        output = None
+        selection = Cut(self._selection) & Cut(cut)
+        while self._rollover():
+            summaries = self._tree.describe(
+                expressions, selection, weight, **kwargs)
+            if output is None:
+                output = summaries
+            elif isinstance(expressions, string_types):
+                output.merge(summaries)
+            else:
+                for expression, summary in summaries.items():
+                    output[expression].merge(summary)
+        return output
+
+    def _extremum(self, expression, cut, maximum):
+        self.reset()
+        selection = Cut(self._selection) & Cut(cut)
+        values = []
+        while self._rollover():
+            values.append(
+                self._tree._extremum(expression, selection, maximum))
+        if not values:
+            return -sys.float_info.max if maximum else sys.float_info.max
+        return max(values) if maximum else min(values)
+
+    def GetMaximum(self, expression, cut=None):
+        """
+        Return the maximum value of an expression over all trees (see
+        ``rootpy.tree.Tree.GetMaximum``)
+        """
+        return self._extremum(expression, cut, True)
+
+    def GetMinimum(self, expression, cut=None):
+        """
+        Return the minimum value of an expression over all trees (see
+        ``rootpy.tree.Tree.GetMinimum``)
+        """
+        return self._extremum(expression, cut, False)
+
     def __getattr__(self, attr):
         try:
             return getattr(self._tree, attr)
@@ -142,27 +427,37 @@ class BaseTreeChain(object):
     def __iter__(self):
         passed_events = 0
         while True:
+            self._select_entries()
             entries = 0
+            passing = 0
             total_entries = float(self._tree.GetEntries())
             t1 = time.time()
             t2 = t1
-            for entry in self._tree:
-                entries += 1
-                self.userdata = {}
-                if self._filters(entry):
-                    yield entry
-                    passed_events += 1
-                    if self._events == passed_events:
-                        break
-                if time.time() - t2 > 60:
-                    entry_rate = int(entries / (time.time() - t1))
-                    log.info(
-                        "{0:d} entr{1} per second. "
-                        "{2:.0f}% done current tree.".format(
-                            entry_rate,
-                            'ies' if entry_rate != 1 else 'y',
-                            100 * entries / total_entries))
-                    t2 = time.time()
+            file_metrics = self.metrics.current
+            try:
+                for entry in self._tree:
+                    entries += 1
+                    self.userdata = {}
+                    if self._filters(entry):
+                        passing += 1
+                        yield entry
+                        passed_events += 1
+                        if self._events == passed_events:
+                            break
+                    if time.time() - t2 > 60:
+                        entry_rate = int(entries / (time.time() - t1))
+                        log.info(
+                            "{0:d} entr{1} per second. "
+                            "{2:.0f}% done current tree.".format(
+                                entry_rate,
+                                'ies' if entry_rate != 1 else 'y',
+                                100 * entries / total_entries))
+                        t2 = time.time()
+            finally:
+                # also record the entries if the loop is stopped early
+                if file_metrics is not None:
+                    file_metrics.entries += entries
+                    file_metrics.passing += passing
             if self._events == passed_events:
                 break
             log.info("{0:d} entries per second".format(
@@ -175,22 +470,87 @@ class BaseTreeChain(object):
                 break
         self._filters.finalize()
 
+    def iter_batches(self, branches=None, batch_size=100000, selection=None):
+        """
+        Iterate over the events of all trees in batches of NumPy arrays (see
+        ``rootpy.tree.Tree.iter_batches``). The event filters are applied in
+        batch mode (see ``rootpy.tree.filtering.EventFilter.passes_batch``)
+        so the cutflow is accumulated exactly as when iterating over single
+        events and only the events passing all filters are yielded.
+        """
+        selection = Cut(self._selection) & Cut(selection)
+        passed_events = 0
+        while True:
+            file_metrics = self.metrics.current
+            entries_read = self._tree.entries_read
+            try:
+                for batch in self._tree.iter_batches(
+                        branches=branches, batch_size=batch_size,
+                        selection=selection):
+                    if self._filters:
+                        batch = batch.select(
+                            self._filters.filter_batch(batch))
+                        if batch.size == 0:
+                            continue
+                    if self._events != -1:
+                        batch = batch.select(
+                            slice(0, self._events - passed_events))
+                    passed_events += batch.size
+                    if file_metrics is not None:
+                        file_metrics.passing += batch.size
+                    yield batch
+                    if self._events == passed_events:
+                        break
+            finally:
+                if file_metrics is not None:
+                    # the entries read before the selection
+                    file_metrics.entries += (
+                        self._tree.entries_read - entries_read)
+            if self._events == passed_events:
+                break
+            self._total_events += self._tree.GetEntries()
+            if not self._rollover():
+                break
+        self._filters.finalize()
+
+    @property
+    def learned_branches(self):
+        """
+        The sorted list of branches accessed in all files when reading
+        branches on demand with ``learn_branches`` or ``learned_branches``.
+        Pass this list as ``learned_branches`` in later runs to read these
+        branches in bulk from the first entry.
+        """
+        branches = set(self._accessed_branches)
+        if self._tree is not None and self._tree.learned_branches:
+            branches.update(self._tree.learned_branches)
+        return sorted(branches)
+
+    def _select_entries(self):
+        """
+        Restrict the entries of the current tree to those passing the
+        selection of the chain. The entry list is only built when events are
+        iterated over or drawn since the batch methods apply the selection
+        while reading.
+        """
+        if self._selection and not self._tree.GetEntryList():
+            self._tree.SetEntryList(self._tree.entry_list(self._selection))
+
     def _rollover(self):
+        if self._tree is not None and self._tree.learned_branches:
+            self._accessed_branches.update(self._tree.learned_branches)
         BaseTreeChain.reset(self)
-        filename = self._next_file()
-        if filename is None:
+        chain_file = self._next_chain_file()
+        if chain_file is None:
             return False
+        filename = chain_file.filename
         log.info("current file: {0}".format(filename))
-        try:
-            with preserve_current_directory():
-                self._file = root_open(filename)
-        except IOError:
-            self._file = None
+        self._file = chain_file.file
+        if self._file is None:
             log.warning("could not open file {0} (skipping)".format(filename))
             return self._rollover()
-        try:
-            self._tree = self._file.Get(self._name)
-        except DoesNotExist:
+        self._tree = chain_file.tree
+        if self._tree is None:
             log.warning(
                 "tree {0} does not exist in file {1} (skipping)".format(
                     self._name, filename))
@@ -214,15 +574,38 @@ class BaseTreeChain(object):
             self._buffer = self._tree._buffer
         if self._use_cache:
             # enable TTreeCache for this tree
-            log.info(
-                "enabling a {0} TTreeCache for the current tree "
-                "({1:d} learning entries)".format(
-                    humanize_bytes(self._cache_size), self._learn_entries))
-            self._tree.SetCacheSize(self._cache_size)
-            self._tree.SetCacheLearnEntries(self._learn_entries)
+            cache_branches = self._cache_branches()
+            cache_size = self._tree.configure_cache(
+                self._cache_size, self._learn_entries, cache_branches)
+            if cache_branches:
+                log.info(
+                    "enabling a {0} TTreeCache for the current tree "
+                    "with {1:d} branches".format(
+                        humanize_bytes(cache_size), len(cache_branches)))
+            else:
+                log.info(
+                    "enabling a {0} TTreeCache for the current tree "
+                    "({1:d} learning entries)".format(
+                        humanize_bytes(cache_size), self._learn_entries))
+        if self._selection:
+            # the entry list is only built when needed (see _select_entries)
+            self._tree.selection_cache = self._selection_cache
+        if self._zonemaps:
+            self._tree.load_zonemap()
         self._tree.read_branches_on_demand = self._read_branches_on_demand
+        self._tree.fast_access = self._fast_access
+        self._tree.learn_branches = self._learn_branches
+        if not self._learn_branches or not self._accessed_branches:
+            # start warm with the branches given by the user. Once branches
+            # have been learned they are learned again in each file since
+            # the access pattern may change.
+            self._tree.learned_branches = self._learned_branches
         self._tree.always_read(self._always_read)
         self.weight = self._tree.GetWeight()
+        self.metrics.start_file(
+            filename, self._tree,
+            open_time=chain_file.open_time,
+            wait_time=chain_file.wait_time)
         for target, args in self._filechange_hooks:
             # run any user-defined functions
             target(*args, name=self._name, file=self._file, tree=self._tree)
@@ -232,6 +615,72 @@ class BaseTreeChain(object):
 class TreeChain(BaseTreeChain):
     """
     A ROOT.TChain replacement
+
+    Parameters
+    ----------
+    name : str
+        The name of the tree in each file
+
+    files : str or list
+        The file or list of files
+
+    prefetch : int, optional (default=0)
+        Open this many of the following files in background threads while the
+        current file is processed. See ``prefetch_stats``. Background I/O
+        must first be enabled with ``enable_background_io`` otherwise the
+        files are opened in the foreground.
+
+    selection : str or rootpy.tree.Cut, optional (default=None)
+        Only iterate over the entries passing this selection
+
+    selection_cache : SelectionCache or bool, optional (default=None)
+        Read the entries passing ``selection`` from this
+        ``rootpy.tree.cache.SelectionCache`` (or the default cache if True)
+        instead of evaluating the selection again for unchanged files
+
+    zonemaps : bool, optional (default=False)
+        Read the zone map of each file written with
+        ``rootpy.tree.Tree.build_zonemap`` if it exists so that the clusters
+        of entries that cannot pass the selection are skipped by
+        ``iter_batches`` and when the entries passing ``selection`` are
+        evaluated
+
+    learn_branches : int, optional (default=0)
+        When reading branches on demand, record the branches accessed in the
+        first ``learn_branches`` entries of each file and then read those
+        branches together in each remaining entry. Branches accessed later
+        are still read on demand. See
+        ``learned_branches``.
+
+    learned_branches : list, optional (default=None)
+        When reading branches on demand, read these branches in bulk from the
+        first entry (i.e. the ``learned_branches`` of a previous run)
+
+    fast_access : bool, optional (default=False)
+        Yield accessors generated for the schema of the TreeBuffer where each
+        branch is a property reading the value directly (see
+        ``rootpy.tree.Tree.create_buffer``)
+
+    cache_size : int or 'auto', optional (default=30000000)
+        The size in bytes of the TTreeCache enabled with ``cache=True``. If
+        'auto' the cache of each file is sized to hold the compressed baskets
+        of its largest cluster of the branches read (see
+        ``rootpy.tree.Tree.configure_cache``). The ``always_read`` branches
+        and those in ``learned_branches`` or learned in previous files are
+        added to the cache before the first entry so the learning phase is
+        skipped.
+
+    onmetrics : callable, optional (default=None)
+        Called with the ``rootpy.tree.metrics.FileMetrics`` of each file once
+        it is processed. The metrics of all files are recorded in ``metrics``
+        and can be serialized with ``metrics.to_json()``.
+
+    perf_stats : bool, optional (default=False)
+        Also record the time spent decompressing and reading baskets in the
+        metrics with a ``TTreePerfStats``
+
+    kwargs : dict, optional
+        Remaining keyword arguments are passed to ``BaseTreeChain``
     """
     def __init__(self, name, files, **kwargs):
         if isinstance(files, tuple):
@@ -253,11 +702,168 @@ class TreeChain(BaseTreeChain):
         Note: not valid when in queue mode
         """
         super(TreeChain, self).reset()
+        self._clear_prefetched()
         self.curr_file_idx = 0
 
     def __len__(self):
         return len(self._files)
 
+    def Draw(self, expression, selection="", options="", hist=None,
+             create_hist=False, workers=None, **kwargs):
+        """
+        Loop over subfiles, draw each, and sum the output into a single
+        histogram. If ``workers`` is not None, then the files are drawn in
+        parallel by that many worker processes and the memory-resident
+        histograms are summed in a balanced binary tree. See
+        ``rootpy.tree.Tree.Draw`` for a description of the other arguments.
+        If ``hist`` is specified it is filled and returned.
+        """
+        if workers is None:
+            output = super(TreeChain, self).Draw(
+                expression, selection, options,
+                hist=hist, create_hist=create_hist, **kwargs)
+            if hist is not None:
+                return hist
+            return output
+        selection_cache = None
+        if self._selection_cache:
+            selection_cache = self._selection_cache.path
+        output = tree_sum(draw_files(
+            self._name, self._files, expression,
+            selection=selection, options=options,
+            hist=hist, create_hist=create_hist,
+            workers=workers, chain_selection=self._selection,
+            selection_cache=selection_cache))
+        if hist is not None:
+            if output is not None:
+                hist.Add(output)
+            output = hist
+        elif output is None:
+            return None
+        if isinstance(output, Plottable):
+            output.decorate(**kwargs)
+        if 'goff' not in options:
+            output.Draw()
+        return output
+
+    def map_reduce(self, func, init=None, reducer=merge, workers=None,
+                   split=False, entries_per_task=None, scheduler=None):
+        """
+        Distribute the files of this chain across a pool of worker processes.
+        Each worker loops over the entries of a file, applies the same
+        filters as this chain and calls ``func(event, output)`` for each
+        event passing the filters. The output of each file is then merged
+        in the order of the files in this chain, so the result does not
+        depend on the order in which the workers complete. The cutflow
+        counts of the workers are added to the filters of this chain.
+
+        If ``split`` is True then each file is also split into ranges of
+        entries aligned on the clusters of baskets of the tree (see
+        ``rootpy.tree.Tree.clusters``) that are processed in parallel, so
+        that a few large files can also be processed by many workers.
+
+        Parameters
+        ----------
+        func : callable
+            Called as ``func(event, output)`` for each event passing the
+            filters, where ``output`` is the output for the current file.
+
+        init : callable, optional (default=None)
+            Called without arguments in the worker to create the initial
+            output for each file, i.e. a dict of empty histograms. By default
+            the output is an empty dict.
+
+        reducer : callable, optional (default=rootpy.tree.parallel.merge)
+            Called as ``reducer(left, right)`` to merge the output of two
+            files. By default histograms are added, numbers are summed and
+            dicts, lists and tuples are merged element by element.
+
+        workers : int, optional (default=None)
+            The number of worker processes. By default use one worker
+            per CPU.
+
+        split : bool, optional (default=False)
+            Split each file into cluster-aligned ranges of entries processed
+            by separate workers. The output of each range is created with
+            ``init`` and merged with ``reducer`` in the order of the entries.
+
+        entries_per_task : int, optional (default=None)
+            The minimum number of entries in each range if ``split`` is True.
+            By default each file is split into about four ranges per worker.
+
+        scheduler : rootpy.tree.scheduler.Scheduler, optional (default=None)
+            Distribute the ranges of entries of all files with this
+            scheduler instead, where idle workers steal ranges from busy
+            workers and ranges of crashed workers are retried. ``workers``,
+            ``split`` and ``entries_per_task`` are then ignored. See
+            ``Scheduler.stats`` for the throughput of each worker.
+
+        Returns
+        -------
+        output : the merged output of all files
+
+        Notes
+        -----
+        The workers are forked from the current process so ``func`` and
+        ``init`` need not be picklable but the output must be.
+        """
+        if self._events != -1:
+            raise ValueError(
+                "map_reduce does not support a limit on the number of events")
+        output = None
+        cutflow = None
+        if scheduler is not None:
+            outputs = scheduler.map(
+                self._name, self._files, func, init,
+                self._filters, self._options)
+        elif split:
+            outputs = map_ranges(
+                self._name, self._cluster_ranges(workers, entries_per_task),
+                func, init, self._filters, self._options, workers=workers)
+        else:
+            outputs = map_files(
+                self._name, self._files, func, init,
+                self._filters, self._options, workers=workers)
+        for file_output, file_cutflow in outputs:
+            if cutflow is None:
+                output = file_output
+                cutflow = file_cutflow
+            else:
+                output = reducer(output, file_output)
+                cutflow = FilterList.merge(cutflow, file_cutflow)
+        if cutflow is not None:
+            for filter, counts in zip(self._filters, cutflow):
+                filter += counts
+        self._filters.finalize()
+        return output
+
+    def _cluster_ranges(self, workers=None, entries_per_task=None):
+        """
+        Return the list of (filename, start, stop) cluster-aligned ranges of
+        entries of the tree in each file
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        ranges = []
+        for filename in self._files:
+            with root_open(filename) as rfile:
+                try:
+                    tree = rfile.Get(self._name)
+                except DoesNotExist:
+                    log.warning(
+                        "tree {0} does not exist in file {1} "
+                        "(skipping)".format(self._name, filename))
+                    continue
+                entries = entries_per_task
+                if entries is None:
+                    entries = tree.GetEntries() // (4 * max(1, workers))
+                for start, stop in cluster_ranges(
+                        tree.clusters(), max(1, entries)):
+                    ranges.append((filename, start, stop))
+        log.info("split {0:d} files into {1:d} ranges of entries".format(
+            len(self._files), len(ranges)))
+        return ranges
+
     def _next_file(self):
         if self.curr_file_idx >= len(self._files):
             return None
@@ -271,9 +877,20 @@ class TreeChain(BaseTreeChain):
 
 
 class TreeQueue(BaseTreeChain):
+    """
+    A chain over the files received from a ``multiprocessing.Queue`` until
+    ``SENTINEL`` is received. Workers sharing a queue each process whole
+    files. See ``rootpy.tree.scheduler.Scheduler`` to balance ranges of
+    entries across workers instead. With ``prefetch`` at most the next file
+    is taken from the queue ahead of time.
+    """
 
     SENTINEL = None
 
+    # files prefetched from the shared queue are not available to the other
+    # workers so only the next file is taken ahead of time
+    _max_prefetch = 1
+
     def __init__(self, name, files, **kwargs):
         # multiprocessing.queues d.n.e. until one has been created
         multiprocessing.Queue()
@@ -261,6 +261,16 @@ class Cut(QROOT.TCut):
         s = s.replace("||", r" \text{ or } ")
         return s
 
+    def compile(self):
+        """
+        Return a ``rootpy.tree.expression.Expression`` that evaluates this cut
+        on batches of NumPy columns (see ``rootpy.tree.Tree.iter_batches``).
+        The ``branches`` attribute of the expression lists the branches
+        required by this cut.
+        """
+        from .expression import compile
+        return compile(str(self))
+
     def where(self):
         """
         Return string compatible with PyTable's Table.where syntax:
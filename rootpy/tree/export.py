@@ -0,0 +1,233 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements writers that export the branches of a tree in batches
+of NumPy columns (see ``rootpy.tree.Tree.iter_batches``) so that only one
+batch is held in memory at a time. See ``rootpy.tree.Tree.export``.
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+
+__all__ = [
+    'FORMATS',
+    'write_csv',
+    'write_npy',
+    'write_npz',
+    'write_parquet',
+]
+
+
+def _is_jagged(column):
+    return column.dtype == object
+
+
+def _csv_tokens(column):
+    """
+    Return a list of string arrays, one for each CSV column of a branch
+    """
+    if column.dtype == np.bool_:
+        column = column.astype(np.uint8)
+    if column.ndim == 1:
+        return [column.astype(str)]
+    column = column.reshape(len(column), -1)
+    return [column[:, i].astype(str) for i in range(column.shape[1])]
+
+
+def _check_rectangular(template):
+    for name, column in template.items():
+        if _is_jagged(column):
+            raise TypeError(
+                "variable-length branch `{0}` cannot be "
+                "exported in this format".format(name))
+
+
+def write_csv(stream, template, batches, sep=',', include_labels=True):
+    """
+    Write batches in CSV format. Fixed-length arrays are expanded to one
+    column per element.
+    """
+    _check_rectangular(template)
+    if include_labels:
+        labels = []
+        for name, column in template.items():
+            if column.ndim == 1:
+                labels.append(name)
+            else:
+                labels.extend(
+                    '{0}[{1:d}]'.format(name, idx)
+                    for idx in range(int(np.prod(column.shape[1:]))))
+        stream.write(sep.join(labels) + '\n')
+    for batch in batches:
+        if batch.size == 0:
+            continue
+        tokens = []
+        for column in batch.values():
+            tokens.extend(_csv_tokens(column))
+        lines = tokens[0]
+        for token in tokens[1:]:
+            lines = np.char.add(np.char.add(lines, sep), token)
+        stream.write('\n'.join(lines.tolist()))
+        stream.write('\n')
+
+
+def _record_dtype(template):
+    return np.dtype([(name, column.dtype, column.shape[1:])
+                     for name, column in template.items()])
+
+
+def write_npy(filename, template, batches, entries):
+    """
+    Write batches into a .npy file of a structured array with one field per
+    branch. The file is memory-mapped and filled batch by batch. ``entries``
+    is the number of entries in all batches.
+    """
+    _check_rectangular(template)
+    output = np.lib.format.open_memmap(
+        filename, mode='w+', dtype=_record_dtype(template), shape=(entries,))
+    start = 0
+    for batch in batches:
+        stop = start + batch.size
+        for name, column in batch.items():
+            output[name][start:stop] = column
+        start = stop
+    output.flush()
+    del output
+
+
+class _TemporaryArrays(dict):
+    """
+    Memory-mapped temporary .npy files, one for each branch
+    """
+    def __init__(self, path, template, entries):
+        super(_TemporaryArrays, self).__init__()
+        self.paths = {}
+        for index, (name, column) in enumerate(template.items()):
+            filename = os.path.join(path, '{0:d}.npy'.format(index))
+            self.paths[name] = filename
+            self[name] = np.lib.format.open_memmap(
+                filename, mode='w+', dtype=column.dtype,
+                shape=(entries,) + column.shape[1:])
+
+    def flush(self):
+        for name in list(self.keys()):
+            self[name].flush()
+            # close the memory maps
+            del self[name]
+
+
+def write_npz(filename, template, batches, entries):
+    """
+    Write batches into a .npz archive with one array per branch (as with
+    ``numpy.savez``). Each array is first filled batch by batch in a
+    memory-mapped temporary .npy file.
+    """
+    _check_rectangular(template)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        arrays = _TemporaryArrays(tmpdir, template, entries)
+        start = 0
+        for batch in batches:
+            stop = start + batch.size
+            for name, column in batch.items():
+                arrays[name][start:stop] = column
+            start = stop
+        arrays.flush()
+        with zipfile.ZipFile(filename, mode='w',
+                             compression=zipfile.ZIP_STORED,
+                             allowZip64=True) as archive:
+            for name, path in arrays.paths.items():
+                archive.write(path, arcname=name + '.npy')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def _arrow_type(pa, column, element=None):
+    """
+    Return the Arrow type of a column. ``element`` is the NumPy dtype and
+    shape of the elements of a variable-length column.
+    """
+    if _is_jagged(column):
+        dtype, shape = element if element is not None else (np.float64, ())
+        value_type = pa.from_numpy_dtype(np.dtype(dtype))
+        if shape:
+            value_type = pa.list_(value_type, int(np.prod(shape)))
+        return pa.list_(value_type)
+    value_type = pa.from_numpy_dtype(column.dtype)
+    if column.ndim > 1:
+        return pa.list_(value_type, int(np.prod(column.shape[1:])))
+    return value_type
+
+
+def _arrow_array(pa, column, arrow_type):
+    if _is_jagged(column):
+        lengths = np.array([len(row) for row in column], dtype=np.int32)
+        offsets = np.zeros(len(column) + 1, dtype=np.int32)
+        np.cumsum(lengths, out=offsets[1:])
+        value_type = arrow_type.value_type
+        if lengths.sum():
+            values = np.concatenate([np.asarray(row) for row in column])
+        else:
+            values = np.empty(0)
+        values = values.reshape(-1)
+        if isinstance(value_type, pa.FixedSizeListType):
+            values = pa.FixedSizeListArray.from_arrays(
+                pa.array(values, type=value_type.value_type),
+                value_type.list_size)
+        else:
+            values = pa.array(values, type=value_type)
+        return pa.ListArray.from_arrays(pa.array(offsets), values)
+    if column.ndim > 1:
+        return pa.FixedSizeListArray.from_arrays(
+            pa.array(column.reshape(-1), type=arrow_type.value_type),
+            arrow_type.list_size)
+    return pa.array(column, type=arrow_type)
+
+
+def write_parquet(filename, template, batches, elements=None):
+    """
+    Write batches into an Apache Parquet file with one row group per batch.
+    Fixed-length arrays are stored as fixed-size lists and variable-length
+    arrays as lists. The schema is determined by the types of the branches
+    so that all row groups have the same schema. ``elements`` maps the
+    names of variable-length branches to the NumPy dtype and shape of their
+    elements (by default double values). This requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if elements is None:
+        elements = {}
+    schema = pa.schema([
+        (name, _arrow_type(pa, column, elements.get(name)))
+        for name, column in template.items()])
+    writer = pq.ParquetWriter(filename, schema)
+    try:
+        empty = True
+        for batch in batches:
+            if batch.size == 0:
+                continue
+            writer.write_table(pa.Table.from_arrays(
+                [_arrow_array(pa, column, field.type)
+                 for column, field in zip(batch.values(), schema)],
+                schema=schema))
+            empty = False
+        if empty:
+            # write an empty table with the schema
+            writer.write_table(schema.empty_table())
+    finally:
+        writer.close()
+
+
+# file extensions of the supported formats
+FORMATS = {
+    '.csv': 'csv',
+    '.npy': 'npy',
+    '.npz': 'npz',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+}
@@ -0,0 +1,549 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements a parser for the TTreeFormula-like expressions used in
+``rootpy.tree.Cut`` selections and draw expressions and evaluates them on
+batches of NumPy columns (i.e. the batches yielded by
+``rootpy.tree.Tree.iter_batches``). Expressions may use numbers, branch names,
+fixed-index subscripts (``x[0]``), the arithmetic, comparison, logical and
+bitwise operators of C, ``**`` and ``^`` for powers and the common math
+functions with or without the ``TMath::`` prefix.
+
+.. sourcecode:: python
+
+    >>> from rootpy.tree.expression import compile
+    >>> expr = compile('(3<x)&&(x<8)&&abs(y)<2')
+    >>> expr.branches
+    ['x', 'y']
+    >>> mask = expr.mask(batch)
+"""
+from __future__ import absolute_import
+
+import numbers
+import re
+
+import numpy as np
+
+__all__ = [
+    'Expression',
+    'compile',
+]
+
+
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+    (?P<name>[A-Za-z_][A-Za-z0-9_.]*(?:::[A-Za-z_][A-Za-z0-9_]*)*)|
+    (?P<op>\*\*|&&|\|\||==|!=|<=|>=|[-+*/%^!<>&|(),\[\]])
+    )''', re.VERBOSE)
+
+
+def _numeric(value):
+    # TTreeFormula evaluates arithmetic in double precision: booleans are
+    # counted as 0 or 1 and integers neither wrap around nor overflow
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind in 'biu':
+            return value.astype(np.float64)
+        return value
+    if isinstance(value, numbers.Integral):
+        return float(value)
+    return value
+
+
+def _arithmetic(func):
+    def wrapped(left, right):
+        return func(_numeric(left), _numeric(right))
+    return wrapped
+
+
+def _bitwise(func):
+    def wrapped(left, right):
+        return func(np.asarray(left).astype(np.int64),
+                    np.asarray(right).astype(np.int64))
+    return wrapped
+
+
+def _modulo(left, right):
+    # integer modulo with the sign of the dividend as in C
+    return np.fmod(np.trunc(_numeric(left)), np.trunc(_numeric(right)))
+
+
+# binary operators and their precedence
+_BINARY = {
+    '||': (1, np.logical_or),
+    '&&': (2, np.logical_and),
+    '|': (3, _bitwise(np.bitwise_or)),
+    '&': (4, _bitwise(np.bitwise_and)),
+    '==': (5, np.equal),
+    '!=': (5, np.not_equal),
+    '<': (6, np.less),
+    '<=': (6, np.less_equal),
+    '>': (6, np.greater),
+    '>=': (6, np.greater_equal),
+    '+': (7, _arithmetic(np.add)),
+    '-': (7, _arithmetic(np.subtract)),
+    '*': (8, _arithmetic(np.multiply)),
+    '/': (8, _arithmetic(np.true_divide)),
+    '%': (8, _modulo),
+}
+
+_UNARY = {
+    '!': np.logical_not,
+    '-': lambda value: np.negative(_numeric(value)),
+    '+': _numeric,
+}
+
+_POWER = _arithmetic(np.power)
+
+# functions and their number of arguments
+_FUNCTIONS = {
+    'abs': (np.abs, 1),
+    'fabs': (np.abs, 1),
+    'sqrt': (np.sqrt, 1),
+    'exp': (np.exp, 1),
+    'log': (np.log, 1),
+    'log10': (np.log10, 1),
+    'sin': (np.sin, 1),
+    'cos': (np.cos, 1),
+    'tan': (np.tan, 1),
+    'asin': (np.arcsin, 1),
+    'acos': (np.arccos, 1),
+    'atan': (np.arctan, 1),
+    'atan2': (np.arctan2, 2),
+    'sinh': (np.sinh, 1),
+    'cosh': (np.cosh, 1),
+    'tanh': (np.tanh, 1),
+    'floor': (np.floor, 1),
+    'ceil': (np.ceil, 1),
+    'pow': (_POWER, 2),
+    'power': (_POWER, 2),
+    'sq': (np.square, 1),
+    'min': (np.minimum, 2),
+    'max': (np.maximum, 2),
+    'pi': (lambda: np.pi, 0),
+}
+
+_CONSTANTS = {
+    'true': True,
+    'false': False,
+    'kTRUE': True,
+    'kFALSE': False,
+}
+
+
+def _split(flat, offsets):
+    """
+    Return an object array of the arrays ``flat[offsets[i]:offsets[i + 1]]``
+    """
+    rows = np.empty(len(offsets), dtype=object)
+    if len(offsets) < 2:
+        return rows[:0]
+    # the extra element keeps NumPy from broadcasting rows of equal length
+    # into a multidimensional array
+    rows[:] = np.split(flat, offsets[1:-1]) + [None]
+    return rows[:-1]
+
+
+class Jagged(object):
+    """
+    The values of a variable-length array or vector column as one flat array
+    of the values of all entries and the number of values of each entry.
+    Operators are applied to the flat values. As in TTreeFormula, combining
+    two variable-length arrays uses the smaller number of values of each
+    entry and the values of a column with one value per entry are repeated
+    for each value of the entry.
+    """
+    def __init__(self, counts, flat):
+        self.counts = counts
+        self.flat = flat
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Return the Jagged values of an object array of arrays
+        """
+        counts = np.array([len(row) for row in rows], dtype=np.int64)
+        if counts.sum():
+            flat = np.concatenate([np.asarray(row) for row in rows])
+        else:
+            flat = np.empty(0, dtype=np.float64)
+        return cls(counts, flat)
+
+    @property
+    def offsets(self):
+        offsets = np.zeros(len(self.counts) + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=offsets[1:])
+        return offsets
+
+    @property
+    def entry(self):
+        """
+        The entry of each of the flat values
+        """
+        return np.repeat(np.arange(len(self.counts)), self.counts)
+
+    def local(self):
+        """
+        The index of each of the flat values within its entry
+        """
+        return (np.arange(len(self.flat)) -
+                np.repeat(self.offsets[:-1], self.counts))
+
+    def truncate(self, counts):
+        """
+        Return the flat values of the first ``counts`` values of each entry
+        """
+        return self.flat[self.local() < np.repeat(counts, self.counts)]
+
+    def rows(self):
+        """
+        Return an object array of the values of each entry
+        """
+        return _split(self.flat, self.offsets)
+
+
+def _nonzero(value):
+    # missing elements (NaN) do not pass a selection
+    value = np.asarray(value)
+    if value.dtype.kind == 'f':
+        return (value != 0) & ~np.isnan(value)
+    return value != 0
+
+
+def _jagged(value):
+    if isinstance(value, np.ndarray) and value.dtype == object:
+        return Jagged.from_rows(value)
+    return value
+
+
+def _apply(func, *args):
+    """
+    Apply a NumPy function to the arguments with the flat values of
+    variable-length arrays
+    """
+    jagged = [arg for arg in args if isinstance(arg, Jagged)]
+    if not jagged:
+        return func(*args)
+    counts = jagged[0].counts
+    for arg in jagged[1:]:
+        if not np.array_equal(arg.counts, counts):
+            counts = np.minimum(counts, arg.counts)
+    flat_args = []
+    for arg in args:
+        if isinstance(arg, Jagged):
+            if arg.counts is not counts and not np.array_equal(
+                    arg.counts, counts):
+                arg = arg.truncate(counts)
+            else:
+                arg = arg.flat
+        elif np.ndim(arg) > 0:
+            # one value per entry
+            arg = np.repeat(arg, counts, axis=0)
+        flat_args.append(arg)
+    return Jagged(counts, func(*flat_args))
+
+
+class Node(object):
+
+    def branches(self):
+        """
+        The set of branch names used in this node and its children
+        """
+        names = set()
+        for child in self.children:
+            names.update(child.branches())
+        return names
+
+
+class Constant(Node):
+
+    children = ()
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, columns):
+        return self.value
+
+
+class Branch(Node):
+
+    children = ()
+
+    def __init__(self, name):
+        self.name = name
+
+    def branches(self):
+        return set([self.name])
+
+    def evaluate(self, columns):
+        try:
+            return _jagged(columns[self.name])
+        except KeyError:
+            raise KeyError(
+                "branch `{0}` is not in the batch".format(self.name))
+
+
+class Subscript(Node):
+
+    def __init__(self, operand, index):
+        self.operand = operand
+        self.index = index
+        self.children = (operand,)
+
+    def evaluate(self, columns):
+        value = self.operand.evaluate(columns)
+        if isinstance(value, Jagged):
+            # variable-length arrays: out-of-range elements are NaN and
+            # therefore fail any comparison
+            result = np.full(len(value.counts), np.nan)
+            inside = value.counts > self.index
+            result[inside] = value.flat[
+                value.offsets[:-1][inside] + self.index]
+            return result
+        return value[:, self.index]
+
+
+class Unary(Node):
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+        self.children = (operand,)
+
+    def evaluate(self, columns):
+        return _apply(_UNARY[self.op], self.operand.evaluate(columns))
+
+
+class Binary(Node):
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.children = (left, right)
+
+    def evaluate(self, columns):
+        if self.op == '**':
+            func = _POWER
+        else:
+            func = _BINARY[self.op][1]
+        return _apply(func, self.left.evaluate(columns),
+                      self.right.evaluate(columns))
+
+
+class Call(Node):
+
+    def __init__(self, name, args):
+        self.name = name
+        self.func = _FUNCTIONS[name][0]
+        self.args = args
+        self.children = tuple(args)
+
+    def evaluate(self, columns):
+        return _apply(
+            lambda *args: self.func(*[_numeric(arg) for arg in args]),
+            *[arg.evaluate(columns) for arg in self.args])
+
+
+class _Parser(object):
+
+    def __init__(self, string):
+        self.string = string
+        self.tokens = self.tokenize(string)
+        self.pos = 0
+
+    def tokenize(self, string):
+        tokens = []
+        pos = 0
+        string = string.rstrip()
+        while pos < len(string):
+            match = _TOKEN.match(string, pos)
+            if not match or match.end() == pos:
+                raise SyntaxError(
+                    "unexpected character at position {0:d} "
+                    "in `{1}`".format(pos, string))
+            kind = match.lastgroup
+            tokens.append((kind, match.group(kind)))
+            pos = match.end()
+        return tokens
+
+    def error(self, message):
+        return SyntaxError("{0} in `{1}`".format(message, self.string))
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        kind, token = self.next()
+        if token != value:
+            raise self.error("expected `{0}`".format(value))
+
+    def parse(self):
+        node = self.parse_binary(1)
+        if self.pos != len(self.tokens):
+            raise self.error(
+                "unexpected token `{0}`".format(self.peek()[1]))
+        return node
+
+    def parse_binary(self, min_precedence):
+        left = self.parse_unary()
+        while True:
+            kind, token = self.peek()
+            if kind != 'op' or token not in _BINARY:
+                return left
+            precedence = _BINARY[token][0]
+            if precedence < min_precedence:
+                return left
+            self.next()
+            right = self.parse_binary(precedence + 1)
+            left = Binary(token, left, right)
+
+    def parse_unary(self):
+        kind, token = self.peek()
+        if kind == 'op' and token in _UNARY:
+            self.next()
+            return Unary(token, self.parse_unary())
+        return self.parse_power()
+
+    def parse_power(self):
+        base = self.parse_postfix()
+        kind, token = self.peek()
+        if kind == 'op' and token in ('**', '^'):
+            self.next()
+            # right associative
+            return Binary('**', base, self.parse_unary())
+        return base
+
+    def parse_postfix(self):
+        node = self.parse_primary()
+        while self.peek() == ('op', '['):
+            self.next()
+            kind, token = self.next()
+            if kind != 'number' or not token.isdigit():
+                raise self.error("only constant integer indices are supported")
+            self.expect(']')
+            node = Subscript(node, int(token))
+        return node
+
+    def parse_primary(self):
+        kind, token = self.next()
+        if kind == 'number':
+            return Constant(float(token) if re.search('[.eE]', token)
+                            else int(token))
+        if kind == 'name':
+            if self.peek() == ('op', '('):
+                return self.parse_call(token)
+            if token in _CONSTANTS:
+                return Constant(_CONSTANTS[token])
+            return Branch(token)
+        if token == '(':
+            node = self.parse_binary(1)
+            self.expect(')')
+            return node
+        if token is None:
+            raise self.error("unexpected end of expression")
+        raise self.error("unexpected token `{0}`".format(token))
+
+    def parse_call(self, name):
+        func = name
+        if func.startswith('TMath::'):
+            func = func[len('TMath::'):]
+        func = func.lower()
+        if func not in _FUNCTIONS:
+            raise self.error("unsupported function `{0}`".format(name))
+        self.expect('(')
+        args = []
+        if self.peek() != ('op', ')'):
+            args.append(self.parse_binary(1))
+            while self.peek() == ('op', ','):
+                self.next()
+                args.append(self.parse_binary(1))
+        self.expect(')')
+        if len(args) != _FUNCTIONS[func][1]:
+            raise self.error(
+                "function `{0}` takes {1:d} argument(s)".format(
+                    name, _FUNCTIONS[func][1]))
+        return Call(func, args)
+
+
+class Expression(object):
+    """
+    An expression that is evaluated on a batch of columns, i.e. a dict
+    mapping branch names to NumPy arrays of equal length.
+
+    Parameters
+    ----------
+    string : str
+        The expression. An empty expression is always true.
+    """
+    def __init__(self, string):
+        self.string = string
+        if string.strip():
+            self.root = _Parser(string).parse()
+        else:
+            self.root = Constant(True)
+        self.branches = sorted(self.root.branches())
+
+    def __repr__(self):
+        return "Expression('{0}')".format(self.string)
+
+    def _evaluate(self, columns):
+        value = self.root.evaluate(columns)
+        if np.ndim(value) == 0 and not isinstance(value, Jagged):
+            # a constant expression
+            size = len(next(iter(columns.values()))) if columns else 1
+            return np.repeat(value, size)
+        return value
+
+    def __call__(self, columns):
+        """
+        Evaluate the expression on a batch of columns and return an array
+        with one value per entry. Expressions of variable-length arrays or
+        vectors return an object array of the arrays of values of each
+        entry.
+        """
+        value = self._evaluate(columns)
+        if isinstance(value, Jagged):
+            return value.rows()
+        return value
+
+    def mask(self, columns):
+        """
+        Evaluate the expression as a selection and return a boolean array
+        that is True for the entries with a non-zero value (NaN values of
+        missing elements do not pass). For
+        multidimensional and variable-length values an entry passes if any
+        of its elements is non-zero as in TTreeFormula.
+        """
+        value = self._evaluate(columns)
+        if isinstance(value, Jagged):
+            passing = _nonzero(value.flat)
+            return np.bincount(value.entry[passing],
+                               minlength=len(value.counts)) > 0
+        value = _nonzero(value)
+        if value.ndim > 1:
+            value = value.reshape(len(value), -1).any(axis=1)
+        return value
+
+
+_COMPILED = {}
+
+
+def compile(string):
+    """
+    Return the (cached) Expression for a string
+    """
+    string = str(string)
+    try:
+        return _COMPILED[string]
+    except KeyError:
+        expression = Expression(string)
+        _COMPILED[string] = expression
+        return expression
@@ -43,7 +43,7 @@ class Filter(object):
         else:
             self.count_funcs = {}
 
-        for func_name in self.count_funcs.iterkeys():
+        for func_name in self.count_funcs.keys():
             self.count_funcs_total[func_name] = 0.
             self.count_funcs_passing[func_name] = 0.
 
@@ -125,10 +125,49 @@ class Filter(object):
     def __add__(self, other):
         return Filter.add(self, other)
 
+    def __iadd__(self, other):
+        """
+        Add the counts of another Filter (or its state dict as returned by
+        ``__getstate__``) to this Filter in place
+        """
+        if isinstance(other, dict):
+            _other = Filter()
+            _other.__setstate__(other)
+            other = _other
+        if self.name != other.name:
+            raise ValueError("Attemping to add filters with different names")
+        self.total += other.total
+        self.passing += other.passing
+        for detail, value in other.details.items():
+            if detail in self.details:
+                self.details[detail] += value
+            else:
+                self.details[detail] = value
+        for func_name in other.count_funcs_total.keys():
+            self.count_funcs_total[func_name] = (
+                self.count_funcs_total.get(func_name, 0.) +
+                other.count_funcs_total[func_name])
+            self.count_funcs_passing[func_name] = (
+                self.count_funcs_passing.get(func_name, 0.) +
+                other.count_funcs_passing[func_name])
+        return self
+
+    def reset(self):
+        """
+        Reset the total and passing counts and the details to zero
+        """
+        self.total = 0
+        self.passing = 0
+        for detail in self.details.keys():
+            self.details[detail] = 0
+        for func_name in self.count_funcs_total.keys():
+            self.count_funcs_total[func_name] = 0.
+            self.count_funcs_passing[func_name] = 0.
+
     def passed(self, event):
         self.total += 1
         self.passing += 1
-        for name, func in self.count_funcs.iteritems():
+        for name, func in self.count_funcs.items():
             count = func(event)
             self.count_funcs_total[name] += count
             self.count_funcs_passing[name] += count
@@ -136,11 +175,40 @@ class Filter(object):
 
     def failed(self, event):
         self.total += 1
-        for name, func in self.count_funcs.iteritems():
+        for name, func in self.count_funcs.items():
             count = func(event)
             self.count_funcs_total[name] += count
         self.was_passed = False
 
+    def counted_batch(self, batch, mask, counted=None):
+        """
+        Update the counts with a batch of events where ``mask`` is a boolean
+        array that is True for the passing events. If ``counted`` is not
+        None, only the events where this boolean array is True contribute to
+        the total. In batch mode the count_funcs are called with the batch
+        and must return an array of counts (i.e. weights) with one element
+        per event or a scalar count per event.
+        """
+        import numpy as np
+        ntotal = len(mask)
+        if counted is not None:
+            ntotal = int(np.count_nonzero(counted))
+        self.total += ntotal
+        npassing = int(np.count_nonzero(mask))
+        self.passing += npassing
+        for name, func in self.count_funcs.items():
+            counts = np.asarray(func(batch), dtype=np.float64)
+            if counts.ndim == 0:
+                self.count_funcs_total[name] += float(counts) * ntotal
+                self.count_funcs_passing[name] += float(counts) * npassing
+            else:
+                if counted is None:
+                    self.count_funcs_total[name] += counts.sum()
+                else:
+                    self.count_funcs_total[name] += counts[counted].sum()
+                self.count_funcs_passing[name] += counts[mask].sum()
+        self.was_passed = npassing > 0
+
 
 class FilterHook(object):
 
@@ -184,6 +252,72 @@ class EventFilter(Filter):
         """
         return True
 
+    def filter_batch(self, batch):
+        """
+        Apply this filter to a batch of events (see
+        ``rootpy.tree.Tree.iter_batches``) and return a boolean array that is
+        True for the passing events. The counts are updated and the hooks
+        are called once per passing event as in the event mode.
+        """
+        import numpy as np
+        counted = None
+        if self.passthrough:
+            mask = np.ones(batch.size, dtype=bool)
+        elif type(self).passes_batch == EventFilter.passes_batch:
+            mask, counted = self._passes_events(batch)
+        else:
+            mask = np.asarray(self.passes_batch(batch), dtype=bool)
+            if mask.shape != (batch.size,):
+                raise ValueError(
+                    "Filter {0} returned a mask of shape {1} for a batch of "
+                    "{2:d} events".format(
+                        self.__class__.__name__, mask.shape, batch.size))
+        self.counted_batch(batch, mask, counted)
+        if self.was_passed and self.hooks:
+            for i in range(int(np.count_nonzero(mask))):
+                for hook in self.hooks:
+                    hook()
+        return mask
+
+    def passes_batch(self, batch):
+        """
+        You should override this method in your derived class to support
+        the batch mode efficiently. Return a boolean array that is True for
+        the events of the batch that pass. By default ``passes`` is called
+        for each event of the batch and, as in the event mode, events for
+        which ``passes`` returns None do not contribute to the cut-flow.
+        """
+        return self._passes_events(batch)[0]
+
+    def _passes_events(self, batch):
+        """
+        Call ``passes`` for each event of a batch and return a boolean array
+        that is True for the passing events and a boolean array that is
+        False for the events where ``passes`` returned None
+        """
+        import numpy as np
+        if type(self).passes == EventFilter.passes:
+            return np.ones(batch.size, dtype=bool), None
+        columns = list(batch.items())
+        mask = np.zeros(batch.size, dtype=bool)
+        counted = np.ones(batch.size, dtype=bool)
+        for i in range(batch.size):
+            _passes = self.passes(batch.__class__(
+                (name, column[i]) for name, column in columns))
+            if _passes is None:
+                counted[i] = False
+            else:
+                mask[i] = bool(_passes)
+        if not counted.all():
+            # events are not counted in total
+            log.warning(
+                "Filter {0} returned None for {1:d} events so they will not "
+                "contribute to cut-flow. Use True to accept event, "
+                "otherwise False.".format(
+                    self.__class__.__name__,
+                    batch.size - int(np.count_nonzero(counted))))
+        return mask, counted
+
     def finalize(self):
         """
         You should override this method in your derived class
@@ -219,6 +353,57 @@ class ObjectFilter(Filter):
         """
         return collection
 
+    def filter_batch(self, batch, mask):
+        """
+        Apply this filter to the objects of a collection in a batch of events.
+        ``mask`` is a ``rootpy.tree.expression.Jagged`` boolean array (or an
+        object array holding a boolean array for each event) that is True
+        for the objects currently selected. Return the mask of the objects
+        passing this filter in the same form.
+        """
+        import numpy as np
+        mask, rows = _jagged_mask(mask)
+        if self.count_events:
+            self.total += len(mask.counts)
+        else:
+            self.total += int(np.count_nonzero(mask.flat))
+        if not self.passthrough:
+            mask, _ = _jagged_mask(self.filtered_batch(batch, mask))
+        if self.count_events:
+            # the number of events with at least one passing object
+            npassing = int(np.count_nonzero(np.bincount(
+                mask.entry[mask.flat], minlength=len(mask.counts))))
+        else:
+            npassing = int(np.count_nonzero(mask.flat))
+        self.passing += npassing
+        self.was_passed = npassing > 0
+        if rows:
+            return mask.rows()
+        return mask
+
+    def filtered_batch(self, batch, mask):
+        """
+        You should override this method in your derived class to support
+        the batch mode. ``mask`` is a ``rootpy.tree.expression.Jagged``
+        boolean array of the objects currently selected. Return the mask of
+        the objects passing this filter, i.e. with the flat values of the
+        collection ``Jagged(mask.counts, mask.flat & (pt > 20))``.
+        """
+        return mask
+
+
+def _jagged_mask(mask):
+    """
+    Return a mask of objects as a ``rootpy.tree.expression.Jagged`` boolean
+    array and whether it was given as an object array of arrays
+    """
+    import numpy as np
+    from .expression import Jagged
+    if isinstance(mask, Jagged):
+        return Jagged(mask.counts, np.asarray(mask.flat, dtype=bool)), False
+    mask = Jagged.from_rows(mask)
+    return Jagged(mask.counts, mask.flat.astype(bool)), True
+
 
 class FilterList(list):
     """
@@ -263,6 +448,13 @@ class FilterList(list):
         """
         return [filter.__getstate__() for filter in self]
 
+    def reset(self):
+        """
+        Reset the counts of all filters to zero
+        """
+        for filter in self:
+            filter.reset()
+
     def __setitem__(self, filter):
         if not isinstance(filter, (Filter, dict)):
             raise TypeError(
@@ -323,6 +515,28 @@ class EventFilterList(FilterList):
                 return False
         return True
 
+    def filter_batch(self, batch):
+        """
+        Apply the filters in sequence to a batch of events (see
+        ``rootpy.tree.Tree.iter_batches``) and return a boolean array that is
+        True for the events passing all filters. As in the event mode, each
+        filter only sees the events passing the previous filters so the
+        cutflow is identical.
+        """
+        import numpy as np
+        indices = np.arange(batch.size)
+        selected = batch
+        for filter in self:
+            passing = filter.filter_batch(selected)
+            if not passing.all():
+                indices = indices[passing]
+                selected = batch.select(indices)
+            if len(indices) == 0:
+                break
+        mask = np.zeros(batch.size, dtype=bool)
+        mask[indices] = True
+        return mask
+
     def __setitem__(self, filter):
         if not isinstance(filter, EventFilter):
             raise TypeError(
@@ -352,6 +566,19 @@ class ObjectFilterList(FilterList):
                 return []
         return passing_objects
 
+    def filter_batch(self, batch, mask):
+        """
+        Apply the filters in sequence to the objects of a collection in a
+        batch of events and return the mask of the passing objects (see
+        ``ObjectFilter.filter_batch``)
+        """
+        mask, rows = _jagged_mask(mask)
+        for filter in self:
+            mask = filter.filter_batch(batch, mask)
+        if rows:
+            return mask.rows()
+        return mask
+
     def __setitem__(self, filter):
         if not isinstance(filter, ObjectFilter):
             raise TypeError(
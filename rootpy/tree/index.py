@@ -0,0 +1,228 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements indices of the entries of a tree by the values of one
+or more key branches, i.e. (run, event), that are used to join the entries of
+two trees without a nested loop (see ``rootpy.tree.Tree.join``). Indices are
+persisted in the rootpy user-data area next to the cached selections (see
+``rootpy.tree.cache``) and are invalidated when the file changes.
+"""
+from __future__ import absolute_import
+
+import os
+
+import numpy as np
+
+from . import log; log = log[__name__]
+from ..utils.path import mkdir_p
+from ..extern.shortuuid import uuid
+from ..extern.six import string_types
+from .cache import CACHE_ROOT, cache_key
+from .reader import iter_read
+
+__all__ = [
+    'TreeIndex',
+    'IndexCache',
+]
+
+
+def _key_names(keys):
+    if isinstance(keys, string_types):
+        return (keys,)
+    return tuple(keys)
+
+
+class TreeIndex(object):
+    """
+    A sorted index of the entries of a tree by the values of key branches.
+    If several entries have the same key the first entry is used.
+
+    Parameters
+    ----------
+    names : tuple
+        The names of the key branches
+
+    keys : numpy structured array
+        The sorted unique keys with one field per key branch
+
+    entries : numpy array
+        The entry of each key
+    """
+    def __init__(self, names, keys, entries):
+        self.names = _key_names(names)
+        self.keys = keys
+        self.entries = entries
+        self._lookup = None
+
+    @classmethod
+    def build(cls, tree, keys, batch_size=100000):
+        """
+        Build the index of a tree by the values of the branches ``keys``
+        """
+        names = _key_names(keys)
+        columns = dict((name, []) for name in names)
+        for batch in iter_read(tree, list(names), chunk_size=batch_size):
+            for name in names:
+                if batch[name].ndim != 1:
+                    raise TypeError(
+                        "key branch `{0}` is not a scalar".format(name))
+                columns[name].append(batch[name])
+        dtype = []
+        for name in names:
+            if columns[name]:
+                columns[name] = np.concatenate(columns[name])
+            else:
+                columns[name] = np.empty(0, dtype=np.int64)
+            dtype.append((name, columns[name].dtype))
+        keys = np.empty(tree.GetEntries(), dtype=dtype)
+        for name in names:
+            keys[name] = columns[name]
+        order = np.argsort(keys, order=names, kind='mergesort')
+        keys = keys[order]
+        # keep the first entry of each key
+        if len(keys):
+            unique = np.ones(len(keys), dtype=bool)
+            unique[1:] = keys[1:] != keys[:-1]
+            duplicates = len(keys) - unique.sum()
+            if duplicates:
+                log.warning(
+                    "{0:d} entries of tree {1} have duplicate keys".format(
+                        duplicates, tree.GetName()))
+            keys = keys[unique]
+            order = order[unique]
+        return cls(names, keys, order.astype(np.int64))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, columns):
+        """
+        Return the entries matching the keys given as a dict (or Batch) of
+        arrays or a structured array with one column per key branch. The
+        entry is -1 for keys that are not in the index.
+        """
+        size = len(columns[self.names[0]])
+        query = np.empty(size, dtype=self.keys.dtype)
+        for name in self.names:
+            query[name] = columns[name]
+        entries = np.full(size, -1, dtype=np.int64)
+        if len(self.keys) == 0:
+            return entries
+        position = np.searchsorted(self.keys, query)
+        inside = position < len(self.keys)
+        found = np.zeros(size, dtype=bool)
+        found[inside] = self.keys[position[inside]] == query[inside]
+        entries[found] = self.entries[position[found]]
+        return entries
+
+    def entry(self, *key):
+        """
+        Return the entry matching the values of the key branches or -1
+        """
+        if self._lookup is None:
+            # a hash table for fast lookups of single keys
+            self._lookup = dict(zip(
+                [tuple(key) for key in self.keys.tolist()],
+                self.entries.tolist()))
+        return self._lookup.get(key, -1)
+
+    def align(self, other, batch_size=100000):
+        """
+        Return the entries of the indexed tree matching each entry of
+        ``other`` (a tree or a TreeChain) by the values of the same key
+        branches, or -1 if there is no matching entry. For a TreeChain the
+        entries are those passing its selection and filters in the order of
+        iteration.
+        """
+        aligned = [self.lookup(batch) for batch in other.iter_batches(
+            list(self.names), batch_size=batch_size)]
+        if not aligned:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(aligned)
+
+    def save(self, filename):
+        """
+        Write the index to a .npz file
+        """
+        with open(filename, 'wb') as stream:
+            np.savez(stream, names=np.array(self.names),
+                     keys=self.keys, entries=self.entries)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read an index written with ``save``
+        """
+        with np.load(filename) as archive:
+            return cls(tuple(archive['names'].tolist()),
+                       archive['keys'], archive['entries'])
+
+
+class IndexCache(object):
+    """
+    A persistent cache of the indices of trees. An index is built once and
+    stored in the cache directory. Later indices by the same key branches of
+    the same unchanged file are read from the cache.
+
+    Parameters
+    ----------
+    path : str, optional (default=None)
+        The cache directory. By default the cache is placed in the rootpy
+        user-data area.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(CACHE_ROOT, 'indices')
+        mkdir_p(path)
+        self.path = path
+        self._memory = {}
+
+    def key(self, tree, keys):
+        """
+        Return the cache key for an index of a tree or None if the tree
+        cannot be cached
+        """
+        return cache_key(tree, 'index', _key_names(keys))
+
+    def index(self, tree, keys, batch_size=100000):
+        """
+        Return the ``TreeIndex`` of ``tree`` by the branches ``keys``. The
+        index is read from the cache if available, otherwise it is built and
+        stored in the cache.
+        """
+        key = self.key(tree, keys)
+        if key is None:
+            return TreeIndex.build(tree, keys, batch_size=batch_size)
+        if key in self._memory:
+            return self._memory[key]
+        filename = os.path.join(self.path, key + '.npz')
+        index = None
+        if os.path.exists(filename):
+            try:
+                index = TreeIndex.load(filename)
+            except (IOError, ValueError, KeyError) as e:
+                log.warning(
+                    "ignoring unreadable index cache {0}: {1}".format(
+                        filename, e))
+            else:
+                log.debug("read cached index {0}".format(filename))
+        if index is None:
+            index = TreeIndex.build(tree, keys, batch_size=batch_size)
+            # write to a temporary file first so that concurrent readers
+            # never see an incomplete cache file
+            tmpname = '{0}.{1}.tmp'.format(filename, uuid())
+            index.save(tmpname)
+            os.rename(tmpname, filename)
+            log.info("cached index of {0:d} keys in {1}".format(
+                len(index), filename))
+        self._memory[key] = index
+        return index
+
+    def clear(self):
+        """
+        Remove all cached indices
+        """
+        self._memory = {}
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.path, name))
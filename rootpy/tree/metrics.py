@@ -0,0 +1,221 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements the throughput metrics recorded for each file of a
+chain (see ``rootpy.tree.TreeChain.metrics``). The metrics can be serialized
+as JSON to compare the throughput of files and storage nodes.
+"""
+from __future__ import absolute_import
+
+import json
+import time
+
+import ROOT
+
+__all__ = [
+    'FileMetrics',
+    'ChainMetrics',
+]
+
+
+class FileMetrics(object):
+    """
+    The metrics of one file of a chain. Times are in seconds.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the file
+
+    open_time : float
+        The time spent opening the file and retrieving the tree (in a
+        background thread if prefetching)
+
+    wait_time : float
+        The time spent waiting for the file to be opened in the background
+
+    entries : int
+        The number of entries read
+
+    passing : int
+        The number of entries passing the filters of the chain
+
+    bytes_read : int
+        The number of bytes read from the file
+
+    read_calls : int
+        The number of read calls on the file
+
+    cache_efficiency : float
+        The fraction of the bytes read through the TTreeCache that were
+        found in the cache (``TTreeCache::GetEfficiency``) or None if no
+        cache is used
+
+    cache_efficiency_rel : float
+        ``TTreeCache::GetEfficiencyRel`` or None if no cache is used
+
+    unzip_time : float
+        The time spent decompressing baskets if ``perf_stats`` is enabled,
+        otherwise None
+
+    disk_time : float
+        The time spent reading from the storage if ``perf_stats`` is
+        enabled, otherwise None
+
+    wall_time : float
+        The time from when the tree was ready until the chain moved on to the
+        next file
+    """
+    FIELDS = (
+        'filename',
+        'open_time',
+        'wait_time',
+        'entries',
+        'passing',
+        'bytes_read',
+        'read_calls',
+        'cache_efficiency',
+        'cache_efficiency_rel',
+        'unzip_time',
+        'disk_time',
+        'wall_time',
+        'rate',
+    )
+
+    def __init__(self, filename, open_time=0., wait_time=0.):
+        self.filename = filename
+        self.open_time = open_time
+        self.wait_time = wait_time
+        self.entries = 0
+        self.passing = 0
+        self.bytes_read = 0
+        self.read_calls = 0
+        self.cache_efficiency = None
+        self.cache_efficiency_rel = None
+        self.unzip_time = None
+        self.disk_time = None
+        self.wall_time = 0.
+        self._start = time.time()
+        self._perf_stats = None
+
+    @property
+    def rate(self):
+        """
+        The number of entries read per second of wall time
+        """
+        if self.wall_time <= 0:
+            return 0.
+        return self.entries / self.wall_time
+
+    def start(self, tree, perf_stats=False):
+        if perf_stats:
+            # records the time spent reading and decompressing baskets
+            self._perf_stats = ROOT.TTreePerfStats(
+                'rootpy_perf_stats', tree)
+
+    def finish(self, rfile, tree):
+        self.wall_time = time.time() - self._start
+        self.bytes_read = rfile.GetBytesRead()
+        self.read_calls = rfile.GetReadCalls()
+        cache = tree.GetReadCache(rfile)
+        if cache:
+            self.cache_efficiency = cache.GetEfficiency()
+            self.cache_efficiency_rel = cache.GetEfficiencyRel()
+        if self._perf_stats is not None:
+            self._perf_stats.Finish()
+            self.unzip_time = self._perf_stats.GetUnzipTime()
+            self.disk_time = self._perf_stats.GetDiskTime()
+            self._perf_stats = None
+
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __repr__(self):
+        return (
+            "FileMetrics('{0}', entries={1:d}, passing={2:d}, "
+            "wall_time={3:.3f})").format(
+                self.filename, self.entries, self.passing, self.wall_time)
+
+
+class ChainMetrics(object):
+    """
+    The metrics of the files processed by a chain
+
+    Parameters
+    ----------
+    callback : callable, optional (default=None)
+        Called with the ``FileMetrics`` of each file once it is processed
+
+    perf_stats : bool, optional (default=False)
+        Record the time spent decompressing and reading baskets with a
+        ``TTreePerfStats`` (adds a small overhead to each read)
+    """
+    def __init__(self, callback=None, perf_stats=False):
+        self.callback = callback
+        self.perf_stats = perf_stats
+        self.files = []
+        self.current = None
+
+    def start_file(self, filename, tree, open_time=0., wait_time=0.):
+        self.current = FileMetrics(filename, open_time, wait_time)
+        self.current.start(tree, self.perf_stats)
+        return self.current
+
+    def finish_file(self, rfile, tree):
+        metrics = self.current
+        if metrics is None:
+            return None
+        self.current = None
+        metrics.finish(rfile, tree)
+        self.files.append(metrics)
+        if self.callback is not None:
+            self.callback(metrics)
+        return metrics
+
+    def reset(self):
+        self.files = []
+        self.current = None
+
+    def _sum(self, field):
+        values = [getattr(metrics, field) for metrics in self.files]
+        values = [value for value in values if value is not None]
+        return sum(values) if values else None
+
+    @property
+    def total(self):
+        """
+        A dict of the metrics summed over all files
+        """
+        total = dict(
+            (field, self._sum(field)) for field in (
+                'open_time', 'wait_time', 'entries', 'passing',
+                'bytes_read', 'read_calls', 'unzip_time', 'disk_time',
+                'wall_time'))
+        total['files'] = len(self.files)
+        if total['wall_time']:
+            total['rate'] = total['entries'] / total['wall_time']
+        else:
+            total['rate'] = 0.
+        return total
+
+    def slowest(self, n=5):
+        """
+        Return the metrics of the ``n`` files with the lowest rates
+        """
+        return sorted(self.files, key=lambda metrics: metrics.rate)[:n]
+
+    def as_dict(self):
+        return {
+            'files': [metrics.as_dict() for metrics in self.files],
+            'total': self.total,
+        }
+
+    def to_json(self, stream=None, **kwargs):
+        """
+        Serialize the metrics as JSON and write them to ``stream`` if given,
+        otherwise return a string. Remaining keyword arguments are passed to
+        ``json.dump``.
+        """
+        if stream is None:
+            return json.dumps(self.as_dict(), **kwargs)
+        json.dump(self.as_dict(), stream, **kwargs)
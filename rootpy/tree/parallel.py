@@ -0,0 +1,285 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements the machinery used to process trees in a pool of
+worker processes and merge the output of the workers.
+"""
+from __future__ import absolute_import
+
+import multiprocessing
+
+import ROOT
+
+from . import log; log = log[__name__]
+from .. import asrootpy
+from ..io import root_open, DoesNotExist
+from .cache import SelectionCache
+from .filtering import FilterList
+
+__all__ = [
+    'cluster_ranges',
+    'merge',
+    'tree_sum',
+]
+
+
+def merge(left, right):
+    """
+    Merge the output of two workers. Histograms are added, numbers are
+    summed, dicts are merged key by key, lists and tuples are merged element
+    by element and FilterLists are merged filter by filter. The left
+    argument may be modified in place.
+    """
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if isinstance(left, FilterList):
+        return FilterList.merge(left, right)
+    if isinstance(left, dict):
+        for key, value in right.items():
+            if key in left:
+                left[key] = merge(left[key], value)
+            else:
+                left[key] = value
+        return left
+    if isinstance(left, (list, tuple)):
+        if len(left) != len(right):
+            raise ValueError(
+                "unable to merge sequences of different lengths")
+        values = [merge(l, r) for l, r in zip(left, right)]
+        if hasattr(left, '_fields'):
+            # namedtuples take the values as separate arguments
+            return left.__class__(*values)
+        return left.__class__(values)
+    if isinstance(left, ROOT.TH1):
+        left.Add(right)
+        return left
+    return left + right
+
+
+# The state of a worker process. This is set by the pool initializer and is
+# inherited by forked workers without being pickled.
+_WORKER_STATE = {}
+
+
+def _fork_context():
+    """
+    Return the multiprocessing context that forks worker processes. The
+    workers inherit the state of the parent process so functions and
+    objects that cannot be pickled may be used in the workers.
+    """
+    try:
+        return multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 always forks
+        return multiprocessing
+    except ValueError:
+        raise RuntimeError(
+            "processing trees in parallel requires the fork start method")
+
+
+def _init_worker(state):
+    _WORKER_STATE.clear()
+    _WORKER_STATE.update(state)
+
+
+def _map_file(task):
+    from .chain import TreeChain
+    index, filename, start, stop = task
+    state = _WORKER_STATE
+    filters = state['filters']
+    filters.reset()
+    func = state['func']
+    init = state['init']
+    output = init() if init is not None else {}
+    chain = TreeChain(state['name'], [filename],
+                      filters=filters, **state['kwargs'])
+    if start is None:
+        for event in chain:
+            func(event, output)
+    else:
+        # only loop over a range of entries of the file
+        try:
+            chain._select_entries()
+            for event in chain._tree.iter_range(start, stop):
+                chain.userdata = {}
+                if filters(event):
+                    func(event, output)
+        finally:
+            # close the file since workers process many tasks
+            chain.reset()
+        filters.finalize()
+    return index, output, filters.basic()
+
+
+def _draw_file(filename):
+    state = _WORKER_STATE
+    with root_open(filename) as rfile:
+        try:
+            tree = rfile.Get(state['name'])
+        except DoesNotExist:
+            log.warning(
+                "tree {0} does not exist in file {1} (skipping)".format(
+                    state['name'], filename))
+            return None
+        if state['chain_selection']:
+            # only draw the entries passing the selection of the chain
+            if state['selection_cache'] is not None:
+                tree.selection_cache = SelectionCache(
+                    state['selection_cache'])
+            tree.SetEntryList(tree.entry_list(state['chain_selection']))
+        hist = state['hist']
+        if hist is not None:
+            hist = hist.Clone()
+            hist.Reset()
+            tree.Draw(state['expression'], state['selection'],
+                      state['options'], hist=hist)
+        else:
+            hist = tree.Draw(state['expression'], state['selection'],
+                             state['options'],
+                             create_hist=state['create_hist'])
+            if not isinstance(hist, ROOT.TH1):
+                return None
+            hist = hist.Clone()
+        # make it memory resident
+        hist.SetDirectory(0)
+    return hist
+
+
+def _imap(func, tasks, state, workers):
+    """
+    Apply ``func`` to each task in a pool of worker processes sharing the
+    same ``state`` and yield the results in the order of the tasks
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = _fork_context().Pool(
+        max(1, min(workers, len(tasks))),
+        initializer=_init_worker,
+        initargs=(state,))
+    try:
+        for result in pool.imap(func, tasks, chunksize=1):
+            yield result
+    except BaseException:
+        # also terminate the workers if the generator is closed early
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
+def map_files(name, files, func, init, filters, kwargs, workers=None):
+    """
+    Process each file in a pool of worker processes and yield the output
+    for each file and the corresponding cutflow in the order of ``files``
+    regardless of the order in which the workers complete.
+    """
+    state = {
+        'name': name,
+        'func': func,
+        'init': init,
+        'filters': filters,
+        'kwargs': kwargs,
+    }
+    tasks = [(index, filename, None, None)
+             for index, filename in enumerate(files)]
+    for index, output, cutflow in _imap(_map_file, tasks, state, workers):
+        log.info("processed file {0}".format(files[index]))
+        yield output, cutflow
+
+
+def map_ranges(name, ranges, func, init, filters, kwargs, workers=None):
+    """
+    Process ranges of entries given as (filename, start, stop) in a pool of
+    worker processes where each worker opens the file independently. Yield
+    the output for each range and the corresponding cutflow in the order of
+    ``ranges``.
+    """
+    state = {
+        'name': name,
+        'func': func,
+        'init': init,
+        'filters': filters,
+        'kwargs': kwargs,
+    }
+    tasks = [(index, filename, start, stop)
+             for index, (filename, start, stop) in enumerate(ranges)]
+    for index, output, cutflow in _imap(_map_file, tasks, state, workers):
+        log.debug("processed entries [{1:d}, {2:d}) of file {0}".format(
+            *ranges[index]))
+        yield output, cutflow
+
+
+def cluster_ranges(clusters, entries):
+    """
+    Group consecutive clusters given as (start, stop) entry ranges (see
+    ``rootpy.tree.Tree.clusters``) into ranges of at least ``entries``
+    entries. Clusters are never split so the ranges are aligned on cluster
+    boundaries.
+    """
+    ranges = []
+    first = None
+    for start, stop in clusters:
+        if first is None:
+            first = start
+        if stop - first >= entries:
+            ranges.append((first, stop))
+            first = None
+    if first is not None:
+        ranges.append((first, stop))
+    return ranges
+
+
+def draw_files(name, files, expression, selection='', options='',
+               hist=None, create_hist=False, workers=None,
+               chain_selection=None, selection_cache=None):
+    """
+    Draw the tree in each file in a pool of worker processes and yield the
+    memory-resident histograms in the order of ``files``. Only the entries
+    passing ``chain_selection`` are drawn, read from the selection cache in
+    the directory ``selection_cache`` if not None.
+    """
+    if 'goff' not in options:
+        options = (options + ' goff').strip()
+    state = {
+        'name': name,
+        'expression': expression,
+        'selection': selection,
+        'options': options,
+        'hist': hist,
+        'create_hist': create_hist,
+        'chain_selection': chain_selection,
+        'selection_cache': selection_cache,
+    }
+    for hist in _imap(_draw_file, list(files), state, workers):
+        if hist is not None:
+            yield asrootpy(hist, warn=False)
+
+
+def tree_sum(hists):
+    """
+    Sum histograms pairwise in a balanced binary tree. Only O(log(N))
+    partial sums are held in memory at any time.
+    """
+    # a stack of (level, partial sum) where each partial sum at level n is
+    # the sum of 2^n consecutive histograms
+    stack = []
+    for hist in hists:
+        level = 0
+        while stack and stack[-1][0] == level:
+            _, left = stack.pop()
+            left.Add(hist)
+            hist = left
+            level += 1
+        stack.append((level, hist))
+    if not stack:
+        return None
+    _, total = stack.pop()
+    while stack:
+        _, left = stack.pop()
+        left.Add(total)
+        total = left
+    return total
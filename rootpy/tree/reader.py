@@ -0,0 +1,574 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements a reader that copies the values of branches of basic
+types, fixed-length and variable-length arrays of basic types and
+``std::vector`` of basic types into NumPy arrays in a compiled loop (see
+``rootpy.tree.Tree.iter_batches`` and ``rootpy.tree.Tree.to_array``).
+Names that are not branches are evaluated as TTreeFormula expressions.
+The output follows the conventions of ``root_numpy.tree2array``.
+"""
+from __future__ import absolute_import
+
+import re
+import warnings
+
+import numpy as np
+
+from .. import compiled as C
+from ..extern.six import string_types
+from .cut import Cut
+from .expression import _split
+from .treebuffer import Batch
+
+__all__ = [
+    'UnconvertibleWarning',
+    'read',
+    'iter_read',
+    'tree2array',
+]
+
+C.register_code("""
+#include <cstring>
+#include <vector>
+#include <TTree.h>
+#include <TBranch.h>
+#include <TBranchElement.h>
+#include <TEntryList.h>
+#include <TLeaf.h>
+#include <TObjArray.h>
+#include <TTreeFormula.h>
+
+class RootpyTreeReader
+{
+public:
+    // the kinds of columns
+    enum {
+        FIXED = 0, JAGGED = 1, VECTOR = 2,
+        FORMULA = 3, JAGGED_FORMULA = 4
+    };
+
+    RootpyTreeReader(TTree* tree, const char* selection):
+        fTree(tree), fSelection(0), fEntryList(0), fValid(true)
+    {
+        if (selection && selection[0]) {
+            fSelection = new TTreeFormula(
+                "rootpy_reader_selection", selection, tree);
+            if (!fSelection->GetNdim()) {
+                fValid = false;
+            }
+        }
+    }
+
+    ~RootpyTreeReader()
+    {
+        delete fSelection;
+        for (size_t j = 0; j < fColumns.size(); ++j) {
+            delete fColumns[j].formula;
+        }
+    }
+
+    bool IsValid() const
+    {
+        return fValid;
+    }
+
+    void SetEntryList(TEntryList* elist)
+    {
+        // only read the entries in this entry list
+        fEntryList = elist;
+    }
+
+    int AddColumn(const char* name, int kind, int type, int size, int width)
+    {
+        Column column;
+        column.branch = fTree->GetBranch(name);
+        if (!column.branch) {
+            return -1;
+        }
+        column.leaf = static_cast<TLeaf*>(
+            column.branch->GetListOfLeaves()->At(0));
+        column.formula = 0;
+        column.kind = kind;
+        column.type = type;
+        column.size = size;
+        column.width = width;
+        column.destination = 0;
+        fColumns.push_back(column);
+        return fColumns.size() - 1;
+    }
+
+    int AddFormula(const char* expression)
+    {
+        // The values of an expression are evaluated in double precision.
+        // Expressions with a variable number of instances are jagged.
+        TTreeFormula* formula = new TTreeFormula(
+            "rootpy_reader_formula", expression, fTree);
+        if (!formula->GetNdim()) {
+            delete formula;
+            return -1;
+        }
+        Column column;
+        column.branch = 0;
+        column.leaf = 0;
+        column.formula = formula;
+        column.kind = formula->GetMultiplicity() ? JAGGED_FORMULA : FORMULA;
+        column.type = 9;
+        column.size = sizeof(Double_t);
+        column.width = 1;
+        column.destination = 0;
+        fColumns.push_back(column);
+        return fColumns.size() - 1;
+    }
+
+    int GetKind(int column) const
+    {
+        return fColumns[column].kind;
+    }
+
+    void SetDestination(int column, long address)
+    {
+        fColumns[column].destination = reinterpret_cast<char*>(address);
+    }
+
+    Long64_t Read(Long64_t start, Long64_t stop, Long64_t step)
+    {
+        // Read the entries in [start, stop) with the given step passing the
+        // selection. Fixed-size values are written into the destination of
+        // each column. Variable-length values are appended to the data of
+        // each column and their lengths to the counts.
+        Long64_t n = 0;
+        for (Long64_t entry = start; entry < stop; entry += step) {
+            if (fEntryList && !fEntryList->Contains(entry)) {
+                continue;
+            }
+            Long64_t local = fTree->LoadTree(entry);
+            if (local < 0) {
+                break;
+            }
+            if (fSelection && !Passes()) {
+                continue;
+            }
+            for (size_t j = 0; j < fColumns.size(); ++j) {
+                Column& column = fColumns[j];
+                if (column.kind == FORMULA) {
+                    Double_t value = 0;
+                    if (column.formula->GetNdata() > 0) {
+                        value = column.formula->EvalInstance(0);
+                    }
+                    std::memcpy(column.destination + n * sizeof(Double_t),
+                                &value, sizeof(Double_t));
+                    continue;
+                }
+                if (column.kind == JAGGED_FORMULA) {
+                    AppendFormula(column);
+                    continue;
+                }
+                column.branch->GetEntry(local);
+                if (column.kind == FIXED) {
+                    std::memcpy(column.destination +
+                                    n * column.size * column.width,
+                                column.leaf->GetValuePointer(),
+                                column.size * column.width);
+                } else if (column.kind == JAGGED) {
+                    Long64_t length = column.leaf->GetLen();
+                    Append(column, static_cast<const char*>(
+                        column.leaf->GetValuePointer()), length);
+                } else {
+                    AppendVector(column);
+                }
+            }
+            ++n;
+        }
+        return n;
+    }
+
+    Long64_t GetDataSize(int column) const
+    {
+        return fColumns[column].data.size();
+    }
+
+    void CopyData(int column, long address)
+    {
+        std::vector<char>& data = fColumns[column].data;
+        if (!data.empty()) {
+            std::memcpy(reinterpret_cast<char*>(address),
+                        &data[0], data.size());
+        }
+    }
+
+    void CopyCounts(int column, long address)
+    {
+        std::vector<Long64_t>& counts = fColumns[column].counts;
+        if (!counts.empty()) {
+            std::memcpy(reinterpret_cast<char*>(address),
+                        &counts[0], counts.size() * sizeof(Long64_t));
+        }
+    }
+
+private:
+    struct Column
+    {
+        TBranch* branch;
+        TLeaf* leaf;
+        TTreeFormula* formula;
+        int kind;
+        int type;
+        int size;
+        int width;
+        char* destination;
+        std::vector<char> data;
+        std::vector<Long64_t> counts;
+    };
+
+    bool Passes()
+    {
+        // an entry passes if any instance of the selection passes as in
+        // TTree::Draw
+        int ndata = fSelection->GetNdata();
+        for (int i = 0; i < ndata; ++i) {
+            if (fSelection->EvalInstance(i) != 0) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    void AppendFormula(Column& column)
+    {
+        int ndata = column.formula->GetNdata();
+        for (int i = 0; i < ndata; ++i) {
+            Double_t value = column.formula->EvalInstance(i);
+            const char* source = reinterpret_cast<const char*>(&value);
+            column.data.insert(column.data.end(), source,
+                               source + sizeof(Double_t));
+        }
+        column.counts.push_back(ndata);
+    }
+
+    void Append(Column& column, const char* source, Long64_t length)
+    {
+        if (length > 0) {
+            column.data.insert(column.data.end(), source,
+                               source + length * column.size);
+        }
+        column.counts.push_back(length);
+    }
+
+    template <typename T>
+    void AppendVector(Column& column, void* object)
+    {
+        std::vector<T>* values = static_cast<std::vector<T>*>(object);
+        Append(column, values->empty() ? 0 :
+                   reinterpret_cast<const char*>(&(*values)[0]),
+               values->size());
+    }
+
+    void AppendVector(Column& column)
+    {
+        void* object = static_cast<TBranchElement*>(
+            column.branch)->GetObject();
+        if (!object) {
+            column.counts.push_back(0);
+            return;
+        }
+        switch (column.type) {
+            case 0: AppendVector<char>(column, object); break;
+            case 1: AppendVector<unsigned char>(column, object); break;
+            case 2: AppendVector<short>(column, object); break;
+            case 3: AppendVector<unsigned short>(column, object); break;
+            case 4: AppendVector<int>(column, object); break;
+            case 5: AppendVector<unsigned int>(column, object); break;
+            case 6: AppendVector<Long64_t>(column, object); break;
+            case 7: AppendVector<ULong64_t>(column, object); break;
+            case 8: AppendVector<float>(column, object); break;
+            case 9: AppendVector<double>(column, object); break;
+            case 10: AppendVector<long>(column, object); break;
+            case 11: AppendVector<unsigned long>(column, object); break;
+            default: column.counts.push_back(0);
+        }
+    }
+
+    TTree* fTree;
+    TTreeFormula* fSelection;
+    TEntryList* fEntryList;
+    bool fValid;
+    std::vector<Column> fColumns;
+};
+""", ["RootpyTreeReader"])
+
+_FIXED, _JAGGED, _VECTOR, _FORMULA, _JAGGED_FORMULA = range(5)
+
+# ROOT type names mapped to the NumPy type and the type code of the reader
+_TYPES = {
+    'Bool_t': ('bool', 1),
+    'Char_t': ('i1', 0),
+    'UChar_t': ('u1', 1),
+    'Short_t': ('i2', 2),
+    'UShort_t': ('u2', 3),
+    'Int_t': ('i4', 4),
+    'UInt_t': ('u4', 5),
+    'Long64_t': ('i8', 6),
+    'ULong64_t': ('u8', 7),
+    'Float_t': ('f4', 8),
+    'Double_t': ('f8', 9),
+    'Long_t': ('i8', 10),
+    'ULong_t': ('u8', 11),
+}
+
+# the element types of vectors
+_VECTOR_TYPES = {
+    'char': 'Char_t',
+    'unsigned char': 'UChar_t',
+    'short': 'Short_t',
+    'unsigned short': 'UShort_t',
+    'int': 'Int_t',
+    'unsigned int': 'UInt_t',
+    'long long': 'Long64_t',
+    'Long64_t': 'Long64_t',
+    'unsigned long long': 'ULong64_t',
+    'ULong64_t': 'ULong64_t',
+    'float': 'Float_t',
+    'double': 'Double_t',
+    'long': 'Long_t',
+    'unsigned long': 'ULong_t',
+}
+
+_VECTOR = re.compile(r'^vector<\s*(?P<type>.+?)\s*>$')
+_DIMENSIONS = re.compile(r'\[(\w+)\]')
+
+
+def _vector_dtype(classname):
+    """
+    Return the NumPy dtype of the elements of a vector class of a basic type
+    or None
+    """
+    if classname.startswith('std::'):
+        classname = classname[len('std::'):]
+    match = _VECTOR.match(classname)
+    if match is None:
+        return None
+    typename = _VECTOR_TYPES.get(match.group('type'))
+    if typename is None:
+        return None
+    return np.dtype(_TYPES[typename][0])
+
+
+class UnconvertibleWarning(UserWarning):
+    """
+    Issued for branches that cannot be converted into NumPy arrays
+    """
+
+
+class _Column(object):
+
+    def __init__(self, name, kind, typename, shape=()):
+        self.name = name
+        self.kind = kind
+        dtype, self.type = _TYPES[typename]
+        self.dtype = np.dtype(dtype)
+        self.shape = shape
+        self.width = int(np.prod(shape)) if shape else 1
+
+
+def _column(tree, name):
+    """
+    Return the description of a branch or None if it is not supported
+    """
+    branch = tree.GetBranch(name)
+    if not branch:
+        raise ValueError("branch `{0}` does not exist".format(name))
+    classname = branch.GetClassName()
+    if classname:
+        match = _VECTOR.match(classname)
+        if match is None:
+            return None
+        typename = _VECTOR_TYPES.get(match.group('type'))
+        if typename is None:
+            return None
+        return _Column(name, _VECTOR, typename)
+    leaves = branch.GetListOfLeaves()
+    if leaves.GetEntries() != 1:
+        # branches with many leaves are not supported
+        return None
+    leaf = leaves.At(0)
+    typename = leaf.GetTypeName()
+    if typename not in _TYPES or leaf.ClassName() == 'TLeafC':
+        # strings are not supported
+        return None
+    dimensions = _DIMENSIONS.findall(leaf.GetTitle())
+    if leaf.GetLeafCount():
+        # the first dimension is variable
+        shape = tuple(int(dim) for dim in dimensions[1:])
+        return _Column(name, _JAGGED, typename, shape)
+    shape = tuple(int(dim) for dim in dimensions)
+    return _Column(name, _FIXED, typename, shape)
+
+
+def _columns(tree, branches):
+    columns = []
+    for name in branches:
+        if not tree.GetBranch(name):
+            # evaluate anything that is not a branch with TTreeFormula
+            columns.append(_Column(name, _FORMULA, 'Double_t'))
+            continue
+        column = _column(tree, name)
+        if column is None:
+            raise TypeError(
+                "branch `{0}` cannot be converted into an array".format(name))
+        columns.append(column)
+    return columns
+
+
+def _default_branches(tree):
+    """
+    The names of all active branches that can be converted into arrays
+    """
+    names = []
+    for branch in tree.GetListOfBranches():
+        name = branch.GetName()
+        if not tree.GetBranchStatus(name):
+            continue
+        if _column(tree, name) is None:
+            warnings.warn(
+                "ignoring branch `{0}` that cannot be "
+                "converted into an array".format(name),
+                UnconvertibleWarning)
+            continue
+        names.append(name)
+    return names
+
+
+def _range(tree, start, stop, step):
+    entries = tree.GetEntries()
+    if start is None:
+        start = 0
+    if stop is None or stop > entries:
+        stop = entries
+    if step is None:
+        step = 1
+    if step < 1:
+        raise ValueError("step must be positive")
+    return max(0, start), stop, step
+
+
+def read(tree, branches, selection=None, start=None, stop=None, step=None,
+         entry_list=None):
+    """
+    Read branches of the entries in [start, stop) with a step passing a
+    selection into a ``rootpy.tree.treebuffer.Batch`` of NumPy arrays.
+    If a TEntryList ``entry_list`` is given only its entries are read.
+    Fixed-length arrays have one dimension per dimension of the array and
+    variable-length arrays and vectors are object arrays of arrays. Names
+    that are not branches are evaluated as expressions in double precision
+    with one value per entry or, if the expression has a variable number of
+    instances, an array per entry.
+    """
+    if isinstance(branches, string_types):
+        branches = [branches]
+    columns = _columns(tree, branches)
+    start, stop, step = _range(tree, start, stop, step)
+    reader = C.RootpyTreeReader(tree, str(Cut(selection)))
+    if not reader.IsValid():
+        raise ValueError("invalid selection `{0}`".format(selection))
+    if entry_list:
+        reader.SetEntryList(entry_list)
+    size = max(0, (stop - start + step - 1) // step)
+    outputs = []
+    for column in columns:
+        if column.kind == _FORMULA:
+            index = reader.AddFormula(column.name)
+            if index < 0:
+                raise ValueError(
+                    "`{0}` is neither a branch nor a valid "
+                    "expression".format(column.name))
+            column.kind = reader.GetKind(index)
+        else:
+            index = reader.AddColumn(
+                column.name, column.kind, column.type,
+                column.dtype.itemsize, column.width)
+        if column.kind in (_FIXED, _FORMULA):
+            # preallocate the output for all entries in the range
+            output = np.empty((size,) + column.shape, dtype=column.dtype)
+            reader.SetDestination(index, output.ctypes.data)
+        else:
+            output = None
+        outputs.append((index, column, output))
+    n = reader.Read(start, stop, step) if size else 0
+    batch = Batch()
+    for index, column, output in outputs:
+        if column.kind in (_FIXED, _FORMULA):
+            batch[column.name] = output[:n]
+            continue
+        counts = np.empty(n, dtype=np.int64)
+        reader.CopyCounts(index, counts.ctypes.data)
+        data = np.empty(reader.GetDataSize(index) // column.dtype.itemsize,
+                        dtype=column.dtype)
+        reader.CopyData(index, data.ctypes.data)
+        data = data.reshape((-1,) + column.shape)
+        if column.shape:
+            # the lengths count the elements of the inner dimensions
+            counts //= column.width
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        batch[column.name] = _split(data, offsets)
+    return batch
+
+
+def iter_read(tree, branches, selection=None, start=None, stop=None,
+              step=None, chunk_size=100000):
+    """
+    Iterate over the output of ``read`` in chunks of ``chunk_size``
+    consecutive entries (before the selection)
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+    start, stop, step = _range(tree, start, stop, step)
+    chunk_size *= step
+    for chunk_start in range(start, stop, chunk_size):
+        yield read(tree, branches, selection,
+                   chunk_start, min(chunk_start + chunk_size, stop), step)
+
+
+def tree2array(tree, branches=None, selection=None,
+               start=None, stop=None, step=None,
+               include_weight=False, weight_name='weight', **kwargs):
+    """
+    Convert a tree into a NumPy structured array as with
+    ``root_numpy.tree2array``. As with root_numpy, the branches may also be
+    expressions (see ``read``). Any other keyword arguments of
+    ``root_numpy.tree2array`` are passed on to root_numpy if it is installed.
+    """
+    if kwargs:
+        try:
+            from root_numpy import tree2array as root_numpy_tree2array
+        except ImportError:
+            raise TypeError(
+                "unsupported arguments {0} require root_numpy".format(
+                    ', '.join(sorted(kwargs))))
+        return root_numpy_tree2array(
+            tree, branches=branches, selection=selection,
+            start=start, stop=stop, step=step,
+            include_weight=include_weight, weight_name=weight_name,
+            **kwargs)
+    if branches is None:
+        branches = _default_branches(tree)
+    elif isinstance(branches, string_types):
+        branches = [branches]
+    if not branches:
+        raise RuntimeError("no branches can be converted into arrays")
+    batch = read(tree, branches, selection, start, stop, step)
+    fields = []
+    for name, column in batch.items():
+        if column.dtype == object:
+            fields.append((name, object))
+        else:
+            fields.append((name, column.dtype, column.shape[1:]))
+    if include_weight:
+        fields.append((weight_name, np.float64))
+    array = np.empty(batch.size, dtype=fields)
+    for name, column in batch.items():
+        array[name] = column
+    if include_weight:
+        array[weight_name] = tree.GetWeight()
+    return array
@@ -0,0 +1,123 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements TreeBuffers where the scalar variables are stored in
+the fields of a single NumPy structured record that the branches point into
+(see ``rootpy.tree.Tree`` with ``record=True``). A whole entry can then be set
+with one assignment and the scalar variables are reset with one copy.
+"""
+from __future__ import absolute_import
+
+try:
+    from collections import OrderedDict
+except ImportError:  # py 2.6
+    from ..extern.ordereddict import OrderedDict
+
+import numpy as np
+
+from .treetypes import Scalar, ScalarOperators, BaseScalar
+
+__all__ = [
+    'RecordScalar',
+    'TreeRecord',
+]
+
+
+class RecordScalar(ScalarOperators, Scalar):
+    """
+    A scalar variable stored in a field of a ``TreeRecord``. The variable has
+    the same interface as the ``BaseScalar`` it replaces.
+    """
+    def __init__(self, record, name, variable):
+        # a view of the field with the address used by the branch
+        self.buffer = record.array[name]
+        self.type = variable.type
+        self.typename = variable.typename
+        self.typecode = variable.typecode
+        self.default = variable.default
+        self.convert = variable.convert
+        self.resetable = variable.resetable
+
+    def reset(self):
+        """Reset the value to the default"""
+        if self.resetable:
+            self.buffer[0] = self.default
+
+    @property
+    def value(self):
+        """The current value"""
+        return self.buffer[0].item()
+
+    def set(self, value):
+        """Set the value"""
+        if isinstance(value, ScalarOperators):
+            value = value.value
+        self.buffer[0] = self.convert(value)
+
+    def __getitem__(self, i):
+        return self.value
+
+    def __setitem__(self, i, value):
+        self.set(value)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        return "{0}({1}) at {2}".format(
+            self.__class__.__name__, repr(self.value), hex(id(self)))
+
+
+class TreeRecord(object):
+    """
+    Move the scalar variables of a TreeBuffer into the fields of a NumPy
+    structured record of one element. The variables in the TreeBuffer are
+    replaced by ``RecordScalar`` views of the fields, so the values are still
+    set by attribute, but a whole entry can also be set at once with ``set``.
+    This must be done before the branches are created.
+    """
+    def __init__(self, treebuffer):
+        names = [name for name, value in treebuffer.items()
+                 if isinstance(value, BaseScalar)]
+        # align the fields so that the branch addresses are aligned
+        dtype = np.dtype([(name, np.dtype(treebuffer[name].typecode))
+                          for name in names], align=True)
+        self.names = frozenset(names)
+        self.array = np.zeros(1, dtype=dtype)
+        self.defaults = np.zeros(1, dtype=dtype)
+        # the fields that are not reset
+        self.keep = []
+        self.variables = OrderedDict()
+        for name in names:
+            variable = treebuffer[name]
+            self.array[name] = variable.value
+            self.defaults[name] = variable.default
+            if not variable.resetable:
+                self.keep.append(name)
+            self.variables[name] = RecordScalar(self, name, variable)
+        for name, variable in self.variables.items():
+            treebuffer[name] = variable
+        treebuffer._record = self
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    def set(self, values):
+        """
+        Set all fields at once from a tuple of values in the order of the
+        fields or from a record of a structured array with the same dtype
+        """
+        self.array[0] = values
+
+    def reset(self):
+        """
+        Reset the fields to their default values
+        """
+        if self.keep:
+            kept = [self.array[name][0] for name in self.keep]
+            self.array[...] = self.defaults
+            for name, value in zip(self.keep, kept):
+                self.array[name] = value
+        else:
+            self.array[...] = self.defaults
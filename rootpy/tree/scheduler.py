@@ -0,0 +1,352 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements a scheduler that distributes ranges of entries of the
+trees in many files across worker processes (see
+``rootpy.tree.TreeChain.map_reduce``). Unlike ``TreeQueue``, which hands out
+whole files, the work is divided into cluster-aligned ranges of entries sized
+by entries and bytes. When no ranges remain, an idle worker steals the second
+half of the range of the busiest worker so that one large file does not leave
+the other workers idle. Ranges of workers that crash are retried.
+"""
+from __future__ import absolute_import
+
+import bisect
+import multiprocessing
+import time
+import traceback
+from collections import deque
+
+from . import log; log = log[__name__]
+from ..extern.six.moves import queue
+from ..io import root_open, DoesNotExist
+from .parallel import cluster_ranges, _fork_context
+
+__all__ = [
+    'Scheduler',
+]
+
+
+def _work(worker_id, tasks, results, control, state):
+    """
+    The loop of a worker process. ``control`` is a shared array of the entry
+    at which the current cluster ends and the entry at which the worker must
+    stop (or -1), both protected by the lock of the array.
+    """
+    from .chain import TreeChain
+    files = state['files']
+    filters = state['filters']
+    func = state['func']
+    init = state['init']
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        uid, file_index, start, stop = task
+        t0 = time.time()
+        try:
+            filters.reset()
+            output = init() if init is not None else {}
+            chain = TreeChain(state['name'], [files[file_index]],
+                              filters=filters, **state['kwargs'])
+            try:
+                chain._select_entries()
+                tree = chain._tree
+                entries = 0
+                end = start
+                for first, last in tree.clusters(start, stop):
+                    with control.get_lock():
+                        if 0 <= control[1] <= first:
+                            # the remaining clusters were stolen
+                            break
+                        control[0] = last
+                    for event in tree.iter_range(first, last):
+                        entries += 1
+                        chain.userdata = {}
+                        if filters(event):
+                            func(event, output)
+                    end = last
+            finally:
+                # close the file since workers process many units
+                chain.reset()
+            filters.finalize()
+            results.put(('done', worker_id, uid, end, output,
+                         filters.basic(), entries, time.time() - t0))
+        except Exception:
+            results.put(('error', worker_id, uid, traceback.format_exc()))
+
+
+class _Worker(object):
+
+    def __init__(self, worker_id, results, state, context):
+        self.id = worker_id
+        self.tasks = context.Queue()
+        self.control = context.Array('q', [0, -1])
+        self.process = context.Process(
+            target=_work,
+            args=(worker_id, self.tasks, results, self.control, state))
+        self.process.daemon = True
+        self.process.start()
+
+    def assign(self, uid, unit):
+        with self.control.get_lock():
+            self.control[0] = unit[1]
+            self.control[1] = -1
+        self.tasks.put((uid, unit[0], unit[1], unit[2]))
+
+    def stop(self):
+        if self.process.is_alive():
+            self.tasks.put(None)
+
+
+class Scheduler(object):
+    """
+    Distribute cluster-aligned ranges of entries of the trees in many files
+    across a pool of worker processes with work stealing. This is an
+    alternative backend for ``TreeChain.map_reduce``:
+
+    .. sourcecode:: python
+
+        >>> scheduler = Scheduler(workers=8)
+        >>> output = chain.map_reduce(func, init, scheduler=scheduler)
+        >>> scheduler.stats
+
+    Parameters
+    ----------
+    workers : int, optional (default=None)
+        The number of worker processes. By default use one worker per CPU.
+
+    entries_per_unit : int, optional (default=None)
+        The maximum number of entries in the initial ranges. By default the
+        entries of all files are divided into about four ranges per worker.
+
+    bytes_per_unit : int, optional (default=128 MB)
+        The maximum number of compressed bytes in the initial ranges
+
+    min_entries : int, optional (default=1000)
+        Do not steal ranges with fewer entries
+
+    max_retries : int, optional (default=2)
+        The number of times a range is retried if its worker crashes
+
+    poll : float, optional (default=1.)
+        The interval in seconds at which the workers are checked for crashes
+    """
+    def __init__(self, workers=None, entries_per_unit=None,
+                 bytes_per_unit=128 * 1024 ** 2, min_entries=1000,
+                 max_retries=2, poll=1.):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = max(1, workers)
+        self.entries_per_unit = entries_per_unit
+        self.bytes_per_unit = bytes_per_unit
+        self.min_entries = min_entries
+        self.max_retries = max_retries
+        self.poll = poll
+        self.stats = {}
+        self.retries = 0
+        self.steals = 0
+
+    def _plan(self, name, files):
+        """
+        Return the cluster boundaries of the tree in each file and the
+        initial units of work as [file index, start, stop, attempts]
+        """
+        trees = []
+        for file_index, filename in enumerate(files):
+            with root_open(filename) as rfile:
+                try:
+                    tree = rfile.Get(name)
+                except DoesNotExist:
+                    log.warning(
+                        "tree {0} does not exist in file {1} "
+                        "(skipping)".format(name, filename))
+                    continue
+                clusters = tree.clusters()
+                if not clusters:
+                    continue
+                entries = tree.GetEntries()
+                trees.append((file_index, clusters,
+                              float(tree.GetZipBytes()) / entries))
+        total = sum(clusters[-1][1] for _, clusters, _ in trees)
+        entries_per_unit = self.entries_per_unit
+        if entries_per_unit is None:
+            entries_per_unit = total // (4 * self.workers)
+        boundaries = {}
+        units = deque()
+        for file_index, clusters, bytes_per_entry in trees:
+            boundaries[file_index] = [start for start, _ in clusters] + [
+                clusters[-1][1]]
+            entries = entries_per_unit
+            if self.bytes_per_unit and bytes_per_entry > 0:
+                entries = min(entries,
+                              int(self.bytes_per_unit / bytes_per_entry))
+            for start, stop in cluster_ranges(clusters, max(1, entries)):
+                units.append([file_index, start, stop, 0])
+        return boundaries, units
+
+    def _steal(self, workers, assigned, boundaries):
+        """
+        Split the range of the worker with the most remaining entries at the
+        cluster boundary nearest its middle and return the second half
+        """
+        candidates = []
+        for worker_id, (uid, unit) in assigned.items():
+            worker = workers[worker_id]
+            candidates.append((unit[2] - worker.control[0], worker_id))
+        for remaining, worker_id in sorted(candidates, reverse=True):
+            if remaining < 2 * self.min_entries:
+                break
+            uid, unit = assigned[worker_id]
+            lock = workers[worker_id].control.get_lock()
+            if not lock.acquire(timeout=self.poll):
+                continue
+            try:
+                control = workers[worker_id].control
+                position = control[0]
+                edges = boundaries[unit[0]]
+                index = bisect.bisect_left(edges, (position + unit[2]) // 2)
+                if index >= len(edges) or edges[index] >= unit[2]:
+                    index -= 1
+                middle = edges[index]
+                if middle <= position or middle >= unit[2]:
+                    continue
+                control[1] = middle
+            finally:
+                lock.release()
+            stolen = [unit[0], middle, unit[2], 0]
+            unit[2] = middle
+            self.steals += 1
+            log.debug("stole entries [{0:d}, {1:d}) from worker {2:d}".format(
+                middle, stolen[2], worker_id))
+            return stolen
+        return None
+
+    def map(self, name, files, func, init, filters, kwargs):
+        """
+        Process the tree ``name`` in ``files`` as ``rootpy.tree.parallel.
+        map_files`` and yield the output for each range of entries and the
+        corresponding cutflow in the order of the entries and files
+        """
+        self.stats = {}
+        self.retries = 0
+        self.steals = 0
+        boundaries, pending = self._plan(name, files)
+        if not pending:
+            return
+        # the order in which the outputs are yielded
+        order = deque(
+            (file_index, edges[0], edges[-1])
+            for file_index, edges in sorted(boundaries.items()))
+        state = {
+            'name': name,
+            'files': files,
+            'func': func,
+            'init': init,
+            'filters': filters,
+            'kwargs': kwargs,
+        }
+        # fork the workers so they inherit the functions and filters
+        # without pickling them
+        context = _fork_context()
+        results = context.Queue()
+        workers = {}
+        next_worker = 0
+        for _ in range(min(self.workers, len(pending))):
+            workers[next_worker] = _Worker(
+                next_worker, results, state, context)
+            next_worker += 1
+        assigned = {}
+        completed = {}
+        next_uid = 0
+        try:
+            while pending or assigned:
+                # check for crashed workers
+                for worker_id, worker in list(workers.items()):
+                    if worker.process.is_alive():
+                        continue
+                    del workers[worker_id]
+                    log.warning("worker {0:d} exited with code {1}".format(
+                        worker_id, worker.process.exitcode))
+                    if worker_id in assigned:
+                        _, unit = assigned.pop(worker_id)
+                        unit[3] += 1
+                        if unit[3] > self.max_retries:
+                            raise RuntimeError(
+                                "entries [{0:d}, {1:d}) of file {2} failed "
+                                "{3:d} times".format(
+                                    unit[1], unit[2], files[unit[0]],
+                                    unit[3]))
+                        self.retries += 1
+                        pending.appendleft(unit)
+                    workers[next_worker] = _Worker(
+                        next_worker, results, state, context)
+                    next_worker += 1
+                # hand out work to idle workers
+                for worker_id, worker in workers.items():
+                    if worker_id in assigned:
+                        continue
+                    if not pending and assigned:
+                        stolen = self._steal(workers, assigned, boundaries)
+                        if stolen is not None:
+                            pending.append(stolen)
+                    if not pending:
+                        break
+                    unit = pending.popleft()
+                    worker.assign(next_uid, unit)
+                    assigned[worker_id] = (next_uid, unit)
+                    next_uid += 1
+                try:
+                    message = results.get(timeout=self.poll)
+                except queue.Empty:
+                    continue
+                worker_id, uid = message[1], message[2]
+                if (worker_id not in assigned or
+                        assigned[worker_id][0] != uid):
+                    # a late message of a worker considered crashed
+                    continue
+                _, unit = assigned.pop(worker_id)
+                if message[0] == 'error':
+                    raise RuntimeError(
+                        "worker {0:d} failed on entries [{1:d}, {2:d}) "
+                        "of file {3}:\n{4}".format(
+                            worker_id, unit[1], unit[2],
+                            files[unit[0]], message[3]))
+                end, output, cutflow, entries, elapsed = message[3:]
+                if end < unit[2]:
+                    # should not happen but do not lose the entries
+                    pending.appendleft([unit[0], end, unit[2], 0])
+                completed[(unit[0], unit[1])] = (end, output, cutflow)
+                stats = self.stats.setdefault(worker_id, {
+                    'units': 0, 'entries': 0, 'time': 0.})
+                stats['units'] += 1
+                stats['entries'] += entries
+                stats['time'] += elapsed
+                stats['rate'] = stats['entries'] / max(stats['time'], 1e-9)
+                # yield the outputs following the order of the entries
+                while order and (order[0][0], order[0][1]) in completed:
+                    file_index, start, stop = order.popleft()
+                    end, output, cutflow = completed.pop((file_index, start))
+                    if end < stop:
+                        order.appendleft((file_index, end, stop))
+                    else:
+                        log.info("processed file {0}".format(
+                            files[file_index]))
+                    yield output, cutflow
+        except BaseException:
+            for worker in workers.values():
+                worker.process.terminate()
+            raise
+        finally:
+            for worker in workers.values():
+                worker.stop()
+            for worker in workers.values():
+                worker.process.join(self.poll)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+        for worker_id, stats in sorted(self.stats.items()):
+            log.info(
+                "worker {0:d}: {1:d} entries in {2:d} ranges "
+                "({3:.0f} entries per second)".format(
+                    worker_id, stats['entries'], stats['units'],
+                    stats['rate']))
@@ -0,0 +1,219 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements an external merge sort of the entries of a tree by the
+values of one or more expressions (see ``rootpy.tree.Tree.sorted_copy``).
+The tree is split into runs of entries that are sorted in memory by their
+keys and written into temporary ROOT files. The runs are then merged into the
+output tree with a k-way merge of their keys so that only one run of keys and
+the baskets being read are held in memory at a time.
+"""
+from __future__ import absolute_import
+
+import heapq
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import ROOT
+
+from . import log; log = log[__name__]
+from .. import asrootpy
+from .. import compiled as C
+from ..context import preserve_current_directory
+from ..extern.six import string_types
+from ..extern.six.moves import range
+from ..io import TemporaryFile
+
+__all__ = [
+    'sorted_copy',
+]
+
+C.register_code("""
+#include <TTree.h>
+#include <TObjArray.h>
+
+Long64_t rootpy_tree_copy_entries(TTree* source, TTree* output,
+                                  Long64_t n, long entries)
+{
+    // Read the entries of the source tree in the given order and fill the
+    // output tree (a clone sharing the branch addresses of the source)
+    const Long64_t* entry = reinterpret_cast<const Long64_t*>(entries);
+    Long64_t nbytes = 0;
+    for (Long64_t i = 0; i < n; ++i) {
+        if (source->GetEntry(entry[i]) < 0) {
+            return -1;
+        }
+        int nb = output->Fill();
+        if (nb < 0) {
+            return -1;
+        }
+        nbytes += nb;
+    }
+    return nbytes;
+}
+
+Long64_t rootpy_tree_merge_entries(TObjArray* sources, TTree* output,
+                                   Long64_t n, long runs, long entries)
+{
+    // Read the entries of the runs in the merged order and fill the output
+    // tree. All runs share the branch addresses of the output tree.
+    const int* run = reinterpret_cast<const int*>(runs);
+    const Long64_t* entry = reinterpret_cast<const Long64_t*>(entries);
+    Long64_t nbytes = 0;
+    for (Long64_t i = 0; i < n; ++i) {
+        TTree* source = static_cast<TTree*>(sources->UncheckedAt(run[i]));
+        if (source->GetEntry(entry[i]) < 0) {
+            return -1;
+        }
+        int nb = output->Fill();
+        if (nb < 0) {
+            return -1;
+        }
+        nbytes += nb;
+    }
+    return nbytes;
+}
+""", ["rootpy_tree_copy_entries", "rootpy_tree_merge_entries"])
+
+
+def _sort_keys(tree, expressions, start, stop, batch_size, dtype=None):
+    """
+    Evaluate the key expressions on the entries in [start, stop) and return
+    a structured array of the keys sorted by the values of the expressions
+    and then by entry
+    """
+    branches = set()
+    for expression in expressions:
+        branches.update(expression.branches)
+    columns = [[] for expression in expressions]
+    for batch in tree.iter_batches(sorted(branches), batch_size=batch_size,
+                                   start=start, stop=stop):
+        for expression, column in zip(expressions, columns):
+            values = np.asarray(expression(batch))
+            if values.ndim == 0:
+                values = np.repeat(values, batch.size)
+            if values.ndim != 1 or values.dtype == object:
+                raise ValueError(
+                    "the sort key `{0}` does not have one value "
+                    "per entry".format(expression.string))
+            column.append(values)
+    columns = [np.concatenate(column) for column in columns]
+    if dtype is None:
+        dtype = np.dtype(
+            [('key{0:d}'.format(i), column.dtype)
+             for i, column in enumerate(columns)] +
+            [('entry', np.int64)])
+    keys = np.empty(stop - start, dtype=dtype)
+    for name, column in zip(dtype.names, columns):
+        keys[name] = column
+    keys['entry'] = np.arange(start, stop, dtype=np.int64)
+    # the entry makes every key unique so the sort is stable
+    keys.sort(order=dtype.names)
+    return keys
+
+
+def _iter_run(run, keys, chunk_size):
+    """
+    Yield the keys of a run with the run number and the entry in the run
+    """
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size].tolist()
+        for local, key in enumerate(chunk, start):
+            yield key, run, local
+
+
+def _copy(source, output, entries):
+    entries = np.ascontiguousarray(entries, dtype=np.int64)
+    if C.rootpy_tree_copy_entries(
+            source, output, len(entries), entries.ctypes.data) < 0:
+        raise IOError("unable to copy the entries of the tree")
+
+
+def _merge(sources, output, runs, entries):
+    runs = np.asarray(runs, dtype=np.intc)
+    entries = np.asarray(entries, dtype=np.int64)
+    if C.rootpy_tree_merge_entries(
+            sources, output, len(entries),
+            runs.ctypes.data, entries.ctypes.data) < 0:
+        raise IOError("unable to merge the sorted runs")
+
+
+def sorted_copy(tree, keys, output=None, run_size=1000000,
+                batch_size=100000, tmpdir=None):
+    """
+    Copy the entries of a tree into a new tree ordered by the values of one
+    or more expressions. See ``rootpy.tree.Tree.sorted_copy``.
+    """
+    from .expression import compile
+    if isinstance(keys, string_types):
+        keys = [keys]
+    if not keys:
+        raise ValueError("no sort keys given")
+    if run_size < 1:
+        raise ValueError("run_size must be positive")
+    expressions = [compile(key) for key in keys]
+    entries = tree.GetEntries()
+    with preserve_current_directory():
+        if output is not None:
+            output.cd()
+        # the clone shares the branch addresses of the tree
+        sorted_tree = tree.CloneTree(0)
+    if entries == 0:
+        return asrootpy(sorted_tree)
+    if entries <= run_size:
+        # sort in memory
+        order = _sort_keys(tree, expressions, 0, entries, batch_size)
+        for start in range(0, entries, batch_size):
+            _copy(tree, sorted_tree, order['entry'][start:start + batch_size])
+        return asrootpy(sorted_tree)
+    tmpdir = tempfile.mkdtemp(dir=tmpdir)
+    files = []
+    try:
+        # write the sorted runs and their keys
+        sources = ROOT.TObjArray()
+        runs = []
+        dtype = None
+        for start in range(0, entries, run_size):
+            stop = min(start + run_size, entries)
+            run_keys = _sort_keys(
+                tree, expressions, start, stop, batch_size, dtype)
+            dtype = run_keys.dtype
+            filename = os.path.join(
+                tmpdir, 'run{0:d}.npy'.format(len(runs)))
+            np.save(filename, run_keys)
+            run_file = TemporaryFile(dir=tmpdir)
+            files.append(run_file)
+            with preserve_current_directory():
+                run_file.cd()
+                run_tree = tree.CloneTree(0)
+            for chunk in range(0, len(run_keys), batch_size):
+                _copy(tree, run_tree,
+                      run_keys['entry'][chunk:chunk + batch_size])
+            run_tree.FlushBaskets()
+            sources.Add(run_tree)
+            runs.append(np.load(filename, mmap_mode='r'))
+            del run_keys
+        log.debug("merging {0:d} sorted runs".format(len(runs)))
+        # merge the runs. All run trees and the output tree are clones of
+        # the tree and share its branch addresses.
+        merged = heapq.merge(*[_iter_run(run, run_keys, batch_size)
+                               for run, run_keys in enumerate(runs)])
+        run_numbers, run_entries = [], []
+        for key, run, local in merged:
+            run_numbers.append(run)
+            run_entries.append(local)
+            if len(run_entries) == batch_size:
+                _merge(sources, sorted_tree, run_numbers, run_entries)
+                run_numbers, run_entries = [], []
+        if run_entries:
+            _merge(sources, sorted_tree, run_numbers, run_entries)
+        # close the memory maps
+        del runs
+    finally:
+        for run_file in files:
+            run_file.Close()
+        shutil.rmtree(tmpdir)
+    return asrootpy(sorted_tree)
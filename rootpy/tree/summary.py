@@ -0,0 +1,249 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements mergeable summary statistics of the values of an
+expression that are accumulated in a single pass over batches of tree entries
+(see ``rootpy.tree.Tree.describe``). The minimum, maximum and (weighted) sums
+are exact. The mean and variance are accumulated with the numerically stable
+pairwise update of Chan et al. and the quantiles are estimated from a
+weighted reservoir sample of the values.
+"""
+from __future__ import absolute_import
+
+import numpy as np
+
+__all__ = [
+    'Summary',
+]
+
+
+def _flatten(values, weights):
+    """
+    Flatten multidimensional and variable-length values, repeat the weights
+    of each entry for each of its values and drop NaN values
+    """
+    values = np.asarray(values)
+    if values.dtype == object:
+        lengths = np.array([len(row) for row in values], dtype=np.intp)
+        if len(values):
+            values = np.concatenate(
+                [np.asarray(row, dtype=np.float64) for row in values])
+        else:
+            values = np.empty(0, dtype=np.float64)
+        weights = np.repeat(weights, lengths)
+    elif values.ndim > 1:
+        size = int(np.prod(values.shape[1:]))
+        values = values.reshape(-1)
+        weights = np.repeat(weights, size)
+    values = values.astype(np.float64)
+    keep = ~np.isnan(values)
+    if not keep.all():
+        values = values[keep]
+        weights = weights[keep]
+    return values, weights
+
+
+class Summary(object):
+    """
+    Summary statistics of the values of an expression. If the values of an
+    entry are arrays then each element is counted as a separate value with
+    the weight of the entry (as in ``TTree::Draw``).
+
+    Parameters
+    ----------
+    expression : str, optional (default=None)
+        The summarized expression
+
+    reservoir_size : int, optional (default=10000)
+        The number of values sampled to estimate the quantiles
+
+    seed : int, optional (default=None)
+        The seed of the random number generator used for the sampling. By
+        default each Summary draws a different random stream so that the
+        samples of summaries that are merged are independent. Summaries
+        that are merged must not share a seed.
+    """
+    def __init__(self, expression=None, reservoir_size=10000, seed=None):
+        self.expression = expression
+        self.reservoir_size = reservoir_size
+        self.entries = 0
+        self.sum_weights = 0.
+        self.sum_weights2 = 0.
+        self.sum = 0.
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.
+        self._m2 = 0.
+        self._sample = np.empty(0, dtype=np.float64)
+        self._keys = np.empty(0, dtype=np.float64)
+        self._weights = np.empty(0, dtype=np.float64)
+        # whether the sample was reduced to the reservoir
+        self._sampled = False
+        self._random = np.random.RandomState(seed)
+
+    def fill(self, values, weights=None):
+        """
+        Add an array of values with optional weights
+        """
+        values = np.asarray(values)
+        if weights is None:
+            weights = np.ones(len(values), dtype=np.float64)
+        else:
+            weights = np.broadcast_to(
+                np.asarray(weights, dtype=np.float64), (len(values),))
+        values, weights = _flatten(values, weights)
+        if len(values) == 0:
+            return
+        sum_weights = weights.sum()
+        if sum_weights != 0:
+            mean = np.dot(weights, values) / sum_weights
+            m2 = np.dot(weights, (values - mean) ** 2)
+        else:
+            mean, m2 = 0., 0.
+        # weighted reservoir sampling (Efraimidis and Spirakis) where the
+        # values with the largest keys log(u) / w are kept
+        positive = weights > 0
+        keys = np.full(len(values), -np.inf)
+        keys[positive] = (np.log(self._random.uniform(size=positive.sum())) /
+                          weights[positive])
+        self._update(
+            entries=len(values),
+            sum_weights=sum_weights,
+            sum_weights2=np.dot(weights, weights),
+            sum=np.dot(weights, values),
+            min=values.min(),
+            max=values.max(),
+            mean=mean,
+            m2=m2,
+            sample=values[positive],
+            keys=keys[positive],
+            weights=weights[positive],
+            sampled=False)
+
+    def _update(self, entries, sum_weights, sum_weights2, sum, min, max,
+                mean, m2, sample, keys, weights, sampled):
+        total_weights = self.sum_weights + sum_weights
+        if total_weights != 0:
+            delta = mean - self.mean
+            self.mean += delta * sum_weights / total_weights
+            self._m2 += (m2 + delta ** 2 *
+                         self.sum_weights * sum_weights / total_weights)
+        self.entries += entries
+        self.sum_weights = total_weights
+        self.sum_weights2 += sum_weights2
+        self.sum += sum
+        self.min = min if min < self.min else self.min
+        self.max = max if max > self.max else self.max
+        sample = np.concatenate([self._sample, sample])
+        keys = np.concatenate([self._keys, keys])
+        weights = np.concatenate([self._weights, weights])
+        self._sampled = self._sampled or sampled
+        if len(sample) > self.reservoir_size:
+            keep = np.argpartition(
+                keys, len(keys) - self.reservoir_size)[-self.reservoir_size:]
+            sample = sample[keep]
+            keys = keys[keep]
+            weights = weights[keep]
+            self._sampled = True
+        self._sample = sample
+        self._keys = keys
+        self._weights = weights
+
+    def merge(self, other):
+        """
+        Merge the statistics of another Summary into this one
+        """
+        self._update(
+            entries=other.entries,
+            sum_weights=other.sum_weights,
+            sum_weights2=other.sum_weights2,
+            sum=other.sum,
+            min=other.min,
+            max=other.max,
+            mean=other.mean,
+            m2=other._m2,
+            sample=other._sample,
+            keys=other._keys,
+            weights=other._weights,
+            sampled=other._sampled)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def variance(self):
+        """
+        The weighted variance of the values
+        """
+        if self.sum_weights == 0:
+            return np.nan
+        return self._m2 / self.sum_weights
+
+    @property
+    def std(self):
+        """
+        The weighted standard deviation of the values
+        """
+        return np.sqrt(self.variance)
+
+    @property
+    def effective_entries(self):
+        """
+        The effective number of entries (sum of weights)^2 / (sum of squared
+        weights)
+        """
+        if self.sum_weights2 == 0:
+            return 0.
+        return self.sum_weights ** 2 / self.sum_weights2
+
+    def quantile(self, q):
+        """
+        Return the approximate (weighted) quantile or an array of quantiles
+        for ``q`` in [0, 1]
+        """
+        if len(self._sample) == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        order = np.argsort(self._sample, kind='mergesort')
+        values = self._sample[order]
+        if self._sampled:
+            # the values in the reservoir were sampled with probabilities
+            # proportional to their weights
+            weights = np.ones(len(values))
+        else:
+            weights = self._weights[order]
+        # interpolate between the midpoints of the cumulative weights
+        cumulative = np.cumsum(weights)
+        positions = (cumulative - .5 * weights) / cumulative[-1]
+        return np.interp(q, positions, values)
+
+    @property
+    def median(self):
+        """
+        The approximate (weighted) median
+        """
+        return self.quantile(.5)
+
+    def as_dict(self):
+        """
+        Return the statistics as a dict
+        """
+        return {
+            'entries': self.entries,
+            'sum_weights': self.sum_weights,
+            'sum_weights2': self.sum_weights2,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'variance': self.variance,
+            'std': self.std,
+            'median': self.median,
+        }
+
+    def __repr__(self):
+        return (
+            "Summary('{0}', entries={1:d}, min={2:g}, max={3:g}, "
+            "mean={4:g}, std={5:g})").format(
+                self.expression, self.entries,
+                self.min, self.max, self.mean, self.std)
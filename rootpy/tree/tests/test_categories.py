@@ -1,6 +1,7 @@
 # Copyright 2012 the rootpy developers
 # distributed under the terms of the GNU General Public License
 from rootpy.tree.categories import Categories
+from nose.plugins.skip import SkipTest
 from nose.tools import assert_raises
 
 GOOD = [
@@ -43,6 +44,32 @@ def test_len():
     assert len(c) == 4
 
 
+def test_compile():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    random = np.random.RandomState(1)
+    columns = {
+        'a': random.uniform(0, 4, 1000),
+        'b': random.uniform(3, 7, 1000),
+    }
+    c = Categories.from_string('{a|1,2,3*}x{b|*4,5,6*}')
+    compiled = c.compile()
+    assert compiled.branches == ['a', 'b']
+    assert len(compiled) == len(c)
+    index = compiled(columns)
+    # compare with the cuts of each category
+    expected = np.empty(1000, dtype=int)
+    expected.fill(-1)
+    for i, cut in enumerate(compiled.cuts):
+        expected[cut.compile().mask(columns)] = i
+    assert (index == expected).all()
+    counts, yields = compiled.counts(columns, weights=2.)
+    assert counts.sum() == (index >= 0).sum()
+    assert (yields == 2 * counts).all()
+
+
 if __name__ == "__main__":
     import nose
     nose.runmodule()
@@ -0,0 +1,86 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+from rootpy.tree import Cut
+
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal, assert_raises
+
+
+def get_columns():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    return {
+        'x': np.array([1., 4., 9., -2.]),
+        'y': np.array([0, 1, 2, 3]),
+        'v': np.array([[1, 2], [3, 4], [5, 6], [7, 8]]),
+    }
+
+
+def test_evaluate():
+    columns = get_columns()
+    cut = Cut('3<x<8')
+    expr = cut.compile()
+    assert_equal(expr.branches, ['x'])
+    assert_equal(list(expr.mask(columns)), [False, True, False, False])
+    expr = (Cut('x>0') | Cut('y==3')).compile()
+    assert_equal(expr.branches, ['x', 'y'])
+    assert_equal(list(expr.mask(columns)), [True] * 4)
+    # booleans count as 0 or 1 in arithmetic
+    expr = Cut('(x>0)+(y>0)').compile()
+    assert_equal(list(expr(columns)), [1, 2, 2, 1])
+    assert_equal(list(Cut('TMath::Abs(x)*2').compile()(columns)),
+                 [2, 8, 18, 4])
+    assert_equal(list(Cut('-x**2').compile()(columns)), [-1, -16, -81, -4])
+    assert_equal(list(Cut('y%2').compile()(columns)), [0, 1, 0, 1])
+    assert_equal(list(Cut('v[1]>4').compile().mask(columns)),
+                 [False, False, True, True])
+    # an empty cut selects everything
+    assert_equal(list(Cut().compile().mask(columns)), [True] * 4)
+
+
+def test_double_arithmetic():
+    columns = get_columns()
+    import numpy as np
+    columns['n'] = np.array([0, 1, 2, 3], dtype=np.uint32)
+    columns['r'] = np.array([1, 30000, -30000, 2], dtype=np.int32)
+    # integers are evaluated in double precision like in TTreeFormula
+    assert_equal(list(Cut('n-1>0').compile().mask(columns)),
+                 [False, False, True, True])
+    assert_equal(list(Cut('r*100000').compile()(columns)),
+                 [1e5, 3e9, -3e9, 2e5])
+    assert_equal(list(Cut('n**-1').compile()(columns)[1:]),
+                 [1., 0.5, 1. / 3])
+    assert_equal(list(Cut('2**-1').compile()(columns)), [0.5] * 4)
+
+
+def test_jagged():
+    columns = get_columns()
+    import numpy as np
+    jets = np.empty(4, dtype=object)
+    for i, row in enumerate([[10., 40.], [], [50.], [1., 2., 31.]]):
+        jets[i] = np.array(row)
+    columns['j'] = jets
+    # an entry passes if any instance passes
+    assert_equal(list(Cut('j>30').compile().mask(columns)),
+                 [True, False, True, True])
+    assert_equal(list(Cut('j>30&&x>2').compile().mask(columns)),
+                 [False, False, True, False])
+    values = Cut('j*y').compile()(columns)
+    assert_equal([list(row) for row in values],
+                 [[0., 0.], [], [100.], [3., 6., 93.]])
+    # missing elements do not pass
+    assert_equal(list(Cut('j[1]>0').compile().mask(columns)),
+                 [True, False, False, True])
+
+
+def test_syntax_errors():
+    get_columns()
+    for bad in ('x>', '(x', 'foo(x)', 'x[y]', 'Entry$'):
+        assert_raises(SyntaxError, Cut(bad).compile)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
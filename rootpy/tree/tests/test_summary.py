@@ -0,0 +1,64 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal, assert_almost_equal
+
+
+def import_numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    return np
+
+
+def test_merge():
+    np = import_numpy()
+    from rootpy.tree.summary import Summary
+    random = np.random.RandomState(42)
+    values = random.normal(3, 2, 10000)
+    weights = random.uniform(.5, 2, 10000)
+    total = Summary('x', seed=1)
+    for i, chunk in enumerate(np.array_split(np.arange(10000), 7)):
+        # merged summaries draw independent random streams
+        partial = Summary('x', seed=2 + i)
+        partial.fill(values[chunk], weights[chunk])
+        total.merge(partial)
+    mean = np.average(values, weights=weights)
+    assert_equal(total.entries, 10000)
+    assert_equal(total.min, values.min())
+    assert_equal(total.max, values.max())
+    assert_almost_equal(total.sum_weights, weights.sum())
+    assert_almost_equal(total.mean, mean)
+    assert_almost_equal(
+        total.variance, np.average((values - mean) ** 2, weights=weights))
+    assert_equal(abs(total.median - 3) < .2, True)
+
+
+def test_weighted_quantile():
+    np = import_numpy()
+    from rootpy.tree.summary import Summary
+    summary = Summary()
+    summary.fill([1., 2., 3.], [1., 1., 10.])
+    assert_equal(summary.median > 2.5, True)
+    # the sampling is reproducible with a seed
+    random = np.random.RandomState(42)
+    values = random.normal(size=1000)
+    medians = []
+    for i in range(2):
+        summary = Summary(reservoir_size=100, seed=0)
+        summary.fill(values)
+        medians.append(summary.median)
+    assert_equal(medians[0], medians[1])
+
+
+def test_jagged():
+    np = import_numpy()
+    from rootpy.tree.summary import Summary
+    values = np.empty(3, dtype=object)
+    values[:] = [np.array([1., 2.]), np.array([]), np.array([np.nan, 5.])]
+    summary = Summary()
+    summary.fill(values, [1., 2., 3.])
+    assert_equal(summary.entries, 3)
+    assert_equal(summary.sum_weights, 5.)
+    assert_equal((summary.min, summary.max), (1., 5.))
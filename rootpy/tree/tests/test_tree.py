@@ -3,9 +3,13 @@
 import ROOT
 
 from rootpy.vector import LorentzVector
-from rootpy.tree import Tree, Ntuple, TreeModel, TreeChain
+from rootpy.tree import (
+    Tree, Ntuple, TreeModel, TreeChain, enable_background_io)
 from rootpy.io import root_open, TemporaryFile
-from rootpy.tree.treetypes import FloatCol, IntCol
+from rootpy.tree.treetypes import (
+    FloatCol, IntCol, DoubleCol, FloatArrayCol)
+from rootpy.tree.filtering import (
+    EventFilter, EventFilterList, ObjectFilter, ObjectFilterList)
 from rootpy.plotting import Hist, Hist2D, Hist3D
 from rootpy import testdata
 from rootpy import stl
@@ -14,6 +18,8 @@ from random import gauss, randint, random
 import re
 import os
 import sys
+import shutil
+from tempfile import mkdtemp
 if sys.version_info[0] < 3:
     from cStringIO import StringIO
 else:
@@ -26,6 +32,24 @@ from nose.tools import (assert_raises, assert_almost_equal,
 
 FILES = []
 FILE_PATHS = []
+TEMPDIR = None
+
+
+def import_numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    return np
+
+
+def setup_module():
+    global TEMPDIR
+    TEMPDIR = mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TEMPDIR)
 
 
 def create_model():
@@ -123,6 +147,145 @@ def test_attrs():
             assert_equal(len(event.b) > 0, True)
 
 
+@with_setup(create_tree, cleanup)
+def test_collection_columns():
+    import_numpy()
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        tree.define_collection('b', 'b_', 'b_n')
+        for event in tree:
+            event.b.select(lambda b: b.x > 3)
+            event.b.sort(key=lambda b: b.y, reverse=True)
+            expected = [(b.x, b.y) for b in event.b]
+            event.b.reset()
+            columns = event.b.columns()
+            assert_equal(len(columns), event.b_n)
+            columns.select(columns.x > 3)
+            columns.sort('y', reverse=True)
+            assert_equal(list(zip(columns.x, columns.y)), expected)
+            # the selection is synchronized with the collection
+            assert_equal([(b.x, b.y) for b in event.b], expected)
+
+
+@with_setup(create_tree, cleanup)
+def test_collection_make_persistent():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        tree.create_buffer()
+        tree.define_collection('b', 'b_', 'b_n')
+        with TemporaryFile():
+            slim = Tree('slim')
+            slim.set_buffer(tree._buffer, create_branches=True)
+            expected = []
+            for event in tree:
+                event.b.select(lambda b: b.x > 3)
+                event.b.sort(key=lambda b: b.y)
+                expected.append([(b.x, b.y) for b in event.b])
+                event.b.make_persistent()
+                assert_equal(event.b_n, len(expected[-1]))
+                assert_equal(event.b_vect.size(), event.b_n)
+                slim.Fill()
+            slim.define_collection('b', 'b_', 'b_n')
+            for event, objects in zip(slim, expected):
+                assert_equal([(b.x, b.y) for b in event.b], objects)
+
+
+def test_collection_make_persistent_arrays():
+    import_numpy()
+
+    class Event(TreeModel):
+        o_n = IntCol()
+        o_pt = FloatArrayCol(10, length_name='o_n')
+        o_v = stl.vector('float')
+
+    with TemporaryFile():
+        tree = Tree('persistent', model=Event)
+        tree.define_collection('o', 'o_', 'o_n')
+        tree.o_n = 4
+        tree.o_pt = [1., 3., 2., 4.]
+        for value in (1., 3., 2., 4.):
+            tree.o_v.push_back(value)
+        tree.o.select(lambda o: o.pt > 1.5)
+        tree.o.make_persistent()
+        assert_equal(tree.o_n, 3)
+        assert_equal(list(tree.o_pt[:3]), [3., 2., 4.])
+        assert_equal(list(tree.o_v), [3., 2., 4.])
+        # a vector of another length than the collection is not left stale
+        tree.o_v.push_back(5.)
+        tree.o.select(lambda o: o.pt > 2.5)
+        assert_raises(ValueError, tree.o.make_persistent)
+
+
+@with_setup(create_tree, cleanup)
+def test_collection_owned_branches():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        tree.create_buffer()
+        tree.define_collection('b', 'b_', 'b_n')
+        assert_equal(sorted(tree.b._owned_branches()),
+                     ['b_vect', 'b_x', 'b_y'])
+        # a collection with a longer prefix and another size owns b_vect
+        tree.define_collection('v', 'b_v', 'i')
+        assert_equal(sorted(tree.b._owned_branches()), ['b_x', 'b_y'])
+
+
+@with_setup(create_tree, cleanup)
+def test_learn_branches():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        values = [(event.i, event.a_x, event.a_y) for event in tree]
+        tree.read_branches_on_demand = True
+        tree.learn_branches = 10
+        learned_values = []
+        for event in tree:
+            # a_y is only accessed after the learning phase
+            learned_values.append((
+                event.i, event.a_x, event.a_y if event.i >= 500 else None))
+        assert_equal(learned_values, [
+            (i, x, y if i >= 500 else None) for i, x, y in values])
+        assert_equal(tree.learned_branches, ['a_x', 'a_y', 'i'])
+        # all branches are active again after the loop
+        assert_equal(tree.GetBranchStatus('b_n'), True)
+        # start warm with the learned branches
+        tree.learn_branches = 0
+        assert_equal([(event.i, event.a_x, event.a_y) for event in tree],
+                     values)
+
+
+@with_setup(create_tree, cleanup)
+def test_learn_branches_read_after_learning():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        values = [(event.i, event.a_z) for event in tree]
+        tree.read_branches_on_demand = True
+        tree.learn_branches = 10
+        # a_z is never accessed in the learning phase
+        assert_equal([(event.i, event.a_z if event.i >= 10 else None)
+                      for event in tree],
+                     [(i, z if i >= 10 else None) for i, z in values])
+        assert_equal(tree.learned_branches, ['a_z', 'i'])
+
+
+@with_setup(create_tree, cleanup)
+def test_fast_access():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        tree.define_object('a', 'a_')
+        tree.define_collection('b', 'b_', 'b_n')
+        values = [(event.i, event.a_x, event.b_n) for event in tree]
+        tree.create_buffer(fast_access=True)
+        tree.define_object('a', 'a_')
+        tree.define_collection('b', 'b_', 'b_n')
+        fast_values = []
+        for event in tree:
+            assert_equal(event.a_x, event.a.x)
+            assert_equal(len(event.b), event.b_n)
+            fast_values.append((event.i, event.a_x, event.b_n))
+            event.a_y = 1.
+            assert_equal(event.a_y, 1.)
+        assert_equal(fast_values, values)
+
+
 @with_setup(create_tree, cleanup)
 def test_draw():
     with root_open(FILE_PATHS[0]) as f:
@@ -192,13 +355,237 @@ def test_draw():
         assert_equal(hist3.Integral(), hist1.Integral())
 
 
+@with_setup(create_tree, cleanup)
+def test_iter_batches():
+    import_numpy()
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        batches = list(tree.iter_batches(['a_x', 'b_y'], batch_size=300))
+        assert_equal(len(batches), 4)
+        assert_equal(sum(len(batch['a_x']) for batch in batches), 1000)
+        assert_equal(len(batches[0]['b_y'][0]) > 0, True)
+        # selection
+        total = sum(len(batch['a_x']) for batch in
+                    tree.iter_batches('a_x', selection='a_x>0.5'))
+        assert_equal(total, tree.GetEntries('a_x>0.5'))
+        # only the entries in the entry list are read
+        tree.SetEntryList(tree.entry_list('a_x>0'))
+        assert_equal(
+            sum(batch.size for batch in
+                tree.iter_batches('a_x', batch_size=300)),
+            tree.GetEntries('a_x>0'))
+        assert_equal(
+            sum(batch.size for batch in
+                tree.iter_batches('a_x', selection='a_y>0')),
+            tree.GetEntries('a_x>0&&a_y>0'))
+        tree.SetEntryList(None)
+        # deactivated branches are not read
+        tree.deactivate('b_*')
+        batch = next(tree.iter_batches())
+        assert_equal('b_y' in batch, False)
+        assert_raises(ValueError, next, tree.iter_batches('b_y'))
+
+
+@with_setup(create_tree, cleanup)
+def test_reader():
+    np = import_numpy()
+    from rootpy.tree.reader import read, iter_read, tree2array
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        expected = [(event.i, event.a_x, list(event.b_y))
+                    for event in tree]
+        batch = read(tree, ['i', 'a_x', 'b_y'], start=10, stop=100, step=3)
+        assert_equal(batch.size, 30)
+        assert_equal(list(batch.i), [row[0] for row in expected[10:100:3]])
+        assert_equal([list(values) for values in batch.b_y],
+                     [row[2] for row in expected[10:100:3]])
+        passing = [row[0] for row in expected if row[1] > 0.5]
+        assert_equal(
+            [i for chunk in iter_read(tree, 'i', 'a_x>0.5', chunk_size=300)
+             for i in chunk.i],
+            passing)
+        array = tree2array(tree, ['i', 'a_x'], include_weight=True)
+        assert_equal(array.dtype.names, ('i', 'a_x', 'weight'))
+        assert_equal(len(array), 1000)
+        assert_raises(TypeError, read, tree, 'a_vect')
+        # an entry passes if any instance of the selection passes
+        passing = [row[0] for row in expected
+                   if any(y > 0.5 for y in row[2])]
+        assert_equal(list(read(tree, 'i', 'b_y>0.5').i), passing)
+        # names that are not branches are evaluated as expressions
+        batch = read(tree, ['a_x*2', 'b_y*2'], stop=10)
+        assert_equal(list(batch['a_x*2']),
+                     [2 * row[1] for row in expected[:10]])
+        assert_equal([list(values) for values in batch['b_y*2']],
+                     [[2 * y for y in row[2]] for row in expected[:10]])
+        array = tree2array(tree, ['i', 'a_x*2'])
+        assert_equal(array.dtype.names, ('i', 'a_x*2'))
+        assert_raises(ValueError, read, tree, 'a_x*')
+
+    class Event(TreeModel):
+        f = FloatArrayCol(3)
+        n = IntCol()
+        vals = FloatArrayCol(4, length_name='n')
+
+    with TemporaryFile():
+        tree = Tree('reader', model=Event)
+        tree.extend({
+            'f': np.arange(6).reshape(2, 3),
+            'vals': (np.array([0, 3, 4]), np.arange(4)),
+        })
+        batch = read(tree, ['f', 'vals'])
+        assert_equal(batch.f.shape, (2, 3))
+        assert_equal([list(values) for values in batch.vals],
+                     [[0., 1., 2.], [3.]])
+
+
+@with_setup(create_chain, cleanup)
+def test_index():
+    import_numpy()
+    from rootpy.tree.index import IndexCache
+    cache = IndexCache(os.path.join(TEMPDIR, 'indices'))
+    chain = TreeChain('tree', FILE_PATHS[1:])
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        index = tree.index('i', cache=cache)
+        assert_equal(len(index), 1000)
+        # read from the cache
+        assert_equal(len(os.listdir(cache.path)), 1)
+        cached = IndexCache(cache.path).index(tree, 'i')
+        assert_equal(list(cached.entries), list(index.entries))
+        assert_equal(list(index.lookup({'i': [5, 2000, 999]})),
+                     [5, -1, 999])
+        assert_equal(index.entry(7), 7)
+        assert_equal(list(index.align(chain)),
+                     list(range(1000)) * 2)
+        for event, friend in tree.join(chain, 'i', cache=cache):
+            assert_equal(friend.i, event.i)
+
+
+@with_setup(create_tree, cleanup)
+def test_sorted_copy():
+    np = import_numpy()
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        values = tree.to_array(['i', 'a_x'])
+        expected = values['i'][np.argsort(-values['a_x'], kind='mergesort')]
+        with TemporaryFile() as output:
+            # in memory and with an external merge of 4 runs
+            for run_size in (1000, 300):
+                sorted_tree = tree.sorted_copy(
+                    '-a_x', output=output, run_size=run_size,
+                    batch_size=128, tmpdir=TEMPDIR)
+                assert_equal(sorted_tree.GetEntries(), 1000)
+                assert_equal(list(sorted_tree.to_array(['i'])['i']),
+                             list(expected))
+
+
+def test_zonemap():
+    import_numpy()
+    filename = os.path.join(TEMPDIR, 'zonemap.root')
+    with root_open(filename, 'recreate'):
+        tree = Tree('tree')
+        tree.create_branches({'i': 'I', 'x': 'F'})
+        # clusters of 100 entries
+        tree.SetAutoFlush(100)
+        for i in range(1000):
+            tree.i = i
+            tree.x = i % 7
+            tree.fill()
+        tree.write()
+    with root_open(filename) as f:
+        tree = f.tree
+        zonemap = tree.build_zonemap(['i', 'x'])
+        assert_equal(len(zonemap), 10)
+        assert_equal(zonemap.ranges('i>=250&&x<3'), [(200, 1000)])
+        assert_equal(zonemap.ranges('i<100||i==512'), [(0, 100), (500, 600)])
+        # the range of x does not exclude any cluster
+        assert_equal(zonemap.ranges('x>5'), [(0, 1000)])
+        assert_equal(zonemap.ranges('i>2000'), [])
+        for selection in ('i>=250&&x<3', 'i<100||i==512', 'i>2000'):
+            entries = sum(batch.size for batch in tree.iter_batches(
+                ['i'], selection=selection))
+            assert_equal(entries, tree.GetEntries(selection))
+    with root_open(filename) as f:
+        tree = f.tree
+        zonemap = tree.load_zonemap()
+        assert_equal(zonemap.branches, ['i', 'x'])
+        assert_equal(tree.zonemap is zonemap, True)
+        chain = TreeChain('tree', [filename], zonemaps=True)
+        assert_equal(sum(batch.size for batch in chain.iter_batches(
+            ['i'], selection='i<100||i==512')), 101)
+        # entry lists are only evaluated on the clusters that may pass
+        for selection in ('i>=250&&x<3', 'i<100||i==512', 'i>2000'):
+            assert_equal(tree.entry_list(selection).GetN(),
+                         tree.GetEntries(selection))
+    # the selection of the chain is pruned with the zone map
+    chain = TreeChain('tree', [filename], selection='i<100||i==512',
+                      zonemaps=True)
+    assert_equal([event.i for event in chain], list(range(100)) + [512])
+    chain = TreeChain('tree', [filename], selection='i<100||i==512',
+                      zonemaps=True)
+    assert_equal(sum(batch.size for batch in chain.iter_batches(['i'])), 101)
+
+
+@with_setup(create_tree, cleanup)
+def test_selection_cache():
+    from rootpy.tree.cache import SelectionCache
+    cache = SelectionCache(os.path.join(TEMPDIR, 'selections'))
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        expected = tree.GetEntries('a_x>0')
+        tree.selection_cache = cache
+        assert_equal(tree.GetEntries('a_x>0'), expected)
+        assert_equal(len(os.listdir(cache.path)), 1)
+        hist = tree.draw('a_x', 'a_x>0', create_hist=True)
+        assert_equal(hist.GetEntries(), expected)
+        # only the entries passing the selection are iterated over
+        tree.SetEntryList(tree.entry_list('a_x>0'))
+        assert_equal(sum(1 for event in tree), expected)
+        assert_equal(sum(1 for event in tree.iter_range(100, 200)),
+                     tree.GetEntries('a_x>0&&i>=100&&i<200'))
+        # the entry list applied to the tree does not change the cached
+        # entries of another selection
+        assert_equal(tree.entry_list('a_y>0').GetN(),
+                     tree.GetEntries('a_y>0'))
+        tree.SetEntryList(None)
+        assert_equal(tree.entry_list('a_y>0').GetN(),
+                     tree.GetEntries('a_y>0'))
+        # aliases are part of the key
+        tree.SetAlias('sel', 'a_x>0')
+        assert_equal(tree.entry_list('sel').GetN(), expected)
+        tree.SetAlias('sel', 'a_x<=0')
+        assert_equal(tree.entry_list('sel').GetN(),
+                     tree.GetEntries() - expected)
+    # the cached selection is read by a new cache instance
+    cache = SelectionCache(cache.path)
+    chain = TreeChain('tree', FILE_PATHS, selection='a_x>0',
+                      selection_cache=cache)
+    assert_equal(sum(1 for event in chain), expected)
+
+
+@with_setup(create_tree, cleanup)
+def test_chain_selection_batches():
+    import_numpy()
+    from rootpy.tree.cache import SelectionCache
+    with root_open(FILE_PATHS[0]) as f:
+        expected = f.tree.GetEntries('a_x>0')
+    cache = SelectionCache(os.path.join(TEMPDIR, 'batch_selections'))
+    chain = TreeChain('tree', FILE_PATHS, selection='a_x>0',
+                      selection_cache=cache)
+    # reading batches applies the selection without building entry lists
+    assert_equal(sum(batch.size for batch in chain.iter_batches('a_x')),
+                 expected)
+    assert_equal(os.listdir(cache.path), [])
+
+
 @with_setup(create_chain, cleanup)
 def test_chain_draw():
     if sys.version_info[0] >= 3:
         raise SkipTest("Python 3 support not implemented")
     chain = TreeChain('tree', FILE_PATHS)
     hist = Hist(100, 0, 1)
-    chain.draw('a_x', hist=hist)
+    assert_equal(chain.draw('a_x', hist=hist) is hist, True)
     assert_equal(hist.Integral() > 0, True)
 
     # check that Draw can be repeated
@@ -207,6 +594,340 @@ def test_chain_draw():
     assert_equal(hist.Integral(), hist2.Integral())
 
 
+@with_setup(create_chain, cleanup)
+def test_chain_prefetch():
+    enable_background_io()
+    chain = TreeChain('tree', FILE_PATHS, prefetch=2, cache=True)
+    entries = 0
+    for event in chain:
+        entries += 1
+    assert_equal(entries, 3000)
+    stats = chain.prefetch_stats
+    assert_equal(stats['open'] >= stats['waited'], True)
+    # iterating again after a reset also works with prefetching
+    chain.reset()
+    chain._rollover()
+    assert_equal(sum(1 for event in chain), 3000)
+
+
+class PositiveX(EventFilter):
+
+    def passes(self, event):
+        return event.a_x > 0
+
+    def passes_batch(self, batch):
+        return batch.a_x > 0
+
+
+class PositiveXEvent(EventFilter):
+
+    def passes(self, event):
+        return event.a_x > 0
+
+
+class PositiveXOrNone(EventFilter):
+
+    def passes(self, event):
+        if event.a_y < 0:
+            return None
+        return event.a_x > 0
+
+
+class PositiveXDetails(EventFilter):
+
+    def __init__(self, **kwargs):
+        super(PositiveXDetails, self).__init__(**kwargs)
+        self.details['positive'] = 0
+
+    def passes(self, event):
+        if event.a_x > 0:
+            self.details['positive'] += 1
+            return True
+        return False
+
+
+def _init_output():
+    hist = Hist(100, -5, 5)
+    hist.SetDirectory(0)
+    return {'hist': hist, 'count': 0}
+
+
+def _fill_output(event, output):
+    output['hist'].Fill(event.a_x)
+    output['count'] += 1
+
+
+def test_merge():
+    from collections import namedtuple
+    from rootpy.tree.parallel import merge
+    Counts = namedtuple('Counts', ['n', 'sumw'])
+    assert_equal(merge(Counts(1, 2.), Counts(3, 4.)), Counts(4, 6.))
+    assert_equal(merge([1, (2, 3)], [4, (5, 6)]), [5, (7, 9)])
+    assert_equal(merge({'a': 1}, {'a': 2, 'b': 3}), {'a': 3, 'b': 3})
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_map_reduce():
+    filters = EventFilterList([PositiveX()])
+    chain = TreeChain('tree', FILE_PATHS, filters=filters)
+    output = chain.map_reduce(_fill_output, init=_init_output, workers=2)
+    assert_equal(filters.total, 3000)
+    assert_equal(output['count'], filters.passing)
+    assert_equal(output['hist'].GetEntries(), filters.passing)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_map_reduce_reused_filters():
+    # a single worker reuses its filters for each file
+    filters = EventFilterList([PositiveXDetails()])
+    chain = TreeChain('tree', FILE_PATHS, filters=filters)
+    chain.map_reduce(_fill_output, init=_init_output, workers=1)
+    assert_equal(filters.total, 3000)
+    assert_equal(filters[0].details['positive'], filters.passing)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_map_reduce_split():
+    filters = EventFilterList([PositiveX()])
+    chain = TreeChain('tree', FILE_PATHS, filters=filters)
+    output = chain.map_reduce(_fill_output, init=_init_output, workers=2)
+    split_filters = EventFilterList([PositiveX()])
+    chain = TreeChain('tree', FILE_PATHS, filters=split_filters)
+    split_output = chain.map_reduce(_fill_output, init=_init_output,
+                                    workers=2, split=True,
+                                    entries_per_task=100)
+    assert_equal(split_filters.basic(), filters.basic())
+    assert_equal(split_output['count'], output['count'])
+    assert_equal(split_output['hist'].GetEntries(),
+                 output['hist'].GetEntries())
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_map_reduce_scheduler():
+    from rootpy.tree.scheduler import Scheduler
+    filters = EventFilterList([PositiveX()])
+    chain = TreeChain('tree', FILE_PATHS, filters=filters)
+    output = chain.map_reduce(_fill_output, init=_init_output, workers=2)
+    scheduler = Scheduler(workers=2, entries_per_unit=200, min_entries=10)
+    scheduler_filters = EventFilterList([PositiveX()])
+    chain = TreeChain('tree', FILE_PATHS, filters=scheduler_filters)
+    scheduler_output = chain.map_reduce(
+        _fill_output, init=_init_output, scheduler=scheduler)
+    assert_equal(scheduler_filters.basic(), filters.basic())
+    assert_equal(scheduler_output['count'], output['count'])
+    assert_equal(sum(stats['entries']
+                     for stats in scheduler.stats.values()), 3000)
+
+
+@with_setup(create_chain, cleanup)
+def test_clusters():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        clusters = tree.clusters()
+        assert_equal(clusters[0][0], 0)
+        assert_equal(clusters[-1][1], tree.GetEntries())
+        for (_, stop), (start, _) in zip(clusters[:-1], clusters[1:]):
+            assert_equal(stop, start)
+        assert_equal(
+            sum(1 for start, stop in clusters
+                for event in tree.iter_range(start, stop)),
+            tree.GetEntries())
+        assert_equal(sum(1 for event in tree.iter_range(10, 20)), 10)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_metrics():
+    import json
+    finished = []
+    filters = EventFilterList([PositiveX()])
+    chain = TreeChain('tree', FILE_PATHS, filters=filters,
+                      onmetrics=finished.append, cache=True)
+    for event in chain:
+        pass
+    assert_equal(len(finished), len(FILE_PATHS))
+    assert_equal([metrics.filename for metrics in chain.metrics.files],
+                 FILE_PATHS)
+    total = chain.metrics.total
+    assert_equal(total['entries'], 3000)
+    assert_equal(total['passing'], filters.passing)
+    assert_equal(total['bytes_read'] > 0, True)
+    output = json.loads(chain.metrics.to_json())
+    assert_equal(len(output['files']), len(FILE_PATHS))
+    assert_equal(output['total']['entries'], 3000)
+    # all entries are read before the selection
+    chain = TreeChain('tree', FILE_PATHS)
+    for batch in chain.iter_batches(['a_x'], selection='a_x>0'):
+        pass
+    total = chain.metrics.total
+    assert_equal(total['entries'], 3000)
+    assert_equal(total['passing'] < 3000, True)
+
+
+@with_setup(create_chain, cleanup)
+def test_auto_cache_size():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        size = tree.auto_cache_size(['a_x'], min_size=1, max_size=10 ** 9)
+        assert_equal(0 < size <= tree.auto_cache_size(
+            min_size=1, max_size=10 ** 9), True)
+        assert_equal(tree.configure_cache('auto', branches=['a_x']),
+                     tree.auto_cache_size(['a_x']))
+    chain = TreeChain('tree', FILE_PATHS, cache=True, cache_size='auto',
+                      always_read=['a_x'])
+    assert_equal(sum(1 for event in chain), 3000)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_filter_batches():
+    import_numpy()
+    filters = EventFilterList([PositiveX()])
+    chain = TreeChain('tree', FILE_PATHS, filters=filters)
+    passing = sum(1 for event in chain)
+    batch_filters = EventFilterList([PositiveX()])
+    chain = TreeChain('tree', FILE_PATHS, filters=batch_filters)
+    batches = list(chain.iter_batches(['a_x'], batch_size=300))
+    assert_equal(sum(batch.size for batch in batches), passing)
+    assert_equal(all((batch.a_x > 0).all() for batch in batches), True)
+    assert_equal(batch_filters.basic(), filters.basic())
+    # filters without a batch mode are applied to each event of a batch
+    event_filters = EventFilterList([PositiveXEvent(name='PositiveX')])
+    chain = TreeChain('tree', FILE_PATHS, filters=event_filters)
+    batches = list(chain.iter_batches(['a_x'], batch_size=300))
+    assert_equal(sum(batch.size for batch in batches), passing)
+    assert_equal(event_filters.basic(), filters.basic())
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_filter_batches_none():
+    import_numpy()
+    from rootpy.tree.filtering import FilterHook
+    calls = []
+    hooks = [FilterHook(calls.append, ('event',))]
+    filters = EventFilterList([PositiveXOrNone(hooks=hooks)])
+    chain = TreeChain('tree', FILE_PATHS, filters=filters)
+    passing = sum(1 for event in chain)
+    event_calls = len(calls)
+    assert_equal(event_calls, passing)
+    del calls[:]
+    # events for which passes returns None are not counted in batch mode
+    batch_filters = EventFilterList([PositiveXOrNone(hooks=hooks)])
+    chain = TreeChain('tree', FILE_PATHS, filters=batch_filters)
+    batches = list(chain.iter_batches(['a_x', 'a_y'], batch_size=300))
+    assert_equal(sum(batch.size for batch in batches), passing)
+    assert_equal(batch_filters.basic(), filters.basic())
+    assert_equal(filters[0].total < 3000, True)
+    assert_equal(len(calls), event_calls)
+
+
+def test_object_filter_batch():
+    np = import_numpy()
+    from rootpy.tree.expression import Jagged
+    from rootpy.tree.treebuffer import Batch
+
+    class HighPt(ObjectFilter):
+
+        def filtered_batch(self, batch, mask):
+            return Jagged(mask.counts, mask.flat & (batch.pt.flat > 20))
+
+    batch = Batch(pt=Jagged(np.array([2, 0, 3]),
+                            np.array([10., 30., 25., 5., 40.])))
+    mask = Jagged(batch.pt.counts, np.ones(5, dtype=bool))
+    objects = HighPt()
+    events = HighPt(count_events=True)
+    mask = ObjectFilterList([objects, events]).filter_batch(batch, mask)
+    assert_equal(list(mask.flat), [False, True, True, False, True])
+    assert_equal((objects.total, objects.passing), (5, 3))
+    assert_equal((events.total, events.passing), (3, 2))
+
+
+@with_setup(create_chain, cleanup)
+def test_describe():
+    import_numpy()
+    chain = TreeChain('tree', FILE_PATHS)
+    values = [(event.a_x, event.a_y) for event in chain]
+    summaries = chain.describe(['a_x', 'a_x*a_y'], cut='a_y>0')
+    selected = [(x, y) for x, y in values if y > 0]
+    summary = summaries['a_x']
+    assert_equal(summary.entries, len(selected))
+    assert_almost_equal(summary.max, max(x for x, y in selected), places=5)
+    assert_almost_equal(summary.min, min(x for x, y in selected), places=5)
+    assert_almost_equal(
+        summary.mean, sum(x for x, y in selected) / len(selected), places=5)
+    assert_equal(summaries['a_x*a_y'].entries, len(selected))
+    assert_almost_equal(chain.GetMaximum('a_x'),
+                        max(x for x, y in values), places=5)
+    # evaluated with TTree::Draw
+    assert_equal(chain.GetMaximum('Length$(b_x)'), 5)
+    assert_equal(chain.GetMinimum('a_x', 'a_x>1e9'), sys.float_info.max)
+
+
+@with_setup(create_tree, cleanup)
+def test_extremum_entry_list():
+    import_numpy()
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        values = [event.a_x for event in tree]
+        # only the entries in the entry list are considered as with Draw
+        tree.SetEntryList(tree.entry_list('a_x<0'))
+        assert_almost_equal(tree.GetMaximum('a_x'),
+                            max(x for x in values if x < 0), places=5)
+        assert_almost_equal(tree.GetMaximum('a_x'),
+                            tree._draw_extremum('a_x', None, True), places=5)
+        tree.SetEntryList(tree.entry_list('a_x>0'))
+        assert_almost_equal(tree.GetMinimum('a_x'),
+                            min(x for x in values if x > 0), places=5)
+
+
+@with_setup(create_chain, cleanup)
+def test_draw_many():
+    import_numpy()
+    chain = TreeChain('tree', FILE_PATHS)
+    hist = Hist(20, -5, 5)
+    chain.draw('a_x', 'a_y>0', hist=hist)
+    # different binning on each axis so a transposed fill is detected
+    hist2d = Hist2D(10, -5, 5, 4, 0, 1)
+    chain.draw('a_x:a_y', hist=hist2d)
+    hists = chain.draw_many([
+        ('a_x', 'a_y>0', None, (20, -5, 5)),
+        dict(expression='a_x:a_y', binning=(10, -5, 5, 4, 0, 1)),
+        dict(expression='a_x', weight='2*i', binning=(20, -5, 5)),
+    ])
+    assert_equal(len(hists), 3)
+    assert_equal(hists[0].GetEntries(), hist.GetEntries())
+    assert_equal(list(hists[0].y()), list(hist.y()))
+    assert_equal(hists[1].GetEntries(), hist2d.GetEntries())
+    assert_equal(isinstance(hists[1], Hist2D), True)
+    assert_equal(hist2d.Integral() > 0, True)
+    assert_equal(
+        [hists[1].GetBinContent(i, j)
+         for i in range(12) for j in range(6)],
+        [hist2d.GetBinContent(i, j) for i in range(12) for j in range(6)])
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_draw_parallel():
+    chain = TreeChain('tree', FILE_PATHS)
+    hist = Hist(100, -5, 5)
+    assert_equal(chain.draw('a_x', 'a_y>0', hist=hist) is hist, True)
+    hist_parallel = Hist(100, -5, 5)
+    output = chain.draw('a_x', 'a_y>0', hist=hist_parallel, workers=2)
+    assert_equal(output is hist_parallel, True)
+    assert_equal(hist.Integral() > 0, True)
+    assert_equal(hist_parallel.Integral(), hist.Integral())
+    # let ROOT create the histogram
+    output = chain.draw('a_x>>h_parallel(100,-5,5)', options='goff',
+                        workers=2)
+    assert_equal(output.GetEntries(), 3000)
+    # the selection of the chain also applies to the workers
+    chain = TreeChain('tree', FILE_PATHS, selection='a_x>0')
+    hist = Hist(100, -5, 5)
+    chain.draw('a_x', 'a_y>0', hist=hist)
+    hist_parallel = Hist(100, -5, 5)
+    chain.draw('a_x', 'a_y>0', hist=hist_parallel, workers=2)
+    assert_equal(hist.Integral(0, 50), 0)
+    assert_equal(hist_parallel.Integral(), hist.Integral())
+
+
 @with_setup(create_chain, cleanup)
 def test_chain_draw_hist_init_first():
     if sys.version_info[0] >= 3:
@@ -281,6 +1002,133 @@ def test_csv():
         assert_equal(output.getvalue(), true_output)
 
 
+@with_setup(create_tree, cleanup)
+def test_export():
+    np = import_numpy()
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        values = [(event.i, event.a_x) for event in tree]
+        branches = ['i', 'a_x']
+        output = StringIO()
+        tree.export(output, format='csv', branches=branches, limit=10,
+                    batch_size=3)
+        lines = output.getvalue().splitlines()
+        assert_equal(lines[0], 'i,a_x')
+        assert_equal(len(lines), 11)
+        assert_equal([int(line.split(',')[0]) for line in lines[1:]],
+                     list(range(10)))
+        filename = os.path.join(TEMPDIR, 'export.npy')
+        tree.export(filename, branches=branches, batch_size=300)
+        rec = np.load(filename)
+        assert_equal(rec.dtype.names, ('i', 'a_x'))
+        assert_equal(list(rec['i']), [i for i, x in values])
+        assert_almost_equal(rec['a_x'][-1], values[-1][1], places=5)
+        filename = os.path.join(TEMPDIR, 'export.npz')
+        tree.export(filename, branches=branches, batch_size=300, limit=500)
+        arrays = np.load(filename)
+        assert_equal(sorted(arrays.files), ['a_x', 'i'])
+        assert_equal(list(arrays['i']), list(range(500)))
+
+
+@with_setup(create_tree, cleanup)
+def test_export_parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SkipTest("pyarrow is not installed")
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        filename = os.path.join(TEMPDIR, 'export.parquet')
+        tree.export(filename, branches=['i', 'b_x'], batch_size=300)
+        table = pq.read_table(filename)
+        assert_equal(table.num_rows, tree.GetEntries())
+        assert_equal(str(table.schema.field('b_x').type), 'list<item: int32>')
+        # the schema is determined by the types of the branches even if
+        # there are no entries
+        tree.export(filename, branches=['i', 'b_x'], limit=0)
+        empty = pq.read_table(filename)
+        assert_equal(empty.num_rows, 0)
+        assert_equal(empty.schema.equals(table.schema), True)
+
+
+def test_extend():
+    np = import_numpy()
+
+    class Event(TreeModel):
+        x = FloatCol()
+        i = IntCol()
+        f = FloatArrayCol(3)
+        n = IntCol()
+        vals = FloatArrayCol(4, length_name='n')
+
+    with TemporaryFile():
+        tree = Tree('extend', model=Event)
+        offsets = np.array([0, 2, 2, 6, 7])
+        entries = tree.extend({
+            'x': np.linspace(0, 1, 4),
+            'i': np.arange(4),
+            'f': np.arange(12).reshape(4, 3),
+            'vals': (offsets, np.arange(7)),
+        })
+        assert_equal(entries, 4)
+        tree.extend({'i': [4], 'vals': np.array(
+            [np.array([1., 2.])], dtype=object)})
+        assert_equal(tree.GetEntries(), 5)
+        assert_raises(ValueError, tree.extend, {'i': [1, 2], 'x': [1.]})
+        assert_raises(ValueError, tree.extend,
+                      {'vals': ([0, 5], np.arange(5))})
+        tree.write()
+        events = [(event.i, event.x, list(event.f), event.n,
+                   list(event.vals)[:event.n]) for event in tree]
+        assert_equal(events[0], (0, 0., [0., 1., 2.], 2, [0., 1.]))
+        assert_equal(events[1][3:], (0, []))
+        assert_equal(events[2][4], [2., 3., 4., 5.])
+        assert_equal(events[3][2], [9., 10., 11.])
+        assert_equal(events[4][0], 4)
+        assert_equal(events[4][3:], (2, [1., 2.]))
+
+
+def test_record():
+    np = import_numpy()
+
+    class Event(TreeModel):
+        x = FloatCol(default=-1.)
+        # a double after a 4-byte field
+        d = DoubleCol()
+        i = IntCol()
+        f = FloatArrayCol(2)
+
+    with TemporaryFile():
+        tree = Tree('record', model=Event, record=True)
+        dtype = tree.record.dtype
+        assert_equal(dtype.names, ('x', 'd', 'i'))
+        # the fields are aligned
+        assert_equal(all(dtype.fields[name][1] % dtype[name].itemsize == 0
+                         for name in dtype.names), True)
+        tree.x = 1.5
+        tree.i = 2
+        tree.f = [1., 2.]
+        # the variables support the operators of the scalar types
+        i, x = tree._buffer['i'], tree._buffer['x']
+        assert_equal((i > 1, i == 2, i != 2, x < i), (True, True, False, True))
+        assert_equal((i + 1, 1 - x, i * x), (3, -0.5, 3.))
+        assert_equal(bool(i), True)
+        tree.fill(reset=True)
+        assert_equal((tree.x, tree.i), (-1., 0))
+        assert_equal(bool(i), False)
+        rows = np.array([(2.5, 0., 3), (3.5, 0., 4)],
+                        dtype=tree.record.dtype)
+        for row in rows:
+            tree.fill_record(row)
+        tree.fill_record((4.5, 0., 5), reset=True)
+        tree.extend({'x': [5.5], 'i': [6], 'd': [0.]})
+        tree.write()
+        events = [(event.x, event.i) for event in tree]
+        assert_equal(events, [(1.5, 2), (2.5, 3), (3.5, 4),
+                              (4.5, 5), (5.5, 6)])
+    assert_raises(ValueError, Tree, 'record', record=True)
+
+
 def test_ntuple():
     with TemporaryFile():
         ntuple = Ntuple(('a', 'b', 'c'), name='test')
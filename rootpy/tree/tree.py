@@ -2,9 +2,11 @@
 # distributed under the terms of the GNU General Public License
 from __future__ import absolute_import, print_function
 
+import os
 import sys
 import re
 import fnmatch
+from contextlib import contextmanager
 
 try:
     from collections import OrderedDict
@@ -26,7 +28,9 @@ from ..plotting.base import Plottable
 from ..plotting import Hist, Canvas
 from ..memory.keepalive import keepalive
 from .cut import Cut
-from .treebuffer import TreeBuffer
+from .cache import (
+    SelectionCache, evaluate_entry_list, intersect_entry_lists)
+from .treebuffer import TreeBuffer, create_accessor
 from .treemodel import TreeModel
 from .treetypes import Scalar, Array, BaseChar
 
@@ -58,9 +62,16 @@ class BaseTree(NamedObject):
             # only set _buffer if model was not specified in the __init__
             self._buffer = TreeBuffer()
         self.read_branches_on_demand = False
+        self.fast_access = False
+        self.learn_branches = 0
+        self.learned_branches = None
         self._branch_cache = {}
         self._current_entry = 0
         self._always_read = []
+        self.selection_cache = None
+        self.zonemap = None
+        # the number of entries read by iter_batches before the selection
+        self.entries_read = 0
         self.userdata = UserData()
         self._inited = True
 
@@ -84,6 +95,128 @@ class BaseTree(NamedObject):
             raise TypeError("branches must be a list or tuple")
         self._always_read = branches
 
+    def entry_list(self, selection):
+        """
+        Return a TEntryList of the entries passing a selection. If
+        ``selection_cache`` is set to a
+        ``rootpy.tree.cache.SelectionCache`` (or True for the default cache)
+        then the entry list is read from the cache if the same selection was
+        previously evaluated on this unchanged tree. If a ``zonemap`` is set
+        only the clusters of entries that may pass the selection are read.
+
+        Parameters
+        ----------
+        selection : str or rootpy.tree.Cut
+            The selection
+        """
+        ranges = None
+        if self.zonemap is not None:
+            ranges = self.zonemap.ranges(selection)
+        cache = self.selection_cache
+        if cache is True:
+            cache = SelectionCache()
+            self.selection_cache = cache
+        if not cache:
+            return evaluate_entry_list(self, selection, ranges)
+        return cache.entry_list(self, selection, ranges)
+
+    def index(self, keys, cache=None):
+        """
+        Return a ``rootpy.tree.index.TreeIndex`` of the entries of this tree
+        by the values of one or more key branches, i.e. ('run', 'event').
+
+        Parameters
+        ----------
+        keys : str or list
+            The key branches
+
+        cache : IndexCache or bool, optional (default=None)
+            Read the index from this ``rootpy.tree.index.IndexCache`` (or the
+            default cache if True) if it was built before for this unchanged
+            tree, otherwise build it and store it in the cache
+        """
+        from .index import TreeIndex, IndexCache
+        if cache is True:
+            cache = IndexCache()
+        if not cache:
+            return TreeIndex.build(self, keys)
+        return cache.index(self, keys)
+
+    def join(self, other, keys, cache=None):
+        """
+        Iterate over the entries of ``other`` (a tree or TreeChain) and read
+        the entry of this tree with the same values of the key branches.
+        Yield pairs of the entry of ``other`` and the buffer of this tree or
+        None if there is no matching entry. The entries are matched with an
+        index of this tree (see ``index``) without a nested loop.
+
+        .. sourcecode:: python
+
+            >>> for event, calib in calib_tree.join(chain, ('run', 'event'),
+            ...                                     cache=True):
+            ...     if calib is not None:
+            ...         energy = event.energy * calib.scale
+        """
+        index = self.index(keys, cache=cache)
+        names = index.names
+        if not self._buffer:
+            self.create_buffer()
+        for event in other:
+            entry = index.entry(*[getattr(event, name) for name in names])
+            if entry < 0:
+                yield event, None
+                continue
+            self.GetEntry(entry)
+            yield event, self._buffer
+
+    @contextmanager
+    def _selected_entries(self, selection):
+        """
+        Context manager that restricts the entries of this tree to those
+        passing the selection if the selection cache is enabled. Entries
+        excluded by an entry list already applied remain excluded.
+        """
+        if not self.selection_cache or not selection:
+            yield None
+            return
+        elist = self.entry_list(selection)
+        old_elist = self.GetEntryList()
+        if old_elist:
+            elist = intersect_entry_lists(elist, old_elist)
+        self.SetEntryList(elist)
+        try:
+            yield elist
+        finally:
+            self.SetEntryList(old_elist)
+
+    def _iter_entry_numbers(self, start=0, stop=None):
+        """
+        Iterator over the entry numbers in [start, stop) honoring the current
+        entry list
+        """
+        if stop is None:
+            stop = self.GetEntries()
+        elist = self.GetEntryList()
+        if elist:
+            n = elist.GetN()
+            # binary search for the first entry not below start since the
+            # entry list is sorted
+            lo, hi = 0, n
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if elist.GetEntry(mid) < start:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            for i in range(lo, n):
+                entry = elist.GetEntry(i)
+                if entry >= stop:
+                    break
+                yield entry
+        else:
+            for i in range(start, stop):
+                yield i
+
     @classmethod
     def branch_type(cls, branch):
         """
@@ -111,10 +244,26 @@ class BaseTree(NamedObject):
         """
         return branch.GetNleaves() == 1
 
-    def create_buffer(self, ignore_unsupported=False):
+    def create_buffer(self, ignore_unsupported=False, fast_access=None):
         """
         Create this tree's TreeBuffer
+
+        Parameters
+        ----------
+        ignore_unsupported : bool, optional (default=False)
+            If True then ignore branches of unsupported types instead of
+            raising a TypeError.
+
+        fast_access : bool, optional (default=None)
+            If not None then set ``fast_access`` on this tree. When iterating
+            over the tree with ``fast_access`` enabled (and without reading
+            branches on demand) the entries are accessors generated for the
+            schema of the TreeBuffer (see
+            ``rootpy.tree.treebuffer.create_accessor``) where each branch is a
+            property reading the value directly.
         """
+        if fast_access is not None:
+            self.fast_access = fast_access
         bufferdict = OrderedDict()
         for branch in self.iterbranches():
             # only include activated branches
@@ -225,7 +374,8 @@ class BaseTree(NamedObject):
                         "Attempting to create two branches "
                         "with the same name: `{0}`".format(name))
                 if isinstance(value, Scalar):
-                    self.Branch(name, value,
+                    # variables in a TreeRecord point into the record
+                    self.Branch(name, getattr(value, 'buffer', value),
                         '{0}/{1}'.format(
                             name, value.type))
                 elif isinstance(value, Array):
@@ -239,7 +389,8 @@ class BaseTree(NamedObject):
             for name in branches:
                 value = treebuffer[name]
                 if self.has_branch(name):
-                    self.SetBranchAddress(name, value)
+                    self.SetBranchAddress(
+                        name, getattr(value, 'buffer', value))
                 elif not ignore_missing:
                     raise ValueError(
                         "Attempting to set address for "
@@ -255,6 +406,7 @@ class BaseTree(NamedObject):
                 if branch in treebuffer:
                     newbuffer[branch] = treebuffer[branch]
             newbuffer.set_objects(treebuffer)
+            newbuffer._record = treebuffer._record
             self.update_buffer(newbuffer, transfer_objects=transfer_objects)
 
     def activate(self, branches, exclusive=False):
@@ -405,6 +557,21 @@ class BaseTree(NamedObject):
     def __iter__(self):
         """
         Iterator over the entries in the Tree.
+
+        If ``read_branches_on_demand`` is True then only the branches
+        accessed are read. If ``learn_branches`` is also positive then the
+        branches accessed in the first ``learn_branches`` entries (or the
+        branches in ``learned_branches`` if set) are read together in each
+        of the remaining entries while other branches are still read on
+        demand. The branches accessed are stored in ``learned_branches``.
+        """
+        return self.iter_range()
+
+    def iter_range(self, start=0, stop=None):
+        """
+        Iterator over the entries in the range [start, stop) of the Tree as
+        with ``__iter__``. See ``clusters`` for ranges aligned to the
+        clusters of baskets.
         """
         if not self._buffer:
             self.create_buffer()
@@ -425,34 +592,341 @@ class BaseTree(NamedObject):
                 # add branches that we should always read to cache
                 self.AddBranchToCache(branch)
 
-            for i in range(self.GetEntries()):
-                # Only increment current entry.
-                # getattr on a branch will then GetEntry on only that branch
-                # see ``TreeBuffer.get_with_read_if_cached``.
-                self._current_entry = i
-                self.LoadTree(i)
-                for attr in self._always_read:
-                    # Always read branched in ``self._always_read`` since
-                    # these branches may never be getattr'd but the TreeBuffer
-                    # should always be updated to reflect their current values.
-                    # This is useful if you are iterating over an input tree
-                    # and writing to an output tree that shares the same
-                    # TreeBuffer but you don't getattr on all branches of the
-                    # input tree in the logic that determines which entries
-                    # to keep.
-                    self._branch_cache[attr].GetEntry(i)
-                self._buffer._entry.set(i)
-                yield self._buffer
-                self._buffer.next_entry()
-                self._buffer.reset_collections()
+            learned = None
+            if self.learned_branches is not None:
+                # start with the branches learned in a previous loop
+                learned = self._bulk_read(self.learned_branches)
+            try:
+                for n, i in enumerate(
+                        self._iter_entry_numbers(start, stop)):
+                    if (learned is None and self.learn_branches > 0 and
+                            n == self.learn_branches):
+                        learned = self._bulk_read(
+                            self._buffer._branch_cache)
+                    # Only increment current entry.
+                    # getattr on a branch will then GetEntry on only that
+                    # branch see ``TreeBuffer.get_with_read_if_cached``.
+                    self._current_entry = i
+                    self._buffer._current_entry = i
+                    self.LoadTree(i)
+                    if learned is not None:
+                        # read all learned branches and mark them as read in
+                        # this entry. Other branches are still read on demand.
+                        for branch in learned:
+                            branch.GetEntry(i)
+                        self._buffer._branch_cache_event.update(learned)
+                    else:
+                        for attr in self._always_read:
+                            # Always read branched in ``self._always_read``
+                            # since these branches may never be getattr'd but
+                            # the TreeBuffer should always be updated to
+                            # reflect their current values. This is useful if
+                            # you are iterating over an input tree and writing
+                            # to an output tree that shares the same
+                            # TreeBuffer but you don't getattr on all branches
+                            # of the input tree in the logic that determines
+                            # which entries to keep.
+                            self._branch_cache[attr].GetEntry(i)
+                    self._buffer._entry.set(i)
+                    yield self._buffer
+                    self._buffer.next_entry()
+                    self._buffer.reset_collections()
+            finally:
+                if self.learn_branches > 0 or learned is not None:
+                    # export the branches accessed including those read on
+                    # demand after the learning phase
+                    self.learned_branches = sorted(
+                        set(self._buffer._branch_cache) |
+                        set(self.learned_branches or []))
         else:
-            for i in range(self.GetEntries()):
+            entry = self._buffer
+            if self.fast_access:
+                entry = create_accessor(self._buffer)
+            for i in self._iter_entry_numbers(start, stop):
                 # Read all activated branches (can be slow!).
                 super(BaseTree, self).GetEntry(i)
                 self._buffer._entry.set(i)
-                yield self._buffer
+                yield entry
                 self._buffer.reset_collections()
 
+    def auto_cache_size(self, branches=None, min_size=1000000,
+                        max_size=256000000):
+        """
+        Return a TTreeCache size that holds the compressed baskets of the
+        largest cluster of ``branches`` (by default the active branches)
+        with some headroom, clipped to [min_size, max_size] bytes.
+        """
+        entries = self.GetEntries()
+        if entries == 0:
+            return min_size
+        if branches is None:
+            branches = [name for name in self.iterbranchnames()
+                        if self.GetBranchStatus(name)]
+        zip_bytes = 0
+        for name in set(branches):
+            branch = self.GetBranch(name)
+            if branch:
+                # include the sub-branches of split branches
+                zip_bytes += branch.GetZipBytes('*')
+        cluster_entries = max(stop - start for start, stop in self.clusters())
+        size = int(1.2 * zip_bytes * cluster_entries / float(entries))
+        return max(min_size, min(max_size, size))
+
+    def configure_cache(self, size='auto', learn_entries=10, branches=None):
+        """
+        Enable the TTreeCache and return its size in bytes.
+
+        Parameters
+        ----------
+        size : int or 'auto', optional (default='auto')
+            The size of the cache in bytes or 'auto' to size the cache from
+            the compressed size of the largest cluster of ``branches`` (see
+            ``auto_cache_size``)
+
+        learn_entries : int, optional (default=10)
+            The number of entries used to learn which branches are read
+
+        branches : list, optional (default=None)
+            The branches known to be read, i.e. the branches that are always
+            read and those learned in a previous loop. These branches are
+            added to the cache and the learning phase is skipped.
+        """
+        if size == 'auto':
+            size = self.auto_cache_size(branches)
+        self.SetCacheSize(size)
+        if branches:
+            for name in branches:
+                if self.GetBranch(name):
+                    self.AddBranchToCache(name, True)
+            self.StopCacheLearningPhase()
+        else:
+            self.SetCacheLearnEntries(learn_entries)
+        return size
+
+    def clusters(self, start=0, stop=None):
+        """
+        Return the list of (start, stop) entry ranges of the clusters of
+        baskets in the range [start, stop). The baskets of all branches are
+        aligned on cluster boundaries so each range can be read
+        independently without reading the same baskets twice.
+        """
+        entries = self.GetEntries()
+        if stop is None or stop > entries:
+            stop = entries
+        ranges = []
+        if start >= stop:
+            return ranges
+        clusters = self.GetClusterIterator(start)
+        first = clusters.Next()
+        while first < stop:
+            last = min(clusters.GetNextEntry(), stop)
+            if last <= first:
+                break
+            ranges.append((max(first, start), last))
+            first = clusters.Next()
+        return ranges
+
+    def build_zonemap(self, branches, save=True):
+        """
+        Build a ``rootpy.tree.zonemap.ZoneMap`` of the minimum, maximum and
+        number of NaN values of scalar branches in each cluster of entries
+        (see ``clusters``) and use it to skip clusters in ``iter_batches``
+        when a selection compares these branches with constants.
+
+        Parameters
+        ----------
+        branches : str or list
+            The numeric scalar branches, i.e. the branches used in selections
+            of time windows, run ranges or thresholds on sorted data
+
+        save : bool, optional (default=True)
+            Write the zone map into a sidecar file next to the ROOT file
+            where it is found by ``load_zonemap``
+
+        Returns
+        -------
+        The zone map
+        """
+        from .zonemap import ZoneMap, sidecar
+        zonemap = ZoneMap.build(self, branches)
+        filename = sidecar(self)
+        if save and filename is not None:
+            try:
+                zonemap.save(filename)
+            except (IOError, OSError) as e:
+                log.warning("unable to write zone map {0}: {1}".format(
+                    filename, e))
+            else:
+                log.info("wrote zone map of {0:d} clusters to {1}".format(
+                    len(zonemap), filename))
+        self.zonemap = zonemap
+        return zonemap
+
+    def load_zonemap(self):
+        """
+        Read the zone map written by ``build_zonemap`` from its sidecar file
+        if it exists and the ROOT file has not changed since.
+
+        Returns
+        -------
+        The zone map or None
+        """
+        from .cache import cache_key
+        from .zonemap import ZoneMap, sidecar
+        filename = sidecar(self)
+        if filename is None or not os.path.exists(filename):
+            return None
+        try:
+            zonemap = ZoneMap.load(filename)
+        except (IOError, ValueError, KeyError) as e:
+            log.warning("ignoring unreadable zone map {0}: {1}".format(
+                filename, e))
+            return None
+        if zonemap.key is None or zonemap.key != cache_key(self, 'zonemap'):
+            log.warning("ignoring stale zone map {0}".format(filename))
+            return None
+        self.zonemap = zonemap
+        return zonemap
+
+    def _bulk_read(self, names):
+        """
+        Look up the TBranches in ``names`` and ``always_read`` that are read
+        in each entry while reading branches on demand. Return a dict of
+        these TBranches to mark as read in each entry (see
+        ``TreeBuffer.get_with_read_if_cached``). Other branches remain active
+        so that they can still be read on demand.
+        """
+        branches = {}
+        for name in set(names) | set(self._always_read):
+            if name not in self._buffer:
+                continue
+            branch = self._buffer._branch_cache.get(name)
+            if branch is None:
+                branch = self.GetBranch(name)
+                if not branch:
+                    continue
+                self._buffer._branch_cache[name] = branch
+                self.AddBranchToCache(branch)
+            try:
+                hash(branch)
+            except TypeError:
+                # PyROOT missing __hash__ for Python 3
+                branch.__class__.__hash__ = object.__hash__
+            branches[branch] = None
+        names = [branch.GetName() for branch in branches]
+        log.info("reading {0:d} learned branches: {1}".format(
+            len(names), ', '.join(sorted(names))))
+        return branches
+
+    def _batch_branches(self, branches=None):
+        """
+        Determine the names of the branches that can be read in batches.
+        Only activated branches are considered. By default all branches
+        that the reader can convert into arrays are included and the others
+        are skipped with an ``UnconvertibleWarning``.
+        """
+        if branches is None:
+            from .reader import _default_branches
+            return _default_branches(self)
+        if isinstance(branches, string_types):
+            branches = [branches]
+        names = []
+        for branch in branches:
+            if '*' in branch:
+                names += [name for name in self.glob(branch)
+                          if self.GetBranchStatus(name)]
+                continue
+            if not self.has_branch(branch):
+                raise ValueError(
+                    "branch `{0}` does not exist".format(branch))
+            if not self.GetBranchStatus(branch):
+                raise ValueError(
+                    "branch `{0}` is not activated".format(branch))
+            names.append(branch)
+        return names
+
+    def _read_batch(self, branches, selection, start, stop):
+        """
+        Read the entries in the range [start, stop) of these branches into
+        a dict of NumPy arrays honoring the current entry list
+        """
+        from .reader import read
+        return read(self, branches, selection, start, stop,
+                    entry_list=self.GetEntryList())
+
+    def iter_batches(self, branches=None, batch_size=100000,
+                     start=0, stop=None, selection=None):
+        """
+        Iterate over the entries of this tree in batches where each batch is
+        a dict mapping branch names to NumPy arrays. This avoids the overhead
+        of ``GetEntry`` and attribute lookups on the TreeBuffer for each
+        entry and allows selections to be vectorized with NumPy. As when
+        iterating over events, only the entries in the entry list of the tree
+        (see ``SetEntryList``) are included.
+
+        Parameters
+        ----------
+        branches : str or list, optional (default=None)
+            Only read these branches. Patterns containing '*' are globbed
+            against the activated branches. If None, all activated branches
+            of basic types, arrays of basic types and vectors of basic types
+            are read. A ValueError is raised if a requested branch is
+            deactivated.
+
+        batch_size : int, optional (default=100000)
+            The number of tree entries considered in each batch. If a
+            ``selection`` is applied then the batches may contain fewer
+            entries.
+
+        start : int, optional (default=0)
+            The first entry
+
+        stop : int, optional (default=None)
+            Stop before this entry. By default continue until the last entry.
+
+        selection : str or rootpy.tree.Cut, optional (default=None)
+            Only include entries passing this selection. If a ``zonemap`` is
+            set (see ``build_zonemap``), the clusters of entries where the
+            comparisons of branches with constants in the selection cannot
+            pass are skipped without being read.
+
+        Returns
+        -------
+        An iterator over ``rootpy.tree.treebuffer.Batch`` dicts of NumPy
+        arrays. Columns are also accessible as attributes of the batch.
+        Fixed-length arrays are
+        two-dimensional and variable-length arrays (arrays with a
+        ``length_name``) and vectors are object arrays of arrays (jagged).
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        names = self._batch_branches(branches)
+        if not names:
+            raise RuntimeError("no branches selected")
+        entries = self.GetEntries()
+        if stop is None or stop > entries:
+            stop = entries
+        selection = str(Cut(selection))
+        if selection and self.zonemap is not None:
+            # skip the clusters that cannot contain passing entries
+            ranges = self.zonemap.ranges(selection, start, stop)
+            log.debug(
+                "reading {0:d} of {1:d} entries with the zone map".format(
+                    sum(last - first for first, last in ranges),
+                    stop - start))
+        else:
+            ranges = [(start, stop)]
+        for range_start, range_stop in ranges:
+            for batch_start in range(range_start, range_stop, batch_size):
+                batch_stop = min(batch_start + batch_size, range_stop)
+                batch = self._read_batch(
+                    names, selection, batch_start, batch_stop)
+                self.entries_read += batch_stop - batch_start
+                if ((selection or self.GetEntryList()) and
+                        batch.size == 0):
+                    continue
+                yield batch
+
     def __setattr__(self, attr, value):
         if '_inited' not in self.__dict__ or attr in self.__dict__:
             return super(BaseTree, self).__setattr__(attr, value)
@@ -580,6 +1054,103 @@ class BaseTree(NamedObject):
             if limit is not None and i + 1 == limit:
                 break
 
+    def export(self, output, format=None, branches=None,
+               include_labels=True, limit=None, sep=',',
+               batch_size=100000):
+        """
+        Export branches in batches (see ``iter_batches``) into CSV, NumPy
+        .npy (a structured array) or .npz (one array per branch) or Apache
+        Parquet format. This is much faster than ``csv`` for large trees and
+        only holds one batch in memory at a time.
+
+        Parameters
+        ----------
+        output : str or file
+            The output filename or a stream for the CSV format
+
+        format : str, optional (default=None)
+            One of 'csv', 'npy', 'npz' or 'parquet'. By default the format is
+            determined by the extension of the output filename.
+
+        branches : list, optional (default=None)
+            Only include these branches. If None, then all branches of basic
+            types and fixed-length arrays of basic types will be included
+            (and also variable-length arrays and vectors in the Parquet
+            format). Other branches are skipped with a warning. A TypeError
+            is raised if a variable-length array or vector is listed
+            explicitly for the CSV, .npy or .npz formats.
+
+        include_labels : bool, optional (default=True)
+            Include a first row of branch names labelling each column in the
+            CSV format.
+
+        limit : int, optional (default=None)
+            Only include up to a maximum of ``limit`` entries.
+
+        sep : str, optional (default=',')
+            The delimiter used to separate columns in the CSV format
+
+        batch_size : int, optional (default=100000)
+            The number of entries read and written at once
+        """
+        from .export import (
+            FORMATS, write_csv, write_npy, write_npz, write_parquet)
+        if format is None:
+            if not isinstance(output, string_types):
+                raise ValueError(
+                    "the format must be specified when writing to a stream")
+            format = FORMATS.get(os.path.splitext(output)[1].lower())
+            if format is None:
+                raise ValueError(
+                    "unable to determine the format of {0}".format(output))
+        elif format not in FORMATS.values():
+            raise ValueError("unsupported format: {0}".format(format))
+        names = self._batch_branches(branches)
+        if not names:
+            raise RuntimeError(
+                "no branches selected or no "
+                "branches of scalar or array types exist")
+        entries = self.GetEntries()
+        if limit is not None:
+            entries = min(limit, entries)
+        # the empty columns determine the types of the output
+        template = self._read_batch(names, '', 0, 0)
+        if branches is None and format != 'parquet':
+            jagged = [name for name, column in template.items()
+                      if column.dtype == object]
+            if jagged:
+                log.warning(
+                    "skipping variable-length branches that cannot be "
+                    "exported in the {0} format: {1}".format(
+                        format, ', '.join(jagged)))
+                names = [name for name in names if name not in jagged]
+                if not names:
+                    raise RuntimeError(
+                        "no branches of scalar or array types exist")
+                template = self._read_batch(names, '', 0, 0)
+        batches = self.iter_batches(names, batch_size=batch_size, stop=entries)
+        if format == 'csv':
+            if isinstance(output, string_types):
+                with open(output, 'w') as stream:
+                    write_csv(stream, template, batches, sep=sep,
+                              include_labels=include_labels)
+            else:
+                write_csv(output, template, batches, sep=sep,
+                          include_labels=include_labels)
+        elif format == 'npy':
+            write_npy(output, template, batches, entries)
+        elif format == 'npz':
+            write_npz(output, template, batches, entries)
+        else:
+            from .reader import _column
+            # the types of the elements of variable-length branches
+            elements = {}
+            for name, column in template.items():
+                if column.dtype == object:
+                    info = _column(self, name)
+                    elements[name] = (info.dtype, info.shape)
+            write_parquet(output, template, batches, elements)
+
     def Scale(self, value):
         """
         Scale the weight of the Tree by ``value``
@@ -616,6 +1187,8 @@ class BaseTree(NamedObject):
                       weighted_cut * cut)
             self.SetWeight(weight)
             entries = hist.Integral()
+        elif cut and self.selection_cache:
+            entries = self.entry_list(cut).GetN()
         elif cut:
             entries = super(BaseTree, self).GetEntries(str(cut))
         else:
@@ -624,40 +1197,193 @@ class BaseTree(NamedObject):
             entries *= self.GetWeight()
         return entries
 
+    def describe(self, expressions, cut=None, weight=None,
+                 batch_size=100000, reservoir_size=10000):
+        """
+        Compute summary statistics of one or more expressions in a single
+        pass over the entries passing ``cut``. The expressions are evaluated
+        on batches of entries (see ``iter_batches`` and
+        ``rootpy.tree.expression``).
+
+        Parameters
+        ----------
+        expressions : str or list
+            An expression or list of expressions
+
+        cut : str or rootpy.tree.Cut, optional (default=None)
+            Only include entries passing this selection
+
+        weight : str, optional (default=None)
+            An expression for the weight of each entry
+
+        batch_size : int, optional (default=100000)
+            The number of entries read at once
+
+        reservoir_size : int, optional (default=10000)
+            The number of values sampled to estimate the quantiles
+
+        Returns
+        -------
+        A ``rootpy.tree.summary.Summary`` if ``expressions`` is a string,
+        otherwise an OrderedDict mapping each expression to its Summary.
+        Summaries of different trees can be merged with ``Summary.merge``.
+        """
+        from .expression import compile
+        from .summary import Summary
+        single = isinstance(expressions, string_types)
+        if single:
+            expressions = [expressions]
+        compiled = [compile(expression) for expression in expressions]
+        branches = set()
+        for expression in compiled:
+            branches.update(expression.branches)
+        if weight:
+            weight = compile(weight)
+            branches.update(weight.branches)
+        summaries = OrderedDict(
+            (expression, Summary(expression, reservoir_size=reservoir_size))
+            for expression in expressions)
+        for batch in self.iter_batches(sorted(branches) or None,
+                                       batch_size=batch_size,
+                                       selection=cut):
+            weights = weight(batch) if weight else None
+            for expression, summary in zip(compiled, summaries.values()):
+                summary.fill(expression(batch), weights)
+        if single:
+            return summaries[expressions[0]]
+        return summaries
+
+    def draw_many(self, booking, batch_size=100000, selection=None):
+        """
+        Fill many histograms in a single pass over the entries
+
+        Parameters
+        ----------
+        booking : HistogramBooking or list
+            A ``rootpy.tree.booking.HistogramBooking`` or a list of dicts of
+            the arguments of ``HistogramBooking.book`` or tuples of
+            (expression, selection, weight, binning)
+
+        batch_size : int, optional (default=100000)
+            The number of entries read at once
+
+        selection : str or rootpy.tree.Cut, optional (default=None)
+            Only consider entries passing this selection
+
+        Returns
+        -------
+        The list of filled histograms in the order they were booked
+        """
+        from .booking import HistogramBooking
+        if not isinstance(booking, HistogramBooking):
+            booking = HistogramBooking.from_requests(booking)
+        for batch in self.iter_batches(booking.branches or None,
+                                       batch_size=batch_size,
+                                       selection=selection):
+            booking.fill(batch, self.GetWeight())
+        return booking.finalize()
+
+    def _extremum(self, expression, cut, maximum):
+        from .expression import compile
+        try:
+            branches = compile(expression).branches
+        except SyntaxError:
+            branches = None
+        if branches is None or not all(
+                self.has_branch(branch) for branch in branches):
+            # only TTreeFormula can evaluate this expression (i.e. with
+            # aliases or special functions such as Length$ or Sum$)
+            return self._draw_extremum(expression, cut, maximum)
+        summary = self.describe(expression, cut)
+        if summary.entries == 0:
+            # as TTree::GetMaximum and TTree::GetMinimum
+            return -sys.float_info.max if maximum else sys.float_info.max
+        return summary.max if maximum else summary.min
+
+    def _draw_extremum(self, expression, cut, maximum):
+        estimate = self.GetEstimate()
+        # keep the values of all selected entries
+        self.SetEstimate(self.GetEntries() + 1)
+        try:
+            self.Draw(expression, cut or '', 'goff')
+            vals = self.GetV1()
+            n = self.GetSelectedRows()
+            vals = [vals[i] for i in range(n)]
+        finally:
+            self.SetEstimate(estimate)
+        if not vals:
+            return -sys.float_info.max if maximum else sys.float_info.max
+        return max(vals) if maximum else min(vals)
+
     def GetMaximum(self, expression, cut=None):
         """
-        TODO: we need a better way of determining the maximum value of an
-        expression.
+        Return the maximum value of an expression over the entries passing
+        ``cut`` in the entry list of the tree, if any (see ``describe``).
+        Expressions that are not supported by ``rootpy.tree.expression``
+        are evaluated with ``TTree::Draw``. As in ``TTree::GetMaximum`` the
+        lowest float is returned if no entries are selected.
         """
-        if cut:
-            self.Draw(expression, cut, 'goff')
-        else:
-            self.Draw(expression, '', 'goff')
-        vals = self.GetV1()
-        n = self.GetSelectedRows()
-        vals = [vals[i] for i in range(min(n, 10000))]
-        return max(vals)
+        return self._extremum(expression, cut, True)
 
     def GetMinimum(self, expression, cut=None):
         """
-        TODO: we need a better way of determining the minimum value of an
-        expression.
+        Return the minimum value of an expression over the entries passing
+        ``cut`` in the entry list of the tree, if any (see ``describe``).
+        Expressions that are not supported by ``rootpy.tree.expression``
+        are evaluated with ``TTree::Draw``. As in ``TTree::GetMinimum`` the
+        largest float is returned if no entries are selected.
         """
-        if cut:
-            self.Draw(expression, cut, "goff")
-        else:
-            self.Draw(expression, "", "goff")
-        vals = self.GetV1()
-        n = self.GetSelectedRows()
-        vals = [vals[i] for i in range(min(n, 10000))]
-        return min(vals)
+        return self._extremum(expression, cut, False)
 
     def CopyTree(self, selection, *args, **kwargs):
         """
         Copy the tree while supporting a rootpy.tree.cut.Cut selection in
         addition to a simple string.
         """
-        return super(BaseTree, self).CopyTree(str(selection), *args, **kwargs)
+        with self._selected_entries(selection):
+            return super(BaseTree, self).CopyTree(
+                str(selection), *args, **kwargs)
+
+    def sorted_copy(self, keys, output=None, run_size=1000000,
+                    batch_size=100000, tmpdir=None):
+        """
+        Copy the entries of this tree into a new tree ordered by the values
+        of one or more expressions. Entries with equal keys keep their
+        order. Trees larger than ``run_size`` entries are sorted with an
+        external merge sort: runs of entries are sorted in memory and written
+        into temporary files, then the runs are merged into the new tree.
+        Only the keys of the current run are held in memory.
+
+        Parameters
+        ----------
+        keys : str or list
+            An expression or list of expressions (see
+            ``rootpy.tree.expression``) with one value per entry. Entries are
+            ordered by the first expression, then by the second and so on.
+            Use i.e. '-pt' for a descending order.
+
+        output : TDirectory, optional (default=None)
+            The file or directory of the new tree. By default the tree is
+            created in the current directory.
+
+        run_size : int, optional (default=1000000)
+            The number of entries sorted in memory at once
+
+        batch_size : int, optional (default=100000)
+            The number of entries read and copied at once
+
+        tmpdir : str, optional (default=None)
+            The directory of the temporary files of the runs. By default the
+            system temporary directory is used.
+
+        Returns
+        -------
+        The sorted tree. As with ``CopyTree`` it must be written by the
+        caller.
+        """
+        from .sort import sorted_copy
+        return sorted_copy(self, keys, output=output, run_size=run_size,
+                           batch_size=batch_size, tmpdir=tmpdir)
 
     def reset_branch_values(self):
         """
@@ -813,7 +1539,8 @@ class BaseTree(NamedObject):
             else:
                 context = do_nothing()
             with context:
-                super(BaseTree, self).Draw(expression, selection, options)
+                with self._selected_entries(selection):
+                    super(BaseTree, self).Draw(expression, selection, options)
 
         if hist is None:
             # Retrieve histogram made by TTree.Draw
@@ -856,9 +1583,12 @@ class BaseTree(NamedObject):
 
     def to_array(self, *args, **kwargs):
         """
-        Convert this tree into a NumPy structured array
+        Convert this tree into a NumPy structured array. The arguments are
+        those of ``root_numpy.tree2array``. The branches, selection, range
+        and weight are read with the compiled reader in
+        ``rootpy.tree.reader`` and other arguments require root_numpy.
         """
-        from root_numpy import tree2array
+        from .reader import tree2array
         return tree2array(self, *args, **kwargs)
 
 
@@ -879,19 +1609,63 @@ class Tree(BaseTree, QROOT.TTree):
 
     model : TreeModel, optional (default=None)
         If specified then this TreeModel will be used to create the branches
+
+    record : bool, optional (default=False)
+        Store the scalar columns of the model in the fields of a single NumPy
+        structured record bound to the branches (see ``record``). A whole
+        entry can then be set and filled with ``fill_record`` and the scalar
+        columns are reset with one copy. This requires NumPy.
     """
     _ROOT = QROOT.TTree
 
     @method_file_check
-    def __init__(self, name=None, title=None, model=None):
+    def __init__(self, name=None, title=None, model=None, record=False):
         super(Tree, self).__init__(name=name, title=title)
         self._buffer = TreeBuffer()
         if model is not None:
             if not issubclass(model, TreeModel):
                 raise TypeError("the model must subclass TreeModel")
-            self.set_buffer(model(), create_branches=True)
+            treebuffer = model()
+            if record:
+                from .record import TreeRecord
+                TreeRecord(treebuffer)
+            self.set_buffer(treebuffer, create_branches=True)
+        elif record:
+            raise ValueError("a record requires a model")
         self._post_init()
 
+    @property
+    def record(self):
+        """
+        The NumPy structured array of one element holding the values of the
+        scalar columns if the Tree was created with ``record=True``,
+        otherwise None
+        """
+        if self._buffer._record is None:
+            return None
+        return self._buffer._record.array
+
+    def fill_record(self, values, reset=False):
+        """
+        Set all scalar columns of the record at once and fill the Tree
+
+        Parameters
+        ----------
+        values : tuple or numpy.void
+            The values in the order of the fields of ``record`` or a row of
+            a structured array with the same dtype
+
+        reset : bool, optional (default=False)
+            Reset the values in the buffer to their default values after
+            filling.
+        """
+        record = self._buffer._record
+        if record is None:
+            raise RuntimeError(
+                "the Tree was not created with record=True")
+        record.set(values)
+        self.Fill(reset=reset)
+
     def Fill(self, reset=False):
         """
         Fill the Tree with the current values in the buffer
@@ -907,6 +1681,37 @@ class Tree(BaseTree, QROOT.TTree):
         if reset:
             self._buffer.reset()
 
+    def extend(self, arrays, reset=False):
+        """
+        Fill many entries at once from NumPy arrays. The values of each entry
+        are copied into the buffer and the Tree is filled in a compiled loop.
+        Branches not included in ``arrays`` are filled with their current
+        values in the buffer.
+
+        Parameters
+        ----------
+        arrays : dict
+            A dict mapping branch names to arrays with one element (or one
+            row for fixed-length array branches) per entry. Variable-length
+            array branches (with a ``length_name``) are given either as a pair
+            of (offsets, values) where the values of entry i are
+            ``values[offsets[i]:offsets[i + 1]]`` or as an object array of
+            arrays. Their length branches are filled automatically.
+
+        reset : bool, optional (default=False)
+            Reset the values in the buffer to their default values after
+            filling.
+
+        Returns
+        -------
+        The number of entries filled
+        """
+        from .bulk import extend
+        entries = extend(self, arrays)
+        if reset:
+            self._buffer.reset()
+        return entries
+
 
 @snake_case_methods
 class Ntuple(BaseTree, QROOT.TNtuple):
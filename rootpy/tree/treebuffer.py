@@ -5,6 +5,8 @@ from __future__ import absolute_import
 import sys
 import re
 import inspect
+import keyword
+from array import array
 
 import ROOT
 
@@ -18,15 +20,39 @@ from . import log
 from .. import lookup_by_name, create, stl
 from ..base import Object
 from ..extern.six import string_types
-from .treetypes import Column, Scalar, Array, Int, Char, UChar, BaseCharArray
+from .treetypes import (
+    Column, Scalar, BaseScalar, Array, Int, Char, UChar, BaseCharArray)
 from .treeobject import TreeCollection, TreeObject, mix_classes
 
 
 __all__ = [
     'TreeBuffer',
+    'TreeBufferAccessor',
+    'create_accessor',
+    'Batch',
 ]
 
 
+__ACCESSORS__ = {}
+
+
+def _assign(variable, value, attr, clsname):
+    """
+    Set the value of a variable in a TreeBuffer
+    """
+    if isinstance(variable, (Scalar, Array)):
+        variable.set(value)
+    elif isinstance(variable, Object):
+        variable.copy_from(value)
+    elif isinstance(variable, (ROOT.TObject, ROOT.ObjectProxy)):
+        # copy constructor
+        variable.__init__(value)
+    else:
+        raise TypeError(
+            "cannot set attribute `{0}` of `{1}` instance".format(
+                attr, clsname))
+
+
 class TreeBuffer(OrderedDict):
     """
     A dictionary mapping branch names to values
@@ -46,6 +72,8 @@ class TreeBuffer(OrderedDict):
         self._current_entry = 0
         self._collections = {}
         self._objects = []
+        # the TreeRecord holding the scalar variables (see rootpy.tree.record)
+        self._record = None
         self._entry = Int(0)
         self.__process(branches)
         self._inited = True
@@ -128,10 +156,18 @@ class TreeBuffer(OrderedDict):
 
     def reset(self):
         if sys.version_info[0] < 3:
-            iter_values = self.itervalues()
+            iter_items = self.iteritems()
         else:
-            iter_values = self.values()
-        for value in iter_values:
+            iter_items = self.items()
+        record = self._record
+        in_record = ()
+        if record is not None:
+            # reset all variables in the record at once
+            record.reset()
+            in_record = record.names
+        for name, value in iter_items:
+            if name in in_record:
+                continue
             if isinstance(value, (Scalar, Array)):
                 value.reset()
             elif isinstance(value, Object):
@@ -146,6 +182,8 @@ class TreeBuffer(OrderedDict):
     def update(self, branches=None):
         if isinstance(branches, TreeBuffer):
             self._entry = branches._entry
+            if branches._record is not None:
+                self._record = branches._record
             for name, value in branches.items():
                 super(TreeBuffer, self).__setitem__(name, value)
             self._fixed_names.update(branches._fixed_names)
@@ -204,20 +242,9 @@ class TreeBuffer(OrderedDict):
         if '_inited' not in self.__dict__ or attr in self.__dict__:
             return super(TreeBuffer, self).__setattr__(attr, value)
         elif attr in self:
-            variable = self.get_with_read_if_cached(attr)
-            if isinstance(variable, (Scalar, Array)):
-                variable.set(value)
-                return
-            elif isinstance(variable, Object):
-                variable.copy_from(value)
-                return
-            elif isinstance(variable, (ROOT.TObject, ROOT.ObjectProxy)):
-                # copy constructor
-                variable.__init__(value)
-                return
-            raise TypeError(
-                "cannot set attribute `{0}` of `{1}` instance".format(
-                    attr, self.__class__.__name__))
+            _assign(self.get_with_read_if_cached(attr), value,
+                    attr, self.__class__.__name__)
+            return
         raise AttributeError(
             "`{0}` instance has no attribute `{1}`".format(
                 self.__class__.__name__, attr))
@@ -280,3 +307,156 @@ class TreeBuffer(OrderedDict):
         for name, value in self.items():
             rep += '{0} -> {1}\n'.format(name, repr(value))
         return rep
+
+
+class TreeBufferAccessor(object):
+    """
+    Base class of the accessor classes generated for each TreeBuffer schema
+    by ``create_accessor``. Branches are exposed as properties that access
+    the underlying variables directly. Everything else is delegated to the
+    TreeBuffer.
+    """
+    __slots__ = ('_buffer',)
+    _NAMES = ()
+
+    def __init__(self, treebuffer):
+        object.__setattr__(self, '_buffer', treebuffer)
+        for i, name in enumerate(self._NAMES):
+            object.__setattr__(self, '_v{0:d}'.format(i),
+                               OrderedDict.__getitem__(treebuffer, name))
+
+    def __getattr__(self, attr):
+        return getattr(self._buffer, attr)
+
+    def __getitem__(self, name):
+        return self._buffer[name]
+
+    def __contains__(self, name):
+        return name in self._buffer
+
+    def __iter__(self):
+        return iter(self._buffer)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def __repr__(self):
+        return repr(self._buffer)
+
+    def __str__(self):
+        return str(self._buffer)
+
+
+_ACCESSOR_SCALAR = '''
+    def _get_{index:d}(self):
+        return _getitem(self._v{index:d}, 0)
+
+    def _set_{index:d}(self, value):
+        self._v{index:d}.set(value)
+
+    {attr} = property(_get_{index:d}, _set_{index:d})
+'''
+
+_ACCESSOR_VALUE = '''
+    def _get_{index:d}(self):
+        return self._v{index:d}.value
+
+    def _set_{index:d}(self, value):
+        self._v{index:d}.set(value)
+
+    {attr} = property(_get_{index:d}, _set_{index:d})
+'''
+
+_ACCESSOR_OBJECT = '''
+    def _get_{index:d}(self):
+        return self._v{index:d}
+
+    def _set_{index:d}(self, value):
+        _assign(self._v{index:d}, value, '{attr}', '{clsname}')
+
+    {attr} = property(_get_{index:d}, _set_{index:d})
+'''
+
+
+def create_accessor(treebuffer):
+    """
+    Return an accessor for a TreeBuffer. The accessor class is generated once
+    for each schema (the branch names and kinds of variables) and has
+    a property for each branch reading the value directly from the variable.
+    This avoids the name lookups and type checks of ``TreeBuffer.__getattr__``
+    but it is only valid while all branches are read with ``GetEntry`` (i.e.
+    not when reading branches on demand).
+    """
+    fixed_names = dict(
+        (name, fixed) for fixed, name in treebuffer._fixed_names.items())
+    schema = []
+    for name, value in treebuffer.items():
+        attr = fixed_names.get(name, name)
+        if (keyword.iskeyword(attr) or
+                hasattr(TreeBufferAccessor, attr) or not attr):
+            # fall back on the TreeBuffer
+            continue
+        if isinstance(value, BaseScalar):
+            template = _ACCESSOR_SCALAR
+        elif isinstance(value, Scalar):
+            template = _ACCESSOR_VALUE
+        else:
+            template = _ACCESSOR_OBJECT
+        schema.append((name, attr, template))
+    schema = tuple(schema)
+    try:
+        cls = __ACCESSORS__[schema]
+    except KeyError:
+        clsname = 'TreeBufferAccessor_{0:d}'.format(len(__ACCESSORS__))
+        cls_def = ['class {0}(TreeBufferAccessor):'.format(clsname)]
+        cls_def.append('    __slots__ = ({0})'.format(''.join(
+            "'_v{0:d}', ".format(i) for i in range(len(schema)))))
+        cls_def.append('    _NAMES = ({0})'.format(''.join(
+            '{0!r}, '.format(name) for name, _, _ in schema)))
+        for index, (name, attr, template) in enumerate(schema):
+            cls_def.append(template.format(
+                index=index, attr=attr, clsname=clsname))
+        namespace = {
+            'TreeBufferAccessor': TreeBufferAccessor,
+            '_getitem': array.__getitem__,
+            '_assign': _assign,
+        }
+        exec('\n'.join(cls_def), namespace)
+        cls = namespace[clsname]
+        __ACCESSORS__[schema] = cls
+    return cls(treebuffer)
+
+
+class Batch(OrderedDict):
+    """
+    A dictionary mapping branch names to NumPy arrays holding the values of
+    consecutive tree entries. Columns are also accessible as attributes so
+    that simple functions of an event such as ``lambda event: event.weight``
+    also work on a batch of events.
+    """
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        try:
+            return self[attr]
+        except KeyError:
+            raise AttributeError(
+                "{0} instance has no attribute `{1}`".format(
+                    self.__class__.__name__, attr))
+
+    @property
+    def size(self):
+        """
+        The number of entries in this batch
+        """
+        for column in self.values():
+            return len(column)
+        return 0
+
+    def select(self, selection):
+        """
+        Return a new Batch of the entries selected by a boolean mask, an
+        array of indices or a slice
+        """
+        return self.__class__(
+            (name, column[selection]) for name, column in self.items())
@@ -2,18 +2,62 @@
 # distributed under the terms of the GNU General Public License
 from __future__ import absolute_import
 
+from array import array
 from copy import deepcopy
 
+from .. import compiled as C
 from ..extern.six.moves import range
+from ..extern.six import string_types
+from .treetypes import Array
 
 __all__ = [
     'TreeObject',
     'TreeCollectionObject',
     'TreeCollection',
+    'TreeCollectionColumns',
 ]
 
 __MIXINS__ = {}
 
+C.register_code("""
+#include <vector>
+#include <TLorentzVector.h>
+
+template <typename T>
+void rootpy_select_elements(std::vector<T>& values,
+                            const long* indices, long n)
+{
+    std::vector<T> selected;
+    selected.reserve(n);
+    for (long i = 0; i < n; ++i) {
+        selected.push_back(values[indices[i]]);
+    }
+    values.swap(selected);
+}
+
+#define ROOTPY_COLLECTION_SELECT(T) \\
+void rootpy_collection_select(std::vector<T >& values, \\
+                              long* indices, long n) \\
+{ \\
+    rootpy_select_elements(values, indices, n); \\
+}
+
+ROOTPY_COLLECTION_SELECT(bool)
+ROOTPY_COLLECTION_SELECT(char)
+ROOTPY_COLLECTION_SELECT(unsigned char)
+ROOTPY_COLLECTION_SELECT(short)
+ROOTPY_COLLECTION_SELECT(unsigned short)
+ROOTPY_COLLECTION_SELECT(int)
+ROOTPY_COLLECTION_SELECT(unsigned int)
+ROOTPY_COLLECTION_SELECT(long)
+ROOTPY_COLLECTION_SELECT(unsigned long)
+ROOTPY_COLLECTION_SELECT(long long)
+ROOTPY_COLLECTION_SELECT(unsigned long long)
+ROOTPY_COLLECTION_SELECT(float)
+ROOTPY_COLLECTION_SELECT(double)
+ROOTPY_COLLECTION_SELECT(TLorentzVector)
+""", ["rootpy_collection_select"])
+
 
 def mix_classes(cls, mixins):
     if not isinstance(mixins, tuple):
@@ -211,12 +255,88 @@ class TreeCollection(object):
             self.selection = range(len(self))
         self.selection = self.selection[slice(start, stop, step)]
 
+    def columns(self):
+        """
+        Return a ``TreeCollectionColumns`` view of the current selection of
+        this collection where attributes are NumPy arrays
+        """
+        return TreeCollectionColumns(self)
+
+    def _owned_branches(self):
+        """
+        The names of the branches of the objects of this collection. The
+        branches of other collections with a longer prefix (i.e.
+        ``jet_track_`` for ``jet_``) and a different size branch and arrays
+        with a different length branch are not included.
+        """
+        others = [
+            prefix for name, prefix, size, mix in
+            getattr(self.tree, '_collections', {}).values()
+            if prefix != self.prefix and prefix.startswith(self.prefix) and
+            size != self.size]
+        names = []
+        for name in list(self.tree.keys()):
+            if not name.startswith(self.prefix) or name == self.size:
+                continue
+            if any(name.startswith(prefix) for prefix in others):
+                continue
+            value = getattr(self.tree, name)
+            length_name = getattr(value, 'length_name', None)
+            if length_name is not None and length_name != self.size:
+                continue
+            names.append(name)
+        return names
+
     def make_persistent(self):
         """
         Perform actual selection and sorting on underlying
         attribute vectors
+
+        The selected objects are moved to the front of each array branch and
+        vector branch of this collection (with one bulk copy per branch),
+        the vectors are resized and the size branch is updated. An output
+        tree sharing the buffer of this collection then writes the selected
+        objects only. The selection is reset afterwards. A ValueError is
+        raised if an array or vector branch of this collection holds fewer
+        (or, for vectors, more) elements than the collection has objects.
         """
-        pass
+        if self.selection is None:
+            return
+        length = self.len()
+        selection = array('l', self.selection)
+        for name in self._owned_branches():
+            value = getattr(self.tree, name)
+            if isinstance(value, Array):
+                if len(value) < length:
+                    raise ValueError(
+                        "array branch `{0}` holds {1:d} elements but the "
+                        "collection `{2}` has {3:d} objects".format(
+                            name, len(value), self.name, length))
+                if not len(selection):
+                    continue
+                import numpy as np
+                values = np.frombuffer(value, dtype=np.dtype(value.typecode))
+                # the selected values are copied before being moved
+                values[:len(selection)] = values[
+                    np.frombuffer(selection, dtype=np.dtype('l'))]
+            elif type(value).__name__.startswith('vector<'):
+                if len(value) != length:
+                    raise ValueError(
+                        "vector branch `{0}` holds {1:d} elements but the "
+                        "collection `{2}` has {3:d} objects".format(
+                            name, len(value), self.name, length))
+                try:
+                    C.rootpy_collection_select(
+                        value, selection, len(selection))
+                except TypeError:
+                    # vectors of other types are copied in Python
+                    selected = value.__class__()
+                    selected.reserve(len(selection))
+                    for i in selection:
+                        selected.push_back(value[i])
+                    value.swap(selected)
+        setattr(self.tree, self.size, len(selection))
+        self.reset()
 
     def getitem(self, index):
         """
@@ -261,6 +381,112 @@ class TreeCollection(object):
             yield self.__getitem__(index)
 
 
+class TreeCollectionColumns(object):
+    """
+    A columnar view of a TreeCollection. Attributes are the prefixed branches
+    of the collection as NumPy arrays over the selected objects (i.e.
+    ``columns.pt`` for a ``jet_`` collection holds the values of ``jet_pt``)
+    and objects are selected and ordered with array operations instead of a
+    Python object per element. The selection is written back into the
+    collection after each operation so iterating over the collection yields
+    the same objects. A view is only valid for the current entry of the
+    tree.
+
+    .. sourcecode:: python
+
+        >>> jets = event.jets.columns()
+        >>> jets.select((jets.pt > 20) & (abs(jets.eta) < 2.5))
+        >>> jets.sort('pt', reverse=True)
+        >>> leading = event.jets[0]
+    """
+    def __init__(self, collection):
+        import numpy as np
+        self.__dict__['collection'] = collection
+        self.__dict__['_columns'] = {}
+        if collection.selection is None:
+            index = np.arange(collection.len())
+        else:
+            index = np.asarray(collection.selection, dtype=np.intp)
+        self.__dict__['index'] = index
+
+    def column(self, attr):
+        """
+        The values of an attribute for all objects of the collection
+        regardless of the selection
+        """
+        try:
+            return self._columns[attr]
+        except KeyError:
+            pass
+        import numpy as np
+        collection = self.collection
+        value = getattr(collection.tree, collection.prefix + attr)
+        size = collection.len()
+        if isinstance(value, array):
+            # rootpy arrays share their memory
+            column = np.frombuffer(value, dtype=value.typecode)[:size]
+        else:
+            from .reader import _vector_dtype
+            dtype = _vector_dtype(type(value).__name__)
+            if dtype is not None and size:
+                # copy the contiguous memory of a vector of a basic type
+                column = np.frombuffer(
+                    value.data(), dtype=dtype, count=size).copy()
+            else:
+                column = np.array([value[i] for i in range(size)])
+        self._columns[attr] = column
+        return column
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return self[attr]
+
+    def __getitem__(self, attr):
+        return self.column(attr)[self.index]
+
+    def __len__(self):
+        return len(self.index)
+
+    def _update(self, index):
+        self.__dict__['index'] = index
+        self.collection.selection = index.tolist()
+        return self
+
+    def select(self, mask):
+        """
+        Keep the objects where the boolean array ``mask`` is True
+        """
+        import numpy as np
+        return self._update(self.index[np.asarray(mask, dtype=bool)])
+
+    def mask(self, mask):
+        """
+        Remove the objects where the boolean array ``mask`` is True
+        """
+        import numpy as np
+        return self._update(self.index[~np.asarray(mask, dtype=bool)])
+
+    def sort(self, key, reverse=False):
+        """
+        Order the objects by the values of an attribute name or array
+        """
+        import numpy as np
+        if isinstance(key, string_types):
+            key = self[key]
+        key = np.asarray(key)
+        if reverse:
+            # keep the order of equal elements as in sorted(reverse=True)
+            order = len(key) - 1 - np.argsort(
+                key[::-1], kind='mergesort')[::-1]
+        else:
+            order = np.argsort(key, kind='mergesort')
+        return self._update(self.index[order])
+
+    def slice(self, start=0, stop=None, step=1):
+        return self._update(self.index[start:stop:step])
+
+
 def one_to_one_assoc(name, collection, index_branch):
     collection = deepcopy(collection)
     collection.reset()
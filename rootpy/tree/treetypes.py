@@ -83,73 +83,38 @@ class Scalar(object):
         self.reset()
 
 
-class BaseScalar(Scalar, array):
-    """This is the base class for all variables"""
-
-    def __init__(self, resetable=True):
-        array.__init__(self)
-        self.resetable = resetable
-
-    def reset(self):
-        """Reset the value to the default"""
-        if self.resetable:
-            self[0] = self.default
-
-    @property
-    def value(self):
-        """The current value"""
-        return self[0]
-
-    def set(self, value):
-        """Set the value"""
-        if isinstance(value, BaseScalar):
-            self[0] = self.convert(value.value)
-        else:
-            self[0] = self.convert(value)
-
-    def __str__(self):
-        return self.__repr__()
-
-    def __repr__(self):
-        return "{0}({1}) at {2}".format(
-            self.__class__.__name__, repr(self.value), hex(id(self)))
-
-    def __getitem__(self, i):
-        return array.__getitem__(self, 0)
-
-    def __setitem__(self, i, value):
-        if isinstance(value, BaseScalar):
-            array.__setitem__(self, 0, value.value)
-        else:
-            array.__setitem__(self, 0, value)
-
+class ScalarOperators(object):
+    """
+    Comparison, truth and arithmetic operators of scalar variables on their
+    ``value``
+    """
     def __lt__(self, value):
-        if isinstance(value, BaseScalar):
+        if isinstance(value, ScalarOperators):
             return self.value < value.value
         return self.value < value
 
     def __le__(self, value):
-        if isinstance(value, BaseScalar):
+        if isinstance(value, ScalarOperators):
             return self.value <= value.value
         return self.value <= value
 
     def __eq__(self, value):
-        if isinstance(value, BaseScalar):
+        if isinstance(value, ScalarOperators):
             return self.value == value.value
         return self.value == value
 
     def __ne__(self, value):
-        if isinstance(value, BaseScalar):
+        if isinstance(value, ScalarOperators):
             return self.value != value.value
         return self.value != value
 
     def __gt__(self, value):
-        if isinstance(value, BaseScalar):
+        if isinstance(value, ScalarOperators):
             return self.value > value.value
         return self.value > value
 
     def __ge__(self, value):
-        if isinstance(value, BaseScalar):
+        if isinstance(value, ScalarOperators):
             return self.value >= value.value
         return self.value >= value
 
@@ -159,7 +124,7 @@ class BaseScalar(Scalar, array):
     __bool__ = __nonzero__
 
     def __add__(self, other):
-        if isinstance(other, BaseScalar):
+        if isinstance(other, ScalarOperators):
             return self.value + other.value
         return self.value + other
 
@@ -167,7 +132,7 @@ class BaseScalar(Scalar, array):
         return self + other
 
     def __sub__(self, other):
-        if isinstance(other, BaseScalar):
+        if isinstance(other, ScalarOperators):
             return self.value - other.value
         return self.value - other
 
@@ -175,7 +140,7 @@ class BaseScalar(Scalar, array):
         return other - self.value
 
     def __mul__(self, other):
-        if isinstance(other, BaseScalar):
+        if isinstance(other, ScalarOperators):
             return self.value * other.value
         return self.value * other
 
@@ -183,7 +148,7 @@ class BaseScalar(Scalar, array):
         return self * other
 
     def __div__(self, other):
-        if isinstance(other, BaseScalar):
+        if isinstance(other, ScalarOperators):
             return self.value / other.value
         return self.value / other
 
@@ -191,6 +156,47 @@ class BaseScalar(Scalar, array):
         return other / self.value
 
 
+class BaseScalar(ScalarOperators, Scalar, array):
+    """This is the base class for all variables"""
+
+    def __init__(self, resetable=True):
+        array.__init__(self)
+        self.resetable = resetable
+
+    def reset(self):
+        """Reset the value to the default"""
+        if self.resetable:
+            self[0] = self.default
+
+    @property
+    def value(self):
+        """The current value"""
+        return self[0]
+
+    def set(self, value):
+        """Set the value"""
+        if isinstance(value, ScalarOperators):
+            self[0] = self.convert(value.value)
+        else:
+            self[0] = self.convert(value)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        return "{0}({1}) at {2}".format(
+            self.__class__.__name__, repr(self.value), hex(id(self)))
+
+    def __getitem__(self, i):
+        return array.__getitem__(self, 0)
+
+    def __setitem__(self, i, value):
+        if isinstance(value, ScalarOperators):
+            array.__setitem__(self, 0, value.value)
+        else:
+            array.__setitem__(self, 0, value)
+
+
 class Array(object):
 
     def __init__(self, resetable=True, length_name=None):
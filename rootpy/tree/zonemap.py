@@ -0,0 +1,273 @@
+# Copyright 2012 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements zone maps of trees: the minimum and maximum values
+and the number of NaN values of selected branches in each cluster of entries
+(see ``rootpy.tree.Tree.clusters``). When a selection is applied in
+``rootpy.tree.Tree.iter_batches`` the comparisons of branches with constants
+in the selection are checked against the zone map and the clusters that
+cannot contain a passing entry are skipped without being read. Zone maps are
+stored in a sidecar file next to the ROOT file and are ignored once the ROOT
+file changes.
+
+.. sourcecode:: python
+
+    >>> tree.build_zonemap(['run', 'pt'])
+    >>> for batch in tree.iter_batches(['pt', 'eta'],
+    ...                                selection='run>=1200&&pt>50'):
+    ...     pass
+"""
+from __future__ import absolute_import
+
+import os
+
+import numpy as np
+
+from ..extern.shortuuid import uuid
+from ..extern.six import string_types
+from .cache import cache_key
+from .cut import Cut
+from .expression import compile, Binary, Branch, Constant, Unary
+from .reader import read
+
+__all__ = [
+    'ZoneMap',
+]
+
+# the comparison with the operands swapped
+_SWAPPED = {
+    '<': '>',
+    '<=': '>=',
+    '>': '<',
+    '>=': '<=',
+    '==': '==',
+    '!=': '!=',
+}
+
+
+def _constant(node):
+    """
+    Return the value of a constant node or None
+    """
+    if isinstance(node, Constant):
+        return node.value
+    if isinstance(node, Unary) and node.op in ('-', '+'):
+        value = _constant(node.operand)
+        if value is not None and node.op == '-':
+            return -value
+        return value
+    return None
+
+
+def sidecar(tree):
+    """
+    Return the name of the zone map file of a tree next to its ROOT file or
+    None if the tree is not stored in a file
+    """
+    directory = tree.GetDirectory()
+    if not directory or not directory.GetFile():
+        return None
+    path = directory.GetPath().split(':', 1)[-1].strip('/')
+    name = '.'.join(filter(None, path.split('/') + [tree.GetName()]))
+    return '{0}.{1}.zonemap.npz'.format(
+        directory.GetFile().GetName(), name)
+
+
+class ZoneMap(object):
+    """
+    The minimum, maximum and number of NaN values of branches in each
+    cluster of entries of a tree
+
+    Parameters
+    ----------
+    starts, stops : numpy array
+        The first entry and the entry after the last entry of each cluster
+
+    mins, maxs, nans : dict
+        Arrays of the minimum and maximum values (ignoring NaN values) and
+        number of NaN values of each branch in each cluster
+
+    key : str, optional (default=None)
+        The identity of the file and tree (see ``rootpy.tree.cache``)
+    """
+    def __init__(self, starts, stops, mins, maxs, nans, key=None):
+        self.starts = starts
+        self.stops = stops
+        self.mins = mins
+        self.maxs = maxs
+        self.nans = nans
+        self.key = key
+
+    @classmethod
+    def build(cls, tree, branches):
+        """
+        Build the zone map of scalar branches of a tree by reading each
+        cluster of entries
+        """
+        if isinstance(branches, string_types):
+            branches = [branches]
+        branches = list(branches)
+        clusters = tree.clusters()
+        starts = np.array([start for start, stop in clusters],
+                          dtype=np.int64)
+        stops = np.array([stop for start, stop in clusters],
+                         dtype=np.int64)
+        mins, maxs, nans = {}, {}, {}
+        for i, (start, stop) in enumerate(clusters):
+            # only keep the statistics of each cluster
+            batch = read(tree, branches, start=start, stop=stop)
+            for name in branches:
+                values = batch[name]
+                if values.ndim != 1 or values.dtype.kind not in 'biuf':
+                    raise TypeError(
+                        "branch `{0}` is not a numeric scalar".format(name))
+                if name not in mins:
+                    dtype = values.dtype
+                    if dtype.kind == 'b':
+                        dtype = np.dtype(np.uint8)
+                    mins[name] = np.zeros(len(clusters), dtype=dtype)
+                    maxs[name] = np.zeros(len(clusters), dtype=dtype)
+                    nans[name] = np.zeros(len(clusters), dtype=np.int64)
+                dtype = mins[name].dtype
+                values = values.astype(dtype, copy=False)
+                if dtype.kind == 'f':
+                    nan = np.isnan(values)
+                    nans[name][i] = nan.sum()
+                    if nans[name][i]:
+                        values = values[~nan]
+                if len(values):
+                    mins[name][i] = values.min()
+                    maxs[name][i] = values.max()
+                elif dtype.kind == 'f':
+                    # the comparisons of clusters without values all fail
+                    mins[name][i] = maxs[name][i] = np.nan
+        for name in branches:
+            if name not in mins:
+                # a tree without clusters
+                mins[name] = np.zeros(0, dtype=np.float64)
+                maxs[name] = np.zeros(0, dtype=np.float64)
+                nans[name] = np.zeros(0, dtype=np.int64)
+        return cls(starts, stops, mins, maxs, nans,
+                   key=cache_key(tree, 'zonemap'))
+
+    @property
+    def branches(self):
+        return sorted(self.mins.keys())
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _compare(self, op, name, value):
+        lo, hi = self.mins[name], self.maxs[name]
+        if op == '<':
+            return lo < value
+        if op == '<=':
+            return lo <= value
+        if op == '>':
+            return hi > value
+        if op == '>=':
+            return hi >= value
+        if op == '==':
+            return (lo <= value) & (value <= hi)
+        # NaN values pass !=
+        return ~((lo == value) & (hi == value)) | (self.nans[name] > 0)
+
+    def _passing(self, node):
+        """
+        Return a mask of the clusters that may contain entries passing the
+        expression or None if every cluster may pass
+        """
+        if isinstance(node, Constant):
+            if node.value:
+                return None
+            return np.zeros(len(self), dtype=bool)
+        if not isinstance(node, Binary):
+            return None
+        if node.op == '&&':
+            left = self._passing(node.left)
+            right = self._passing(node.right)
+            if left is None:
+                return right
+            if right is None:
+                return left
+            return left & right
+        if node.op == '||':
+            left = self._passing(node.left)
+            right = self._passing(node.right)
+            if left is None or right is None:
+                return None
+            return left | right
+        if node.op not in _SWAPPED:
+            return None
+        op, branch, value = node.op, node.left, _constant(node.right)
+        if not isinstance(branch, Branch):
+            op, branch, value = (
+                _SWAPPED[node.op], node.right, _constant(node.left))
+        if (not isinstance(branch, Branch) or value is None or
+                branch.name not in self.mins):
+            return None
+        return self._compare(op, branch.name, value)
+
+    def ranges(self, selection, start=0, stop=None):
+        """
+        Return the list of (start, stop) ranges of the entries in
+        [start, stop) in the clusters that may contain entries passing the
+        selection. Adjacent clusters are merged into one range.
+        """
+        if stop is None:
+            stop = int(self.stops[-1]) if len(self) else 0
+        if start >= stop:
+            return []
+        try:
+            expression = compile(str(Cut(selection)))
+        except SyntaxError:
+            # only TTreeFormula can evaluate this selection
+            return [(start, stop)]
+        passing = self._passing(expression.root)
+        if passing is None:
+            return [(start, stop)]
+        ranges = []
+        for cluster_start, cluster_stop in zip(
+                self.starts[passing].tolist(), self.stops[passing].tolist()):
+            cluster_start = max(cluster_start, start)
+            cluster_stop = min(cluster_stop, stop)
+            if cluster_start >= cluster_stop:
+                continue
+            if ranges and ranges[-1][1] == cluster_start:
+                ranges[-1] = (ranges[-1][0], cluster_stop)
+            else:
+                ranges.append((cluster_start, cluster_stop))
+        return ranges
+
+    def save(self, filename):
+        """
+        Write the zone map to a .npz file
+        """
+        arrays = dict(starts=self.starts, stops=self.stops,
+                      key=np.array(self.key or ''),
+                      branches=np.array(self.branches))
+        for i, name in enumerate(self.branches):
+            arrays['min{0:d}'.format(i)] = self.mins[name]
+            arrays['max{0:d}'.format(i)] = self.maxs[name]
+            arrays['nan{0:d}'.format(i)] = self.nans[name]
+        # write to a temporary file first so that concurrent readers never
+        # see an incomplete file
+        tmpname = '{0}.{1}.tmp'.format(filename, uuid())
+        with open(tmpname, 'wb') as stream:
+            np.savez(stream, **arrays)
+        os.rename(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read a zone map written with ``save``
+        """
+        with np.load(filename) as archive:
+            mins, maxs, nans = {}, {}, {}
+            for i, name in enumerate(archive['branches'].tolist()):
+                mins[name] = archive['min{0:d}'.format(i)]
+                maxs[name] = archive['max{0:d}'.format(i)]
+                nans[name] = archive['nan{0:d}'.format(i)]
+            return cls(archive['starts'], archive['stops'],
+                       mins, maxs, nans,
+                       key=archive['key'].tolist() or None)